@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the hot paths of synapse.
+
+Each module in this package is a script which sets up a homeserver against a
+fresh database, drives one part of it and prints the results as JSON so that
+runs can be compared, e.g.:
+
+    python -m benchmarks.federation_send --transactions 200
+
+The benchmarks aren't run as part of the unit tests.
+"""
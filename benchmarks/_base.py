@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.server import HomeServer
+from synapse.storage.engines import create_engine
+from synapse.storage.prepare_database import prepare_database
+from synapse.util.logcontext import LoggingContext
+
+from twisted.internet import defer
+
+from mock import Mock
+from signedjson.key import generate_signing_key
+
+import functools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# The temporary sqlite databases created by setup_homeserver, which are
+# deleted once the benchmark has finished.
+_temporary_databases = []
+
+
+class BenchmarkHomeServer(HomeServer):
+    def get_db_conn(self, run_new_connection=True):
+        # Any param beginning with cp_ is a parameter for adbapi, and should
+        # not be passed to the database engine.
+        db_params = {
+            k: v for k, v in self.db_config.get("args", {}).items()
+            if not k.startswith("cp_")
+        }
+        db_conn = self.database_engine.module.connect(**db_params)
+
+        if run_new_connection:
+            self.database_engine.on_new_connection(db_conn)
+        return db_conn
+
+
+def add_database_arguments(parser):
+    parser.add_argument(
+        "--database", choices=["sqlite3", "psycopg2"], default="sqlite3",
+        help="The database engine to benchmark against.",
+    )
+    parser.add_argument(
+        "--database-args", type=json.loads, default={},
+        help="A JSON object of connection arguments for postgres, e.g."
+        ' \'{"database": "synapse_bench", "user": "synapse"}\'. The database'
+        " must be empty.",
+    )
+    parser.add_argument(
+        "--keep-database", action="store_true",
+        help="Don't delete the temporary sqlite database when the benchmark"
+        " finishes.",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="Log what synapse is doing to stderr.",
+    )
+
+
+def make_config(server_name):
+    """Build a config for a homeserver that doesn't talk to anything else."""
+    config = Mock()
+    config.server_name = server_name
+    config.signing_key = [generate_signing_key("bench")]
+    config.event_cache_size = 10000
+    config.enable_registration = True
+    config.macaroon_secret_key = "benchmark"
+    config.trusted_third_party_id_servers = []
+    config.room_invite_state_types = []
+    config.app_service_config_files = []
+    config.send_federation = False
+    config.use_frozen_dicts = False
+    config.federation_rc_window_size = 1000
+    config.federation_rc_sleep_limit = 1000000
+    config.federation_rc_sleep_delay = 0
+    config.federation_rc_reject_limit = 1000000
+    config.federation_rc_concurrent = 1000000
+    config.rc_messages_per_second = 1000000
+    config.rc_message_burst_count = 1000000
+    config.federation_connections_per_host = 10
+    config.federation_connection_idle_timeout = 240
+    config.perspectives = {}
+    config.user_agent_suffix = None
+    config.use_insecure_ssl_client_just_for_testing_do_not_use = False
+    return config
+
+
+def setup_homeserver(server_name, args, **kwargs):
+    """Create a homeserver with a freshly prepared database.
+
+    Args:
+        server_name (str)
+        args: The parsed command line arguments, see add_database_arguments.
+        **kwargs: Passed to the HomeServer.
+
+    Returns:
+        BenchmarkHomeServer
+    """
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.database == "sqlite3":
+        fd, path = tempfile.mkstemp(prefix="synapse-bench-", suffix=".db")
+        os.close(fd)
+        _temporary_databases.append(path)
+        db_args = {
+            "database": path,
+            "cp_min": 1,
+            "cp_max": 1,
+            "check_same_thread": False,
+        }
+    else:
+        db_args = {"cp_min": 5, "cp_max": 10}
+        db_args.update(args.database_args)
+
+    # Nothing is sent over federation, but the http client still wants one.
+    kwargs.setdefault("tls_server_context_factory", Mock())
+
+    db_config = {"name": args.database, "args": db_args}
+    database_engine = create_engine(db_config)
+    db_args["cp_openfun"] = database_engine.on_new_connection
+
+    hs = BenchmarkHomeServer(
+        server_name,
+        db_config=db_config,
+        config=make_config(server_name),
+        version_string="Synapse/benchmark",
+        database_engine=database_engine,
+        **kwargs
+    )
+
+    db_conn = hs.get_db_conn(run_new_connection=False)
+    prepare_database(db_conn, database_engine, config=None)
+    database_engine.on_new_connection(db_conn)
+    db_conn.commit()
+
+    hs.setup()
+    return hs
+
+
+def percentile(values, p):
+    """The value below which p percent of the sorted values fall."""
+    if not values:
+        return None
+    values = sorted(values)
+    index = int(round((len(values) - 1) * p / 100.))
+    return values[index]
+
+
+def summarise(durations_ms):
+    """Summarise a list of durations in milliseconds."""
+    return {
+        "count": len(durations_ms),
+        "mean_ms": sum(durations_ms) / len(durations_ms) if durations_ms else None,
+        "p50_ms": percentile(durations_ms, 50),
+        "p99_ms": percentile(durations_ms, 99),
+        "max_ms": max(durations_ms) if durations_ms else None,
+    }
+
+
+def instrument(obj, method_name, label, totals):
+    """Replace a method on an object with one that adds the time spent in it to
+    totals[label]. Works for methods that return deferreds, which are timed
+    until they resolve.
+    """
+    method = getattr(obj, method_name)
+    totals.setdefault(label, {"calls": 0, "total_ms": 0.})
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = time.time()
+
+        def record(result):
+            totals[label]["calls"] += 1
+            totals[label]["total_ms"] += (time.time() - start) * 1000.
+            return result
+
+        result = method(*args, **kwargs)
+        if isinstance(result, defer.Deferred):
+            return result.addBoth(record)
+        return record(result)
+
+    setattr(obj, method_name, timed)
+
+
+def write_results(result):
+    """Write the results of a benchmark to stdout as JSON."""
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+def run(main, args):
+    """Run main(args), which should return a deferred that resolves to a dict
+    of results, print the results as JSON and stop the reactor.
+    """
+    from twisted.internet import reactor
+
+    results = {}
+
+    @defer.inlineCallbacks
+    def go():
+        try:
+            with LoggingContext("benchmark"):
+                result = yield main(args)
+            results["result"] = result
+        except Exception:
+            logging.exception("Benchmark failed")
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(go)
+    reactor.run()
+
+    for path in _temporary_databases:
+        if args.keep_database:
+            sys.stderr.write("Kept database %s\n" % (path,))
+        else:
+            os.remove(path)
+
+    if "result" not in results:
+        sys.exit(1)
+
+    write_results(results["result"])
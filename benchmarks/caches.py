@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmarks for the caching primitives in synapse.util.caches.
+
+Times get, set, invalidate and, where supported, invalidate_many on caches
+holding different numbers of entries, and measures the memory used per entry
+by walking everything a full cache references and comparing it with an
+empty one.
+
+    python -m benchmarks.caches --sizes 100,1000,10000
+    python -m benchmarks.caches --only LruCache,cached
+
+Times are the best of --repeat runs, in microseconds per operation. The
+results are written to stdout as JSON.
+"""
+
+from benchmarks._base import write_results
+
+from synapse.util import Clock
+from synapse.util.caches.descriptors import (
+    CACHE_SIZE_FACTOR, Cache, cached, cachedList,
+)
+from synapse.util.caches.dictionary_cache import DictionaryCache
+from synapse.util.caches.expiringcache import ExpiringCache
+from synapse.util.caches.lrucache import LruCache
+from synapse.util.caches.stream_change_cache import StreamChangeCache
+from synapse.util.caches.treecache import TreeCache
+
+from twisted.internet import defer
+
+import argparse
+import gc
+import math
+import sys
+import time
+import types
+
+
+# The number of children under each parent key for the caches that support
+# invalidate_many.
+TREE_FANOUT = 10
+
+# Sets into a full cache evict an entry each time, which for some caches is
+# much more expensive, so fewer of them are timed.
+MAX_EVICTING_OPS = 1000
+
+
+def measure(setup, op, items, repeat):
+    """Time op(state, item) for each item, where state is a fresh setup() for
+    each of the repeats.
+
+    Returns:
+        dict: The number of ops and the best time per op in microseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        start = time.time()
+        for item in items:
+            op(state, item)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return {
+        "ops": len(items),
+        "us_per_op": best * 1e6 / len(items) if items else None,
+    }
+
+
+def _deep_size(obj, exclude):
+    """The total size of obj and everything it references, not counting the
+    objects whose ids are in `exclude`, modules or classes.
+    """
+    seen = set(exclude)
+    seen.update(
+        id(vars(module)) for module in sys.modules.values() if module is not None
+    )
+
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, types.ModuleType)):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return total
+
+
+def bytes_per_entry(setup, fill, size, shared):
+    """The memory a cache with `size` entries uses per entry, compared with an
+    empty cache. The keys and values, which are passed in `shared`, are owned
+    by whoever uses the cache so aren't counted.
+    """
+    exclude = set()
+    stack = list(shared)
+    while stack:
+        o = stack.pop()
+        if id(o) not in exclude:
+            exclude.add(id(o))
+            stack.extend(gc.get_referents(o))
+
+    empty = setup()
+    cache = setup()
+    fill(cache)
+
+    return float(_deep_size(cache, exclude) - _deep_size(empty, exclude)) / size
+
+
+def unscaled(size):
+    """The size to ask for so that a cache scaled by CACHE_SIZE_FACTOR ends up
+    holding `size` entries.
+    """
+    return int(math.ceil(size / CACHE_SIZE_FACTOR))
+
+
+def keys_for(size, tuples=False, tree=False):
+    """Keys that look like the user and room ids synapse caches are usually
+    keyed on.
+    """
+    if tree:
+        return [
+            ("!room%d:bench" % (i // TREE_FANOUT,), "@user%d:bench" % (i,))
+            for i in range(size)
+        ]
+    if tuples:
+        return [("@user%d:bench" % (i,),) for i in range(size)]
+    return ["@user%d:bench" % (i,) for i in range(size)]
+
+
+def bench_lru_cache(size, args, tree=False):
+    keys = keys_for(size, tree=tree)
+    missing = keys_for(size * 2, tree=tree)[size:]
+    value = object()
+
+    def new():
+        if tree:
+            return LruCache(size, keylen=2, cache_type=TreeCache)
+        return LruCache(size)
+
+    def full():
+        cache = new()
+        for key in keys:
+            cache[key] = value
+        return cache
+
+    results = {
+        "set": measure(new, lambda c, k: c.set(k, value), keys, args.repeat),
+        "set_evicting": measure(
+            full, lambda c, k: c.set(k, value),
+            missing[:MAX_EVICTING_OPS], args.repeat,
+        ),
+        "get_hit": measure(full, lambda c, k: c.get(k), keys, args.repeat),
+        "get_miss": measure(full, lambda c, k: c.get(k), missing, args.repeat),
+        "invalidate": measure(
+            full, lambda c, k: c.pop(k, None), keys, args.repeat,
+        ),
+        "bytes_per_entry": bytes_per_entry(
+            new, lambda c: [c.set(k, value) for k in keys], size,
+            [keys, value],
+        ),
+    }
+
+    if tree:
+        parents = sorted(set((k[0],) for k in keys))
+        results["invalidate_many"] = measure(
+            full, lambda c, k: c.del_multi(k), parents, args.repeat,
+        )
+        results["invalidate_many"]["entries_per_op"] = TREE_FANOUT
+
+    return results
+
+
+def bench_tree_cache(size, args):
+    keys = keys_for(size, tree=True)
+    missing = keys_for(size * 2, tree=True)[size:]
+    value = object()
+
+    def full():
+        cache = TreeCache()
+        for key in keys:
+            cache[key] = value
+        return cache
+
+    parents = sorted(set((k[0],) for k in keys))
+    invalidate_many = measure(
+        full, lambda c, k: c.pop(k, None), parents, args.repeat,
+    )
+    invalidate_many["entries_per_op"] = TREE_FANOUT
+
+    return {
+        "set": measure(TreeCache, lambda c, k: c.set(k, value), keys, args.repeat),
+        "get_hit": measure(full, lambda c, k: c.get(k), keys, args.repeat),
+        "get_miss": measure(full, lambda c, k: c.get(k), missing, args.repeat),
+        "invalidate": measure(
+            full, lambda c, k: c.pop(k, None), keys, args.repeat,
+        ),
+        "invalidate_many": invalidate_many,
+        "bytes_per_entry": bytes_per_entry(
+            TreeCache, lambda c: [c.set(k, value) for k in keys], size,
+            [keys, value],
+        ),
+    }
+
+
+def bench_cache(size, args, tree=False):
+    """The Cache class that backs the descriptors, which adds hit/miss
+    counting and the sequence checks on top of LruCache.
+    """
+    keys = keys_for(size, tuples=True, tree=tree)
+    missing = keys_for(size * 2, tuples=True, tree=tree)[size:]
+    value = object()
+
+    def new():
+        return Cache(
+            "bench", max_entries=size, keylen=2 if tree else 1, tree=tree,
+        )
+
+    def full():
+        cache = new()
+        for key in keys:
+            cache.prefill(key, value)
+        return cache
+
+    results = {
+        "set": measure(
+            new, lambda c, k: c.update(c.sequence, k, value), keys, args.repeat,
+        ),
+        "set_evicting": measure(
+            full, lambda c, k: c.update(c.sequence, k, value),
+            missing[:MAX_EVICTING_OPS], args.repeat,
+        ),
+        "get_hit": measure(full, lambda c, k: c.get(k), keys, args.repeat),
+        "get_miss": measure(
+            full, lambda c, k: c.get(k, None), missing, args.repeat,
+        ),
+        "invalidate": measure(
+            full, lambda c, k: c.invalidate(k), keys, args.repeat,
+        ),
+        "bytes_per_entry": bytes_per_entry(
+            new, lambda c: [c.prefill(k, value) for k in keys], size,
+            [keys, value],
+        ),
+    }
+
+    if tree:
+        parents = sorted(set((k[0],) for k in keys))
+        results["invalidate_many"] = measure(
+            full, lambda c, k: c.invalidate_many(k), parents, args.repeat,
+        )
+        results["invalidate_many"]["entries_per_op"] = TREE_FANOUT
+
+    return results
+
+
+def bench_dictionary_cache(size, args):
+    keys = keys_for(size)
+    missing = keys_for(size * 2)[size:]
+    value = {("m.room.member", "@user%d:bench" % (i,)): "$event" for i in range(10)}
+    dict_keys = value.keys()[:2]
+
+    def new():
+        return DictionaryCache("bench", max_entries=size)
+
+    def full():
+        cache = new()
+        for key in keys:
+            cache.update(cache.sequence, key, value, full=True)
+        return cache
+
+    return {
+        "set": measure(
+            new, lambda c, k: c.update(c.sequence, k, value, full=True),
+            keys, args.repeat,
+        ),
+        "set_partial": measure(
+            full, lambda c, k: c.update(c.sequence, k, {"extra": "$event"}),
+            keys, args.repeat,
+        ),
+        "get_hit": measure(full, lambda c, k: c.get(k), keys, args.repeat),
+        "get_hit_subset": measure(
+            full, lambda c, k: c.get(k, dict_keys), keys, args.repeat,
+        ),
+        "get_miss": measure(full, lambda c, k: c.get(k), missing, args.repeat),
+        "invalidate": measure(
+            full, lambda c, k: c.invalidate(k), keys, args.repeat,
+        ),
+        "bytes_per_entry": bytes_per_entry(
+            new,
+            lambda c: [
+                c.update(c.sequence, k, value, full=True) for k in keys
+            ],
+            size, [keys, value],
+        ),
+    }
+
+
+def bench_stream_change_cache(size, args):
+    entities = keys_for(size)
+    missing = keys_for(size * 2)[size:]
+    positions = range(1, size + 1)
+    batch = entities[::max(1, size // 100)][:100]
+
+    def new():
+        return StreamChangeCache("bench", 0, max_size=unscaled(size))
+
+    def full():
+        cache = new()
+        for pos, entity in zip(positions, entities):
+            cache.entity_has_changed(entity, pos)
+        return cache
+
+    changes = zip(positions, entities)
+    evicting = zip(range(size + 1, size * 2 + 1), missing)[:MAX_EVICTING_OPS]
+    half = size // 2
+
+    def change(cache, change):
+        pos, entity = change
+        cache.entity_has_changed(entity, pos)
+
+    return {
+        "set": measure(new, change, changes, args.repeat),
+        "set_evicting": measure(full, change, evicting, args.repeat),
+        "get_hit": measure(
+            full, lambda c, e: c.has_entity_changed(e, half), entities,
+            args.repeat,
+        ),
+        "get_miss": measure(
+            full, lambda c, e: c.has_entity_changed(e, half), missing,
+            args.repeat,
+        ),
+        "get_entities_changed": dict(
+            measure(
+                full, lambda c, _: c.get_entities_changed(batch, half),
+                range(100), args.repeat,
+            ),
+            entities_per_op=len(batch),
+        ),
+        "bytes_per_entry": bytes_per_entry(
+            new,
+            lambda c: [c.entity_has_changed(e, p) for p, e in changes],
+            size, [changes],
+        ),
+    }
+
+
+def bench_expiring_cache(size, args):
+    keys = keys_for(size)
+    missing = keys_for(size * 2)[size:]
+    value = object()
+    clock = Clock()
+
+    def new():
+        return ExpiringCache(
+            "bench", clock, max_len=size, expiry_ms=30 * 60 * 1000,
+        )
+
+    def full():
+        cache = new()
+        for key in keys:
+            cache[key] = value
+        return cache
+
+    def expire(cache, _):
+        # Make everything old enough to be pruned.
+        for entry in cache._cache.values():
+            entry.time = 0
+        cache._prune_cache()
+
+    def setitem(c, k):
+        c[k] = value
+
+    return {
+        "set": measure(new, setitem, keys, args.repeat),
+        "set_evicting": measure(
+            full, setitem, missing[:MAX_EVICTING_OPS], args.repeat,
+        ),
+        "get_hit": measure(full, lambda c, k: c.get(k), keys, args.repeat),
+        "get_miss": measure(full, lambda c, k: c.get(k), missing, args.repeat),
+        "invalidate_many": dict(
+            measure(full, expire, [None], args.repeat),
+            entries_per_op=size,
+        ),
+        "bytes_per_entry": bytes_per_entry(
+            new, lambda c: [setitem(c, k) for k in keys], size,
+            [keys, value],
+        ),
+    }
+
+
+def _make_store(size, tree):
+    """A class using the cache descriptors the way the storage classes do.
+    The function bodies return straight away, so this measures the overhead
+    of the descriptors themselves.
+    """
+    max_entries = unscaled(size)
+
+    if tree:
+        class Store(object):
+            @cached(max_entries=max_entries, num_args=2, tree=True)
+            def get_thing(self, room_id, user_id):
+                return defer.succeed(user_id)
+
+            @cachedList(
+                cached_method_name="get_thing", list_name="user_ids",
+                num_args=2, inlineCallbacks=False,
+            )
+            def get_things(self, room_id, user_ids):
+                return defer.succeed({u: u for u in user_ids})
+    else:
+        class Store(object):
+            @cached(max_entries=max_entries)
+            def get_thing(self, user_id):
+                return defer.succeed(user_id)
+
+            @cachedList(
+                cached_method_name="get_thing", list_name="user_ids",
+                inlineCallbacks=False,
+            )
+            def get_things(self, user_ids):
+                return defer.succeed({u: u for u in user_ids})
+
+    return Store()
+
+
+def bench_cached(size, args, tree=False):
+    keys = keys_for(size, tree=tree)
+    missing = keys_for(size * 2, tree=tree)[size:]
+
+    def call(store, key):
+        if tree:
+            return store.get_thing(*key)
+        return store.get_thing(key)
+
+    def new():
+        return _make_store(size, tree)
+
+    def full():
+        store = new()
+        for key in keys:
+            call(store, key)
+        return store
+
+    def invalidate(store, key):
+        store.get_thing.invalidate(key if tree else (key,))
+
+    # Bulk lookups of 100 keys at a time, split across the parents for the
+    # tree cache.
+    batches = [keys[i:i + 100] for i in range(0, len(keys), 100)]
+    missing_batches = [missing[i:i + 100] for i in range(0, len(missing), 100)]
+
+    def call_list(store, batch):
+        if tree:
+            return store.get_things(batch[0][0], [k[1] for k in batch])
+        return store.get_things(batch)
+
+    results = {
+        "set": measure(new, call, keys, args.repeat),
+        "set_evicting": measure(
+            full, call, missing[:MAX_EVICTING_OPS], args.repeat,
+        ),
+        "get_hit": measure(full, call, keys, args.repeat),
+        "invalidate": measure(full, invalidate, keys, args.repeat),
+        "list_get_hit": dict(
+            measure(full, call_list, batches, args.repeat),
+            entries_per_op=len(batches[0]),
+        ),
+        "list_get_miss": dict(
+            measure(full, call_list, missing_batches, args.repeat),
+            entries_per_op=len(missing_batches[0]),
+        ),
+        "bytes_per_entry": bytes_per_entry(
+            new, lambda s: [call(s, k) for k in keys], size, [keys],
+        ),
+    }
+
+    if tree:
+        parents = sorted(set((k[0],) for k in keys))
+        results["invalidate_many"] = dict(
+            measure(
+                full, lambda s, k: s.get_thing.invalidate_many(k), parents,
+                args.repeat,
+            ),
+            entries_per_op=TREE_FANOUT,
+        )
+
+    return results
+
+
+BENCHMARKS = {
+    "LruCache": bench_lru_cache,
+    "LruCache[TreeCache]": lambda size, args: bench_lru_cache(
+        size, args, tree=True,
+    ),
+    "TreeCache": bench_tree_cache,
+    "Cache": bench_cache,
+    "Cache[tree]": lambda size, args: bench_cache(size, args, tree=True),
+    "DictionaryCache": bench_dictionary_cache,
+    "StreamChangeCache": bench_stream_change_cache,
+    "ExpiringCache": bench_expiring_cache,
+    "cached": bench_cached,
+    "cached[tree]": lambda size, args: bench_cached(size, args, tree=True),
+}
+
+
+def main(args):
+    results = {}
+    for name in args.only:
+        results[name] = {
+            str(size): BENCHMARKS[name](size, args)
+            for size in args.sizes
+        }
+
+    return {
+        "sizes": args.sizes,
+        "repeat": args.repeat,
+        "cache_size_factor": CACHE_SIZE_FACTOR,
+        "results": results,
+    }
+
+
+def parse_list(value):
+    return [v for v in value.split(",") if v]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the per-operation cost of the caches.",
+    )
+    parser.add_argument(
+        "--sizes", default="100,1000,10000",
+        type=lambda v: [int(s) for s in parse_list(v)],
+        help="Comma separated numbers of entries to fill the caches with."
+        " Default: 100,1000,10000",
+    )
+    parser.add_argument(
+        "--only", type=parse_list, default=sorted(BENCHMARKS),
+        help="Comma separated caches to benchmark. One or more of %s."
+        % (", ".join(sorted(BENCHMARKS)),),
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="The number of times to run each measurement. The best is used.",
+    )
+
+    args = parser.parse_args()
+    for name in args.only:
+        if name not in BENCHMARKS:
+            parser.error("Unknown cache %r" % (name,))
+    if not args.sizes or min(args.sizes) < TREE_FANOUT:
+        parser.error("Sizes must be at least %d" % (TREE_FANOUT,))
+
+    write_results(main(args))
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load test for inbound federation transactions.
+
+A fake remote homeserver, with its own signing key, joins a room on a local
+homeserver and then sends it transactions of signed PDUs and EDUs. By default
+the transactions are PUT to /_matrix/federation/v1/send over HTTP, so the
+request signature checks and the TransportLayerServer are included, but
+--direct hands them straight to FederationServer.on_incoming_transaction.
+
+    python -m benchmarks.federation_send --transactions 200 \\
+        --pdus-per-transaction 10 --edus-per-transaction 5 \\
+        --edu-types typing,receipt
+
+The results are written to stdout as JSON.
+"""
+
+from benchmarks._base import (
+    add_database_arguments, instrument, run, setup_homeserver, summarise,
+)
+
+from synapse.api.constants import EventTypes, Membership
+from synapse.crypto.event_signing import (
+    add_hashes_and_signatures, compute_event_reference_hash,
+)
+from synapse.events.builder import EventBuilderFactory
+from synapse.federation.transport.server import TransportLayerServer
+from synapse.http.site import SynapseSite
+from synapse.types import Requester, UserID
+from synapse.util.async import concurrently_execute
+
+from twisted.internet import defer, reactor
+from twisted.web.client import Agent, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+
+from canonicaljson import encode_canonical_json
+from signedjson.key import generate_signing_key, get_verify_key
+from signedjson.sign import sign_json
+from unpaddedbase64 import encode_base64
+
+import argparse
+import json
+import StringIO
+import time
+
+
+LOCAL_SERVER_NAME = "local.bench"
+REMOTE_SERVER_NAME = "remote.bench"
+
+EDU_TYPES = ("typing", "receipt", "presence")
+
+
+class FakeRemoteServer(object):
+    """Builds signed events, EDUs and transactions as a remote homeserver
+    would, chaining each sender's messages off their previous event.
+    """
+
+    def __init__(self, server_name, clock):
+        self.server_name = server_name
+        self.clock = clock
+        self.signing_key = generate_signing_key("remote")
+        self.verify_key = get_verify_key(self.signing_key)
+        self.event_builder_factory = EventBuilderFactory(clock, server_name)
+        self._txn_id = 0
+
+    @property
+    def key_id(self):
+        return "%s:%s" % (self.signing_key.alg, self.signing_key.version)
+
+    def build_event(self, event_dict, prev_events, auth_events, depth):
+        """
+        Args:
+            event_dict (dict): The type, room_id, sender, content etc.
+            prev_events (list): List of (event_id, hashes) tuples.
+            auth_events (list): List of (event_id, hashes) tuples.
+            depth (int)
+        Returns:
+            FrozenEvent
+        """
+        builder = self.event_builder_factory.new(dict(event_dict))
+        builder.prev_events = prev_events
+        builder.auth_events = auth_events
+        builder.depth = depth
+        if "state_key" in event_dict:
+            builder.prev_state = []
+        add_hashes_and_signatures(builder, self.server_name, self.signing_key)
+        return builder.build()
+
+    def build_edu(self, edu_type, room_id, user_id, last_event_id):
+        now = self.clock.time_msec()
+        if edu_type == "typing":
+            content = {"room_id": room_id, "user_id": user_id, "typing": True}
+            edu_type = "m.typing"
+        elif edu_type == "receipt":
+            content = {
+                room_id: {
+                    "m.read": {
+                        user_id: {
+                            "event_ids": [last_event_id],
+                            "data": {"ts": now},
+                        },
+                    },
+                },
+            }
+            edu_type = "m.receipt"
+        else:
+            content = {
+                "push": [{
+                    "user_id": user_id,
+                    "presence": "online",
+                    "last_active_ago": 0,
+                }],
+            }
+            edu_type = "m.presence"
+
+        return {
+            "edu_type": edu_type,
+            "content": content,
+            "origin": self.server_name,
+            "destination": LOCAL_SERVER_NAME,
+        }
+
+    def build_transaction(self, events, edus):
+        self._txn_id += 1
+        now = self.clock.time_msec()
+        return {
+            "transaction_id": str(self._txn_id),
+            "origin": self.server_name,
+            "destination": LOCAL_SERVER_NAME,
+            "origin_server_ts": now,
+            "pdus": [event.get_pdu_json(now) for event in events],
+            "edus": edus,
+        }
+
+    def sign_request(self, method, uri, content):
+        request = sign_json({
+            "method": method,
+            "uri": uri,
+            "origin": self.server_name,
+            "destination": LOCAL_SERVER_NAME,
+            "content": content,
+        }, self.server_name, self.signing_key)
+
+        sig = request["signatures"][self.server_name][self.key_id]
+        return "X-Matrix origin=%s,key=\"%s\",sig=\"%s\"" % (
+            self.server_name, self.key_id, sig,
+        )
+
+
+def reference(event):
+    """The (event_id, hashes) used to refer to an event in prev_events and
+    auth_events.
+    """
+    name, digest = compute_event_reference_hash(event)
+    return (event.event_id, {name: encode_base64(digest)})
+
+
+class HttpSender(object):
+    """Sends transactions to the local TransportLayerServer over HTTP."""
+
+    def __init__(self, hs, remote):
+        self.remote = remote
+        site = SynapseSite(
+            "synapse.access.http.bench", "bench", {}, TransportLayerServer(hs),
+        )
+        self.port = reactor.listenTCP(0, site, interface="127.0.0.1")
+        self.agent = Agent(reactor)
+
+    @defer.inlineCallbacks
+    def send(self, transaction):
+        uri = "/_matrix/federation/v1/send/%s/" % (
+            transaction["transaction_id"],
+        )
+        auth = self.remote.sign_request("PUT", uri, transaction)
+
+        response = yield self.agent.request(
+            "PUT",
+            "http://127.0.0.1:%d%s" % (self.port.getHost().port, uri),
+            Headers({
+                "Authorization": [auth],
+                "Content-Type": ["application/json"],
+            }),
+            FileBodyProducer(StringIO.StringIO(
+                encode_canonical_json(transaction)
+            )),
+        )
+        body = yield readBody(response)
+        if response.code != 200:
+            raise Exception("Got %d: %s" % (response.code, body))
+        defer.returnValue(json.loads(body))
+
+    def stop(self):
+        return self.port.stopListening()
+
+
+class DirectSender(object):
+    """Hands transactions straight to the FederationServer."""
+
+    def __init__(self, hs):
+        self.federation = hs.get_replication_layer()
+
+    @defer.inlineCallbacks
+    def send(self, transaction):
+        _, response = yield self.federation.on_incoming_transaction(
+            transaction
+        )
+        defer.returnValue(response)
+
+    def stop(self):
+        pass
+
+
+@defer.inlineCallbacks
+def setup_room(hs, remote, senders):
+    """Creates a public room on the local server and has `senders` users from
+    the remote server join it.
+
+    Returns:
+        Deferred[(str, list)]: The room_id and a list of (user_id, event)
+        tuples giving each remote user and their join event.
+    """
+    store = hs.get_datastore()
+    auth = hs.get_auth()
+
+    local_user = UserID("alice", LOCAL_SERVER_NAME)
+    yield store.register(local_user.to_string(), "bench_token", None)
+    room_info = yield hs.get_handlers().room_creation_handler.create_room(
+        Requester(local_user, None, False), {"preset": "public_chat"},
+    )
+    room_id = room_info["room_id"]
+
+    remote.verify_key.time_added = hs.get_clock().time_msec()
+    yield hs.get_keyring().store_keys(
+        remote.server_name, remote.server_name,
+        {remote.key_id: remote.verify_key},
+    )
+
+    federation = hs.get_replication_layer()
+
+    joins = []
+    for i in range(senders):
+        user_id = "@bench%d:%s" % (i, remote.server_name)
+        event_dict = {
+            "type": EventTypes.Member,
+            "room_id": room_id,
+            "sender": user_id,
+            "state_key": user_id,
+            "content": {"membership": Membership.JOIN},
+        }
+
+        latest = yield store.get_latest_event_ids_and_hashes_in_room(room_id)
+        state = yield store.get_current_state(room_id)
+        state = {(e.type, e.state_key): e for e in state}
+
+        builder = remote.event_builder_factory.new(dict(event_dict))
+        auth_ids = auth.compute_auth_events(builder, state)
+        auth_events = yield store.add_event_hashes(auth_ids)
+
+        event = remote.build_event(
+            event_dict,
+            prev_events=[(e_id, hashes) for e_id, hashes, _ in latest],
+            auth_events=auth_events,
+            depth=max(depth for _, _, depth in latest) + 1,
+        )
+
+        transaction = remote.build_transaction([event], [])
+        _, response = yield federation.on_incoming_transaction(transaction)
+        if response["pdus"][event.event_id]:
+            raise Exception(
+                "Join was rejected: %r" % (response["pdus"][event.event_id],)
+            )
+
+        joins.append((user_id, event))
+
+    defer.returnValue((room_id, joins))
+
+
+@defer.inlineCallbacks
+def main(args):
+    hs = setup_homeserver(LOCAL_SERVER_NAME, args)
+    store = hs.get_datastore()
+    remote = FakeRemoteServer(REMOTE_SERVER_NAME, hs.get_clock())
+
+    room_id, joins = yield setup_room(hs, remote, args.concurrency)
+
+    create_event = yield store.get_current_state(room_id, EventTypes.Create, "")
+    power_event = yield store.get_current_state(
+        room_id, EventTypes.PowerLevels, ""
+    )
+    base_auth = [reference(create_event[0]), reference(power_event[0])]
+
+    # Only the time spent inside the transactions we're measuring counts.
+    breakdown = {}
+    federation = hs.get_replication_layer()
+    instrument(federation, "_check_sigs_and_hash", "signatures", breakdown)
+    instrument(hs.get_auth(), "check", "auth", breakdown)
+    instrument(store, "persist_event", "persistence", breakdown)
+    instrument(store, "persist_events", "persistence", breakdown)
+
+    if args.direct:
+        sender = DirectSender(hs)
+    else:
+        sender = HttpSender(hs, remote)
+
+    edu_types = args.edu_types.split(",")
+    durations = []
+    pdu_count = [0]
+    edu_count = [0]
+    errors = [0]
+
+    def streams():
+        # Each remote user sends its share of the transactions, one at a time,
+        # in its own chain of events.
+        per_stream = args.transactions // len(joins)
+        for index, (user_id, join_event) in enumerate(joins):
+            count = per_stream
+            if index < args.transactions % len(joins):
+                count += 1
+            yield (user_id, join_event, count)
+
+    @defer.inlineCallbacks
+    def send_stream(stream):
+        user_id, prev_event, count = stream
+        auth_events = base_auth + [reference(joins_by_user[user_id])]
+
+        for _ in range(count):
+            events = []
+            for _ in range(args.pdus_per_transaction):
+                prev_event = remote.build_event(
+                    {
+                        "type": EventTypes.Message,
+                        "room_id": room_id,
+                        "sender": user_id,
+                        "content": {"msgtype": "m.text", "body": "bench"},
+                    },
+                    prev_events=[reference(prev_event)],
+                    auth_events=auth_events,
+                    depth=prev_event.depth + 1,
+                )
+                events.append(prev_event)
+
+            edus = [
+                remote.build_edu(
+                    edu_types[i % len(edu_types)], room_id, user_id,
+                    prev_event.event_id,
+                )
+                for i in range(args.edus_per_transaction)
+            ]
+
+            transaction = remote.build_transaction(events, edus)
+
+            start = time.time()
+            response = yield sender.send(transaction)
+            durations.append((time.time() - start) * 1000.)
+
+            pdu_count[0] += len(events)
+            edu_count[0] += len(edus)
+            errors[0] += sum(1 for r in response["pdus"].values() if r)
+
+    joins_by_user = dict(joins)
+
+    start = time.time()
+    yield concurrently_execute(send_stream, list(streams()), args.concurrency)
+    elapsed = time.time() - start
+
+    yield sender.stop()
+
+    total_ms = sum(durations)
+    defer.returnValue({
+        "database": args.database,
+        "transport": "direct" if args.direct else "http",
+        "transactions": len(durations),
+        "pdus": pdu_count[0],
+        "edus": edu_count[0],
+        "rejected_pdus": errors[0],
+        "elapsed_s": elapsed,
+        "events_per_second": pdu_count[0] / elapsed if elapsed else None,
+        "transaction_latency": summarise(durations),
+        "breakdown": {
+            label: dict(
+                totals,
+                percent_of_transaction_time=(
+                    100. * totals["total_ms"] / total_ms if total_ms else None
+                ),
+            )
+            for label, totals in breakdown.items()
+        },
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure inbound federation transaction throughput.",
+    )
+    parser.add_argument(
+        "--transactions", type=int, default=100,
+        help="The number of transactions to send.",
+    )
+    parser.add_argument(
+        "--pdus-per-transaction", type=int, default=10,
+        help="The number of message PDUs in each transaction.",
+    )
+    parser.add_argument(
+        "--edus-per-transaction", type=int, default=0,
+        help="The number of EDUs in each transaction.",
+    )
+    parser.add_argument(
+        "--edu-types", default=",".join(EDU_TYPES),
+        help="Comma separated EDU types to cycle through. One or more of %s."
+        % (", ".join(EDU_TYPES),),
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1,
+        help="The number of remote users sending transactions in parallel,"
+        " each with their own chain of events.",
+    )
+    parser.add_argument(
+        "--direct", action="store_true",
+        help="Call FederationServer.on_incoming_transaction directly rather"
+        " than going over HTTP.",
+    )
+    add_database_arguments(parser)
+
+    args = parser.parse_args()
+    for edu_type in args.edu_types.split(","):
+        if edu_type not in EDU_TYPES:
+            parser.error("Unknown EDU type %r" % (edu_type,))
+
+    run(main, args)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark for client syncs by users in different numbers of rooms.
+
+A fresh database is populated with rooms, each with --room-size members and
+--messages-per-room messages, and one user per account shape who is in the
+first N of those rooms. For each of those users this times:
+
+    full_state_sync:            an initial /sync
+    incremental_sync_with_gap:  a /sync after --gap-messages have been sent
+    events:                     Notifier.get_events_for, as used by /events
+
+    python -m benchmarks.sync --account-shapes 10,100,1000 --room-size 20
+    python -m benchmarks.sync --database psycopg2 \\
+        --database-args '{"database": "synapse_bench"}'
+
+The results are written to stdout as JSON.
+"""
+
+from benchmarks._base import (
+    add_database_arguments, run, setup_homeserver, summarise,
+)
+
+from synapse.api.constants import EventTypes, Membership
+from synapse.api.filtering import DEFAULT_FILTER_COLLECTION
+from synapse.handlers.sync import SyncConfig
+from synapse.streams.config import PaginationConfig
+from synapse.types import Requester, UserID
+from synapse.util.async import concurrently_execute
+
+from twisted.internet import defer
+
+import argparse
+import logging
+import time
+
+
+logger = logging.getLogger("benchmarks.sync")
+
+SERVER_NAME = "bench"
+
+
+def requester_for(user_id):
+    return Requester(UserID.from_string(user_id), None, False)
+
+
+@defer.inlineCallbacks
+def populate(hs, args):
+    """Creates the rooms and users for each account shape.
+
+    Returns:
+        Deferred[(dict, list)]: A map from account shape to the user_id of
+        the user in that many rooms, and the list of room_ids.
+    """
+    store = hs.get_datastore()
+    handlers = hs.get_handlers()
+
+    creator = "@creator:%s" % (SERVER_NAME,)
+    members = [
+        "@member%d:%s" % (i, SERVER_NAME) for i in range(args.room_size - 1)
+    ]
+    shape_users = {
+        shape: "@user%d:%s" % (shape, SERVER_NAME)
+        for shape in args.account_shapes
+    }
+
+    for user_id in [creator] + members + shape_users.values():
+        yield store.register(user_id, "token_" + user_id, None)
+
+    room_ids = [None] * max(args.account_shapes)
+
+    @defer.inlineCallbacks
+    def create_room(index):
+        info = yield handlers.room_creation_handler.create_room(
+            requester_for(creator), {"preset": "public_chat"},
+        )
+        room_id = info["room_id"]
+        room_ids[index] = room_id
+
+        for user_id in members:
+            yield join(user_id, room_id)
+
+        for i in range(args.messages_per_room):
+            yield send_message(hs, [creator] + members, i, room_id)
+
+        if index % 100 == 99:
+            logger.info("Created %d rooms", index + 1)
+
+    @defer.inlineCallbacks
+    def join(user_id, room_id):
+        yield handlers.room_member_handler.update_membership(
+            requester_for(user_id), UserID.from_string(user_id), room_id,
+            Membership.JOIN,
+        )
+
+    yield concurrently_execute(create_room, range(len(room_ids)), 10)
+
+    for shape, user_id in shape_users.items():
+        for room_id in room_ids[:shape]:
+            yield join(user_id, room_id)
+
+    defer.returnValue((shape_users, room_ids))
+
+
+def send_message(hs, senders, index, room_id):
+    sender = senders[index % len(senders)]
+    message_handler = hs.get_handlers().message_handler
+    return message_handler.create_and_send_nonmember_event(
+        requester_for(sender),
+        {
+            "type": EventTypes.Message,
+            "room_id": room_id,
+            "sender": sender,
+            "content": {"msgtype": "m.text", "body": "Message %d" % (index,)},
+        },
+        ratelimit=False,
+    )
+
+
+@defer.inlineCallbacks
+def time_call(iterations, f, *args, **kwargs):
+    durations = []
+    for _ in range(iterations):
+        start = time.time()
+        yield f(*args, **kwargs)
+        durations.append((time.time() - start) * 1000.)
+    defer.returnValue(summarise(durations))
+
+
+@defer.inlineCallbacks
+def main(args):
+    hs = setup_homeserver(SERVER_NAME, args)
+
+    start = time.time()
+    shape_users, room_ids = yield populate(hs, args)
+    populate_s = time.time() - start
+
+    sync_handler = hs.get_handlers().sync_handler
+    notifier = hs.get_notifier()
+    event_sources = hs.get_event_sources()
+
+    since_token = yield event_sources.get_current_token()
+
+    # Spread the gap over the first rooms, which every user is in.
+    gap_rooms = room_ids[:min(args.account_shapes)]
+    senders = ["@creator:%s" % (SERVER_NAME,)]
+    for i in range(args.gap_messages):
+        yield send_message(hs, senders, i, gap_rooms[i % len(gap_rooms)])
+
+    results = {}
+    for shape in sorted(shape_users):
+        user_id = shape_users[shape]
+        user = UserID.from_string(user_id)
+        sync_config = SyncConfig(
+            user=user,
+            filter_collection=DEFAULT_FILTER_COLLECTION,
+            is_guest=False,
+            request_key=None,
+        )
+
+        full = yield time_call(
+            args.iterations, sync_handler.full_state_sync, sync_config, None,
+        )
+        incremental = yield time_call(
+            args.iterations, sync_handler.incremental_sync_with_gap,
+            sync_config, since_token,
+        )
+        events = yield time_call(
+            args.iterations, notifier.get_events_for, user,
+            PaginationConfig(from_token=since_token, limit=args.events_limit),
+            0,
+        )
+
+        results[str(shape)] = {
+            "rooms": shape,
+            "full_state_sync": full,
+            "incremental_sync_with_gap": incremental,
+            "events": events,
+        }
+
+    defer.returnValue({
+        "database": args.database,
+        "room_size": args.room_size,
+        "messages_per_room": args.messages_per_room,
+        "gap_messages": args.gap_messages,
+        "iterations": args.iterations,
+        "populate_s": populate_s,
+        "account_shapes": results,
+    })
+
+
+def parse_shapes(value):
+    shapes = sorted(set(int(v) for v in value.split(",")))
+    if not shapes or shapes[0] < 1:
+        raise argparse.ArgumentTypeError("Shapes must be positive integers")
+    return shapes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure sync and /events times for different account"
+        " shapes.",
+    )
+    parser.add_argument(
+        "--account-shapes", type=parse_shapes, default=[10, 100, 1000],
+        help="Comma separated numbers of rooms to put a user in. Rooms are"
+        " shared between the users, so the largest sets the number of rooms"
+        " created. Default: 10,100,1000",
+    )
+    parser.add_argument(
+        "--room-size", type=int, default=10,
+        help="The number of members in each room, not counting the users"
+        " being benchmarked.",
+    )
+    parser.add_argument(
+        "--messages-per-room", type=int, default=20,
+        help="The number of messages sent in each room before syncing.",
+    )
+    parser.add_argument(
+        "--gap-messages", type=int, default=50,
+        help="The number of messages sent between the initial and the"
+        " incremental sync.",
+    )
+    parser.add_argument(
+        "--events-limit", type=int, default=10,
+        help="The limit passed to get_events_for.",
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=5,
+        help="The number of times to time each request.",
+    )
+    add_database_arguments(parser)
+
+    args = parser.parse_args()
+    if args.room_size < 1:
+        parser.error("--room-size must be at least 1")
+
+    run(main, args)
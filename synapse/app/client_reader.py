@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import synapse
+
+from synapse.config._base import ConfigError
+from synapse.config.appservice import AppServiceConfig
+from synapse.config.database import DatabaseConfig
+from synapse.config.key import KeyConfig
+from synapse.config.logger import LoggingConfig
+from synapse.handlers.message import MessageHandler
+from synapse.handlers.presence import PresenceHandler
+from synapse.handlers.receipts import ReceiptsHandler
+from synapse.handlers.room import RoomContextHandler, RoomListHandler
+from synapse.http.server import JsonResource
+from synapse.http.site import SynapseSite
+from synapse.metrics.resource import MetricsResource, METRICS_PREFIX
+from synapse.replication.slave.storage.account_data import SlavedAccountDataStore
+from synapse.replication.slave.storage.appservice import (
+    SlavedApplicationServiceStore,
+)
+from synapse.replication.slave.storage.client_ips import SlavedClientIpStore
+from synapse.replication.slave.storage.directory import SlavedDirectoryStore
+from synapse.replication.slave.storage.presence import SlavedPresenceStore
+from synapse.replication.slave.storage.push_rule import SlavedPushRuleStore
+from synapse.replication.slave.storage.receipts import SlavedReceiptsStore
+from synapse.replication.slave.storage.registration import SlavedRegistrationStore
+from synapse.replication.slave.storage.room import SlavedRoomStore
+from synapse.replication.tcp.client import start_replication
+from synapse.rest.client.v1 import initial_sync, room
+from synapse.server import HomeServer
+from synapse.storage.engines import create_engine
+from synapse.storage.presence import UserPresenceState
+from synapse.util.async import sleep
+from synapse.util.httpresourcetree import create_resource_tree
+from synapse.util.logcontext import LoggingContext
+from synapse.util.manhole import manhole
+from synapse.util.rlimit import change_resource_limit
+from synapse.util.versionstring import get_version_string
+
+from twisted.internet import reactor, defer
+from twisted.web.resource import Resource
+
+from daemonize import Daemonize
+
+import sys
+import logging
+
+logger = logging.getLogger("synapse.app.client_reader")
+
+
+# The client endpoints served by the client reader. These only read from the
+# database, so any number of client readers can be run behind a load balancer.
+READER_SERVLET_CLASSES = (
+    room.RoomMessageListRestServlet,
+    room.RoomEventContext,
+    room.RoomInitialSyncRestServlet,
+    room.RoomStateRestServlet,
+    room.RoomMemberListRestServlet,
+    room.PublicRoomListRestServlet,
+    initial_sync.InitialSyncRestServlet,
+)
+
+
+class SlaveConfig(DatabaseConfig):
+    def read_config(self, config):
+        self.replication_url = config["replication_url"]
+        self.replication_tcp_host = config.get("replication_tcp_host")
+        self.replication_tcp_port = config.get("replication_tcp_port")
+        self.cache_warmup_rooms = config.get("cache_warmup_rooms", 0)
+        self.server_name = config["server_name"]
+        self.signing_key = self.read_signing_key(config["signing_key_path"])
+        self.macaroon_secret_key = config["macaroon_secret_key"]
+        self.use_insecure_ssl_client_just_for_testing_do_not_use = config.get(
+            "use_insecure_ssl_client_just_for_testing_do_not_use", False
+        )
+        self.user_agent_suffix = None
+        self.send_federation = False
+        self.listeners = config["listeners"]
+        self.soft_file_limit = config.get("soft_file_limit")
+        self.daemonize = config.get("daemonize")
+        self.pid_file = self.abspath(config.get("pid_file"))
+
+    read_signing_key = KeyConfig.read_signing_key.__func__
+
+    def default_config(self, server_name, **kwargs):
+        pid_file = self.abspath("client_reader.pid")
+        return """\
+        # Slave configuration
+
+        # The replication listener on the synapse to talk to.
+        #replication_url: https://localhost:{replication_port}/_synapse/replication
+
+        # Stream replication from a "replication" listener on the synapse
+        # instead of polling the replication_url.
+        #replication_tcp_host: localhost
+        #replication_tcp_port: {replication_tcp_port}
+
+        # Preload the recent events and current state of this many of the
+        # most active rooms on startup, before starting to replicate.
+        #cache_warmup_rooms: 100
+
+        server_name: "%(server_name)s"
+
+        # The signing key and macaroon secret of the synapse the worker is
+        # serving clients on behalf of.
+        #signing_key_path: "%(server_name)s.signing.key"
+        #macaroon_secret_key: <secret>
+
+        listeners: []
+        # Enable a client listener on the client reader
+        # - type: http
+        #   port: {http_port}
+        #   bind_address: ""
+        #   resources:
+        #    - names: ["client"]
+        # Enable a ssh manhole listener on the client reader
+        # - type: manhole
+        #   port: {manhole_port}
+        #   bind_address: 127.0.0.1
+        # Enable a metric listener on the client reader
+        # - type: http
+        #   port: {metrics_port}
+        #   bind_address: 127.0.0.1
+        #   resources:
+        #    - names: ["metrics"]
+        #      compress: False
+
+        report_stats: False
+
+        daemonize: False
+
+        pid_file: %(pid_file)s
+        """ % locals()
+
+
+class ClientReaderConfig(SlaveConfig, AppServiceConfig, LoggingConfig):
+    pass
+
+
+class ClientReaderSlavedStore(
+    SlavedDirectoryStore,
+    SlavedPushRuleStore,
+    SlavedReceiptsStore,
+    SlavedAccountDataStore,
+    SlavedPresenceStore,
+    SlavedApplicationServiceStore,
+    SlavedRegistrationStore,
+    SlavedRoomStore,
+    SlavedClientIpStore,
+):
+    pass
+
+
+class ClientReaderPresence(object):
+    """Reads the presence of users from the database.
+
+    The client reader only returns presence as part of the snapshots from the
+    initial sync APIs, so it doesn't bother tracking presence in memory.
+    """
+
+    def __init__(self, hs):
+        self.store = hs.get_datastore()
+        self.clock = hs.get_clock()
+
+    get_states = PresenceHandler.get_states.__func__
+
+    @defer.inlineCallbacks
+    def current_state_for_users(self, user_ids):
+        states = {
+            user_id: UserPresenceState.default(user_id)
+            for user_id in user_ids
+        }
+        res = yield self.store.get_presence_for_users(list(user_ids))
+        states.update({state.user_id: state for state in res})
+        defer.returnValue(states)
+
+
+class ClientReaderTyping(object):
+    """Tracks the position of the typing stream so that the client reader can
+    return stream tokens. The initial sync APIs don't include typing
+    notifications so there's no need to track who is typing.
+    """
+
+    def __init__(self, hs):
+        self._latest_room_serial = 0
+
+    def stream_positions(self):
+        return {"typing": self._latest_room_serial}
+
+    def process_replication(self, result):
+        stream = result.get("typing")
+        if stream:
+            self._latest_room_serial = int(stream["position"])
+
+
+class ClientReaderReceipts(object):
+    def __init__(self, hs):
+        self.store = hs.get_datastore()
+
+    get_receipts_for_room = ReceiptsHandler.get_receipts_for_room.__func__
+
+
+class ClientReaderFederation(object):
+    """Asks the main synapse to backfill rooms before they are paginated."""
+
+    def __init__(self, hs):
+        self.http_client = hs.get_simple_http_client()
+        self.backfill_url = hs.config.replication_url + "/backfill"
+
+    def maybe_backfill(self, room_id, current_depth):
+        return self.http_client.post_json_get_json(self.backfill_url, {
+            "room_id": room_id,
+            "current_depth": current_depth,
+        })
+
+
+class ClientReaderHandlers(object):
+    """The subset of the handlers that the read-only room servlets need.
+
+    Most of the handlers either write to the database or keep state that only
+    makes sense on the main synapse, so they aren't available here.
+    """
+
+    def __init__(self, hs):
+        self.message_handler = MessageHandler(hs)
+        self.room_context_handler = RoomContextHandler(hs)
+        self.room_list_handler = RoomListHandler(hs)
+        self.presence_handler = ClientReaderPresence(hs)
+        self.typing_notification_handler = ClientReaderTyping(hs)
+        self.receipts_handler = ClientReaderReceipts(hs)
+        self.federation_handler = ClientReaderFederation(hs)
+
+
+class ClientReaderServer(HomeServer):
+    def get_db_conn(self, run_new_connection=True):
+        # Any param beginning with cp_ is a parameter for adbapi, and should
+        # not be passed to the database engine.
+        db_params = {
+            k: v for k, v in self.db_config.get("args", {}).items()
+            if not k.startswith("cp_")
+        }
+        db_conn = self.database_engine.module.connect(**db_params)
+
+        if run_new_connection:
+            self.database_engine.on_new_connection(db_conn)
+        return db_conn
+
+    def setup(self):
+        logger.info("Setting up.")
+        self.datastore = ClientReaderSlavedStore(self.get_db_conn(), self)
+        logger.info("Finished setting up.")
+
+    def build_handlers(self):
+        return ClientReaderHandlers(self)
+
+    def _listen_http(self, listener_config):
+        port = listener_config["port"]
+        bind_address = listener_config.get("bind_address", "")
+        site_tag = listener_config.get("tag", port)
+        resources = {}
+        for res in listener_config["resources"]:
+            for name in res["names"]:
+                if name == "metrics":
+                    resources[METRICS_PREFIX] = MetricsResource(self)
+                elif name == "client":
+                    resource = JsonResource(self, canonical_json=False)
+                    for servletclass in READER_SERVLET_CLASSES:
+                        servletclass(self).register(resource)
+                    resources.update({
+                        "/_matrix/client/r0": resource,
+                        "/_matrix/client/unstable": resource,
+                        "/_matrix/client/v2_alpha": resource,
+                        "/_matrix/client/api/v1": resource,
+                    })
+
+        root_resource = create_resource_tree(resources, Resource())
+        reactor.listenTCP(
+            port,
+            SynapseSite(
+                "synapse.access.http.%s" % (site_tag,),
+                site_tag,
+                listener_config,
+                root_resource,
+            ),
+            interface=bind_address
+        )
+        logger.info("Synapse client reader now listening on port %d", port)
+
+    def start_listening(self):
+        for listener in self.config.listeners:
+            if listener["type"] == "http":
+                self._listen_http(listener)
+            elif listener["type"] == "manhole":
+                reactor.listenTCP(
+                    listener["port"],
+                    manhole(
+                        username="matrix",
+                        password="rabbithole",
+                        globals={"hs": self},
+                    ),
+                    interface=listener.get("bind_address", '127.0.0.1')
+                )
+            else:
+                logger.warn("Unrecognized listener type: %s", listener["type"])
+
+    @defer.inlineCallbacks
+    def replicate(self):
+        http_client = self.get_simple_http_client()
+        store = self.get_datastore()
+        replication_url = self.config.replication_url
+        typing_handler = self.get_handlers().typing_notification_handler
+
+        def stream_positions():
+            args = store.stream_positions()
+            args.update(typing_handler.stream_positions())
+            return args
+
+        @defer.inlineCallbacks
+        def process_replication(result):
+            yield store.process_replication(result)
+            typing_handler.process_replication(result)
+
+        if self.config.replication_tcp_port:
+            start_replication(
+                self, "client_reader", stream_positions, process_replication
+            )
+            return
+
+        while True:
+            try:
+                args = stream_positions()
+                args["timeout"] = 30000
+                result = yield http_client.get_json(replication_url, args=args)
+                yield process_replication(result)
+            except:
+                logger.exception("Error replicating from %r", replication_url)
+                yield sleep(5)
+
+
+def setup(config_options):
+    try:
+        config = ClientReaderConfig.load_config(
+            "Synapse client reader", config_options
+        )
+    except ConfigError as e:
+        sys.stderr.write("\n" + e.message + "\n")
+        sys.exit(1)
+
+    if not config:
+        sys.exit(0)
+
+    config.setup_logging()
+
+    database_engine = create_engine(config.database_config)
+
+    ss = ClientReaderServer(
+        config.server_name,
+        db_config=config.database_config,
+        config=config,
+        version_string=get_version_string("Synapse", synapse),
+        database_engine=database_engine,
+    )
+
+    ss.setup()
+    ss.start_listening()
+
+    change_resource_limit(ss.config.soft_file_limit)
+
+    @defer.inlineCallbacks
+    def start():
+        ss.get_datastore().start_profiling()
+        ss.get_state_handler().start_caching()
+
+        if ss.config.cache_warmup_rooms:
+            try:
+                yield ss.get_datastore().warm_caches(ss.config.cache_warmup_rooms)
+            except Exception:
+                logger.exception("Failed to warm caches")
+
+        ss.replicate()
+
+    reactor.callWhenRunning(start)
+
+    return ss
+
+
+if __name__ == '__main__':
+    with LoggingContext("main"):
+        ss = setup(sys.argv[1:])
+
+        if ss.config.daemonize:
+            def run():
+                with LoggingContext("run"):
+                    change_resource_limit(ss.config.soft_file_limit)
+                    reactor.run()
+
+            daemon = Daemonize(
+                app="synapse-client-reader",
+                pid=ss.config.pid_file,
+                action=run,
+                auto_close_fds=False,
+                verbose=True,
+                logger=logger,
+            )
+
+            daemon.start()
+        else:
+            reactor.run()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import synapse
+
+from synapse.api.urls import FEDERATION_PREFIX
+from synapse.server import HomeServer
+from synapse.config._base import ConfigError
+from synapse.config.database import DatabaseConfig
+from synapse.config.key import KeyConfig
+from synapse.config.logger import LoggingConfig
+from synapse.config.ratelimiting import RatelimitConfig
+from synapse.config.tls import TlsConfig
+from synapse.crypto import context_factory
+from synapse.federation.replication import ReplicationLayer
+from synapse.federation.transport import server as transport_server
+from synapse.handlers.federation import FederationHandler
+from synapse.handlers.profile import ProfileHandler
+from synapse.http.site import SynapseSite
+from synapse.metrics.resource import MetricsResource, METRICS_PREFIX
+from synapse.replication.slave.storage.events import SlavedEventStore
+from synapse.replication.slave.storage.keys import SlavedKeyStore
+from synapse.replication.tcp.client import start_replication
+from synapse.storage.engines import create_engine
+from synapse.storage import DataStore
+from synapse.util.async import sleep
+from synapse.util.httpresourcetree import create_resource_tree
+from synapse.util.logcontext import LoggingContext
+from synapse.util.manhole import manhole
+from synapse.util.rlimit import change_resource_limit
+from synapse.util.versionstring import get_version_string
+
+from twisted.internet import reactor, defer
+from twisted.web.resource import Resource
+
+from daemonize import Daemonize
+
+import sys
+import logging
+
+logger = logging.getLogger("synapse.app.federation_reader")
+
+
+# The federation endpoints served by the reader. Everything here only reads
+# from the database, apart from /send which is forwarded to the main synapse.
+READER_SERVLET_CLASSES = (
+    transport_server.FederationSendServlet,
+    transport_server.FederationEventServlet,
+    transport_server.FederationStateServlet,
+    transport_server.FederationBackfillServlet,
+    transport_server.FederationQueryServlet,
+    transport_server.FederationGetMissingEventsServlet,
+    transport_server.FederationEventAuthServlet,
+)
+
+
+class SlaveConfig(DatabaseConfig):
+    def read_config(self, config):
+        self.replication_url = config["replication_url"]
+        self.replication_tcp_host = config.get("replication_tcp_host")
+        self.replication_tcp_port = config.get("replication_tcp_port")
+        self.server_name = config["server_name"]
+        self.signing_key = self.read_signing_key(config["signing_key_path"])
+        self.perspectives = self.read_perspectives(
+            config.get("perspectives", {"servers": {}})
+        )
+        self.user_agent_suffix = None
+        self.send_federation = False
+        self.federation_connections_per_host = config.get(
+            "federation_connections_per_host", 10
+        )
+        self.federation_connection_idle_timeout = config.get(
+            "federation_connection_idle_timeout", 240
+        )
+        self.listeners = config["listeners"]
+        self.soft_file_limit = config.get("soft_file_limit")
+        self.daemonize = config.get("daemonize")
+        self.pid_file = self.abspath(config.get("pid_file"))
+
+    read_signing_key = KeyConfig.read_signing_key.__func__
+    read_perspectives = KeyConfig.read_perspectives.__func__
+
+    def default_config(self, server_name, **kwargs):
+        pid_file = self.abspath("federation_reader.pid")
+        return """\
+        # Slave configuration
+
+        # The replication listener on the synapse to talk to.
+        #replication_url: https://localhost:{replication_port}/_synapse/replication
+
+        # Stream replication from a "replication" listener on the synapse
+        # instead of polling the replication_url.
+        #replication_tcp_host: localhost
+        #replication_tcp_port: {replication_tcp_port}
+
+        server_name: "%(server_name)s"
+
+        # The signing key of the synapse the worker is serving on behalf of.
+        #signing_key_path: "%(server_name)s.signing.key"
+
+        # The number of idle connections to keep open to each remote server,
+        # and how many seconds to keep them open for.
+        #federation_connections_per_host: 10
+        #federation_connection_idle_timeout: 240
+
+        listeners: []
+        # Enable a federation listener on the federation reader.
+        # - type: http
+        #   port: {federation_port}
+        #   resources:
+        #    - names: ["federation"]
+        # Enable a ssh manhole listener on the federation reader.
+        # - type: manhole
+        #   port: {manhole_port}
+        #   bind_address: 127.0.0.1
+        # Enable a metric listener on the federation reader.
+        # - type: http
+        #   port: {metrics_port}
+        #   bind_address: 127.0.0.1
+        #   resources:
+        #    - names: ["metrics"]
+        #      compress: False
+
+        report_stats: False
+
+        daemonize: False
+
+        pid_file: %(pid_file)s
+
+        """ % locals()
+
+
+class FederationReaderSlaveConfig(
+    SlaveConfig, RatelimitConfig, TlsConfig, LoggingConfig
+):
+    pass
+
+
+class FederationReaderSlavedStore(SlavedEventStore, SlavedKeyStore):
+    get_profile_displayname = DataStore.get_profile_displayname.__func__
+    get_profile_avatar_url = DataStore.get_profile_avatar_url.__func__
+
+
+class FederationReaderReplicationLayer(ReplicationLayer):
+    """A ReplicationLayer that hands incoming transactions, and any queries it
+    can't answer itself, to the main synapse over replication.
+    """
+
+    def _forward(self, path, body):
+        http_client = self.hs.get_simple_http_client()
+        url = self.hs.config.replication_url + path
+        d = http_client.post_json_get_json(url, body)
+        d.addCallback(lambda result: (result["code"], result["response"]))
+        return d
+
+    def on_incoming_transaction(self, transaction_data):
+        return self._forward("/federation_send", {
+            "transaction": transaction_data,
+        })
+
+    def on_query_request(self, query_type, args):
+        if query_type in self.query_handlers:
+            return super(FederationReaderReplicationLayer, self).on_query_request(
+                query_type, args
+            )
+
+        return self._forward("/federation_query", {
+            "query_type": query_type,
+            "args": args,
+        })
+
+
+class FederationReaderTransportLayerServer(transport_server.TransportLayerServer):
+    def register_servlets(self):
+        for servletclass in READER_SERVLET_CLASSES:
+            servletclass(
+                handler=self.hs.get_replication_layer(),
+                authenticator=self.authenticator,
+                ratelimiter=self.ratelimiter,
+                server_name=self.hs.hostname,
+            ).register(self)
+
+
+class FederationReaderServer(HomeServer):
+
+    def get_db_conn(self, run_new_connection=True):
+        # Any param beginning with cp_ is a parameter for adbapi, and should
+        # not be passed to the database engine.
+        db_params = {
+            k: v for k, v in self.db_config.get("args", {}).items()
+            if not k.startswith("cp_")
+        }
+        db_conn = self.database_engine.module.connect(**db_params)
+
+        if run_new_connection:
+            self.database_engine.on_new_connection(db_conn)
+        return db_conn
+
+    def setup(self):
+        logger.info("Setting up.")
+        self.datastore = FederationReaderSlavedStore(self.get_db_conn(), self)
+
+        # These register themselves with the replication layer as the handler
+        # for PDU requests and for profile queries respectively.
+        FederationHandler(self)
+        ProfileHandler(self)
+        logger.info("Finished setting up.")
+
+    def build_replication_layer(self):
+        return FederationReaderReplicationLayer(
+            self, self.get_federation_transport_client()
+        )
+
+    def _listen_http(self, listener_config):
+        port = listener_config["port"]
+        bind_address = listener_config.get("bind_address", "")
+        site_tag = listener_config.get("tag", port)
+        resources = {}
+        for res in listener_config["resources"]:
+            for name in res["names"]:
+                if name == "metrics":
+                    resources[METRICS_PREFIX] = MetricsResource(self)
+                elif name == "federation":
+                    resources[FEDERATION_PREFIX] = (
+                        FederationReaderTransportLayerServer(self)
+                    )
+
+        root_resource = create_resource_tree(resources, Resource())
+        reactor.listenTCP(
+            port,
+            SynapseSite(
+                "synapse.access.http.%s" % (site_tag,),
+                site_tag,
+                listener_config,
+                root_resource,
+            ),
+            interface=bind_address
+        )
+        logger.info("Synapse federation_reader now listening on port %d", port)
+
+    def start_listening(self):
+        for listener in self.config.listeners:
+            if listener["type"] == "http":
+                self._listen_http(listener)
+            elif listener["type"] == "manhole":
+                reactor.listenTCP(
+                    listener["port"],
+                    manhole(
+                        username="matrix",
+                        password="rabbithole",
+                        globals={"hs": self},
+                    ),
+                    interface=listener.get("bind_address", '127.0.0.1')
+                )
+            else:
+                logger.warn("Unrecognized listener type: %s", listener["type"])
+
+    @defer.inlineCallbacks
+    def replicate(self):
+        http_client = self.get_simple_http_client()
+        store = self.get_datastore()
+        replication_url = self.config.replication_url
+
+        if self.config.replication_tcp_port:
+            start_replication(
+                self, "federation_reader", store.stream_positions,
+                store.process_replication,
+            )
+            return
+
+        while True:
+            try:
+                args = store.stream_positions()
+                args["timeout"] = 30000
+                result = yield http_client.get_json(replication_url, args=args)
+                yield store.process_replication(result)
+            except:
+                logger.exception("Error replicating from %r", replication_url)
+                yield sleep(5)
+
+
+def setup(config_options):
+    try:
+        config = FederationReaderSlaveConfig.load_config(
+            "Synapse federation reader", config_options
+        )
+    except ConfigError as e:
+        sys.stderr.write("\n" + e.message + "\n")
+        sys.exit(1)
+
+    if not config:
+        sys.exit(0)
+
+    config.setup_logging()
+
+    database_engine = create_engine(config.database_config)
+
+    tls_server_context_factory = context_factory.ServerContextFactory(config)
+
+    ss = FederationReaderServer(
+        config.server_name,
+        db_config=config.database_config,
+        tls_server_context_factory=tls_server_context_factory,
+        config=config,
+        version_string=get_version_string("Synapse", synapse),
+        database_engine=database_engine,
+    )
+
+    ss.setup()
+    ss.start_listening()
+
+    change_resource_limit(ss.config.soft_file_limit)
+
+    def start():
+        ss.replicate()
+        ss.get_datastore().start_profiling()
+        ss.get_state_handler().start_caching()
+
+    reactor.callWhenRunning(start)
+
+    return ss
+
+
+if __name__ == '__main__':
+    with LoggingContext("main"):
+        ss = setup(sys.argv[1:])
+
+        if ss.config.daemonize:
+            def run():
+                with LoggingContext("run"):
+                    change_resource_limit(ss.config.soft_file_limit)
+                    reactor.run()
+
+            daemon = Daemonize(
+                app="synapse-federation-reader",
+                pid=ss.config.pid_file,
+                action=run,
+                auto_close_fds=False,
+                verbose=True,
+                logger=logger,
+            )
+
+            daemon.start()
+        else:
+            reactor.run()
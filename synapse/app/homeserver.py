@@ -37,6 +37,7 @@ from twisted.application import service
 from twisted.web.resource import Resource, EncodingResourceWrapper
 from twisted.web.static import File
 from twisted.web.server import GzipEncoderFactory
+from synapse.http.endpoint import setup_server_cache_persistence
 from synapse.http.server import RootRedirect
 from synapse.rest.media.v0.content_repository import ContentRepoResource
 from synapse.rest.media.v1.media_repository import MediaRepositoryResource
@@ -51,7 +52,8 @@ from synapse.config.homeserver import HomeServerConfig
 from synapse.crypto import context_factory
 from synapse.util.logcontext import LoggingContext
 from synapse.metrics.resource import MetricsResource, METRICS_PREFIX
-from synapse.replication.resource import ReplicationResource, REPLICATION_PREFIX
+from synapse.replication.resource import REPLICATION_PREFIX
+from synapse.replication.tcp.server import ReplicationStreamProtocolFactory
 from synapse.federation.transport.server import TransportLayerServer
 
 from synapse.util.rlimit import change_resource_limit
@@ -163,7 +165,7 @@ class SynapseHomeServer(HomeServer):
                     resources[METRICS_PREFIX] = MetricsResource(self)
 
                 if name == "replication":
-                    resources[REPLICATION_PREFIX] = ReplicationResource(self)
+                    resources[REPLICATION_PREFIX] = self.get_replication_resource()
 
         if WEB_CLIENT_PREFIX in resources:
             root_resource = RootRedirect(WEB_CLIENT_PREFIX)
@@ -212,6 +214,16 @@ class SynapseHomeServer(HomeServer):
                     ),
                     interface=listener.get("bind_address", '127.0.0.1')
                 )
+            elif listener["type"] == "replication":
+                reactor.listenTCP(
+                    listener["port"],
+                    ReplicationStreamProtocolFactory(self),
+                    interface=listener.get("bind_address", '127.0.0.1')
+                )
+                logger.info(
+                    "Synapse now listening for replication on port %d",
+                    listener["port"],
+                )
             else:
                 logger.warn("Unrecognized listener type: %s", listener["type"])
 
@@ -330,11 +342,16 @@ def setup(config_options):
     hs.start_listening()
 
     def start():
+        hs.get_action_generator().start()
         hs.get_pusherpool().start()
         hs.get_state_handler().start_caching()
         hs.get_datastore().start_profiling()
         hs.get_datastore().start_doing_background_updates()
+        hs.get_datastore().start_pruning_push_actions()
         hs.get_replication_layer().start_get_pdu_cache()
+        if hs.config.send_federation:
+            hs.get_federation_sender().start_catching_up()
+            setup_server_cache_persistence(hs)
 
     reactor.callWhenRunning(start)
 
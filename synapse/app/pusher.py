@@ -25,6 +25,7 @@ from synapse.metrics.resource import MetricsResource, METRICS_PREFIX
 from synapse.replication.slave.storage.events import SlavedEventStore
 from synapse.replication.slave.storage.pushers import SlavedPusherStore
 from synapse.replication.slave.storage.receipts import SlavedReceiptsStore
+from synapse.replication.tcp.client import start_replication
 from synapse.storage.engines import create_engine
 from synapse.storage import DataStore
 from synapse.util.async import sleep
@@ -48,12 +49,23 @@ logger = logging.getLogger("synapse.app.pusher")
 class SlaveConfig(DatabaseConfig):
     def read_config(self, config):
         self.replication_url = config["replication_url"]
+        self.replication_tcp_host = config.get("replication_tcp_host")
+        self.replication_tcp_port = config.get("replication_tcp_port")
         self.server_name = config["server_name"]
         self.use_insecure_ssl_client_just_for_testing_do_not_use = config.get(
             "use_insecure_ssl_client_just_for_testing_do_not_use", False
         )
         self.user_agent_suffix = None
         self.start_pushers = True
+        self.push_gateway_connections_per_host = config.get(
+            "push_gateway_connections_per_host", 10
+        )
+        self.push_gateway_connection_idle_timeout = config.get(
+            "push_gateway_connection_idle_timeout", 240
+        )
+        self.pusher_startup_concurrency = config.get(
+            "pusher_startup_concurrency", 10
+        )
         self.listeners = config["listeners"]
         self.soft_file_limit = config.get("soft_file_limit")
         self.daemonize = config.get("daemonize")
@@ -67,8 +79,22 @@ class SlaveConfig(DatabaseConfig):
         # The replication listener on the synapse to talk to.
         #replication_url: https://localhost:{replication_port}/_synapse/replication
 
+        # Stream replication from a "replication" listener on the synapse
+        # instead of polling the replication_url.
+        #replication_tcp_host: localhost
+        #replication_tcp_port: {replication_tcp_port}
+
         server_name: "%(server_name)s"
 
+        # The number of idle connections to keep open to each push gateway,
+        # and how many seconds to keep them open for.
+        #push_gateway_connections_per_host: 10
+        #push_gateway_connection_idle_timeout: 240
+
+        # The number of pushers that catch up on missed notifications at once
+        # when starting.
+        #pusher_startup_concurrency: 10
+
         listeners: []
         # Enable a ssh manhole listener on the pusher.
         # - type: manhole
@@ -222,8 +248,11 @@ class PusherServer(HomeServer):
                     pushkey = row[8]
                     yield start_pusher(user_id, app_id, pushkey)
 
-            stream = results.get("events")
-            if stream:
+            # The push actions for new events are added by the main synapse
+            # after the events are persisted, so the pushers follow the
+            # push_actions stream rather than the events stream.
+            stream = results.get("push_actions")
+            if stream and stream["rows"]:
                 min_stream_id = stream["rows"][0][0]
                 max_stream_id = stream["position"]
                 preserve_fn(pusher_pool.on_new_notifications)(
@@ -240,16 +269,26 @@ class PusherServer(HomeServer):
                     min_stream_id, max_stream_id, affected_room_ids
                 )
 
+        @defer.inlineCallbacks
+        def process_replication(result):
+            yield store.process_replication(result)
+            poke_pushers(result)
+
+        if self.config.replication_tcp_port:
+            start_replication(
+                self, "pusher", store.stream_positions, process_replication
+            )
+            return
+
         while True:
             try:
                 args = store.stream_positions()
                 args["timeout"] = 30000
                 result = yield http_client.get_json(replication_url, args=args)
-                yield store.process_replication(result)
-                poke_pushers(result)
+                yield process_replication(result)
             except:
                 logger.exception("Error replicating from %r", replication_url)
-                sleep(30)
+                yield sleep(30)
 
 
 def setup(config_options):
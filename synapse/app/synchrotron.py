@@ -0,0 +1,605 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import synapse
+
+from synapse.api.constants import EventTypes, Membership
+from synapse.config._base import ConfigError
+from synapse.config.appservice import AppServiceConfig
+from synapse.config.database import DatabaseConfig
+from synapse.config.key import KeyConfig
+from synapse.config.logger import LoggingConfig
+from synapse.events import FrozenEvent
+from synapse.handlers.events import EventStreamHandler
+from synapse.handlers.presence import PresenceHandler
+from synapse.handlers.room_member import RoomMemberHandler
+from synapse.handlers.sync import SyncHandler
+from synapse.http.server import JsonResource
+from synapse.http.site import SynapseSite
+from synapse.metrics.resource import MetricsResource, METRICS_PREFIX
+from synapse.replication.slave.storage.account_data import SlavedAccountDataStore
+from synapse.replication.slave.storage.appservice import (
+    SlavedApplicationServiceStore,
+)
+from synapse.replication.slave.storage.client_ips import SlavedClientIpStore
+from synapse.replication.slave.storage.filtering import SlavedFilteringStore
+from synapse.replication.slave.storage.presence import SlavedPresenceStore
+from synapse.replication.slave.storage.push_rule import SlavedPushRuleStore
+from synapse.replication.slave.storage.receipts import SlavedReceiptsStore
+from synapse.replication.slave.storage.registration import SlavedRegistrationStore
+from synapse.replication.tcp.client import start_replication
+from synapse.rest.client.v1.events import EventStreamRestServlet
+from synapse.rest.client.v2_alpha import sync
+from synapse.server import HomeServer
+from synapse.storage.engines import create_engine
+from synapse.storage.presence import UserPresenceState
+from synapse.types import UserID
+from synapse.util.async import sleep
+from synapse.util.distributor import user_joined_room
+from synapse.util.httpresourcetree import create_resource_tree
+from synapse.util.logcontext import LoggingContext, preserve_fn
+from synapse.util.manhole import manhole
+from synapse.util.rlimit import change_resource_limit
+from synapse.util.stringutils import random_string
+from synapse.util.versionstring import get_version_string
+
+from twisted.internet import reactor, defer
+from twisted.web.resource import Resource
+
+from daemonize import Daemonize
+
+import sys
+import logging
+import contextlib
+import ujson as json
+
+logger = logging.getLogger("synapse.app.synchrotron")
+
+# How often to tell the main synapse which users are syncing against us, so
+# that it doesn't time them out while their syncs are still in progress.
+UPDATE_SYNCING_USERS_MS = 10 * 1000
+
+
+class SlaveConfig(DatabaseConfig):
+    def read_config(self, config):
+        self.replication_url = config["replication_url"]
+        self.replication_tcp_host = config.get("replication_tcp_host")
+        self.replication_tcp_port = config.get("replication_tcp_port")
+        self.cache_warmup_rooms = config.get("cache_warmup_rooms", 0)
+        self.server_name = config["server_name"]
+        self.signing_key = self.read_signing_key(config["signing_key_path"])
+        self.macaroon_secret_key = config["macaroon_secret_key"]
+        self.use_insecure_ssl_client_just_for_testing_do_not_use = config.get(
+            "use_insecure_ssl_client_just_for_testing_do_not_use", False
+        )
+        self.user_agent_suffix = None
+        self.send_federation = False
+        self.listeners = config["listeners"]
+        self.soft_file_limit = config.get("soft_file_limit")
+        self.daemonize = config.get("daemonize")
+        self.pid_file = self.abspath(config.get("pid_file"))
+
+    read_signing_key = KeyConfig.read_signing_key.__func__
+
+    def default_config(self, server_name, **kwargs):
+        pid_file = self.abspath("synchrotron.pid")
+        return """\
+        # Slave configuration
+
+        # The replication listener on the synapse to talk to.
+        #replication_url: https://localhost:{replication_port}/_synapse/replication
+
+        # Stream replication from a "replication" listener on the synapse
+        # instead of polling the replication_url.
+        #replication_tcp_host: localhost
+        #replication_tcp_port: {replication_tcp_port}
+
+        # Preload the recent events and current state of this many of the
+        # most active rooms on startup, before starting to replicate.
+        #cache_warmup_rooms: 100
+
+        server_name: "%(server_name)s"
+
+        # The signing key and macaroon secret of the synapse the worker is
+        # serving clients on behalf of.
+        #signing_key_path: "%(server_name)s.signing.key"
+        #macaroon_secret_key: <secret>
+
+        listeners: []
+        # Enable a /sync listener on the synchrotron
+        # - type: http
+        #   port: {http_port}
+        #   bind_address: ""
+        # Enable a ssh manhole listener on the synchrotron
+        # - type: manhole
+        #   port: {manhole_port}
+        #   bind_address: 127.0.0.1
+        # Enable a metric listener on the synchrotron
+        # - type: http
+        #   port: {metrics_port}
+        #   bind_address: 127.0.0.1
+        #   resources:
+        #    - names: ["metrics"]
+        #      compress: False
+
+        report_stats: False
+
+        daemonize: False
+
+        pid_file: %(pid_file)s
+        """ % locals()
+
+
+class SynchrotronConfig(SlaveConfig, AppServiceConfig, LoggingConfig):
+    pass
+
+
+class SynchrotronSlavedStore(
+    SlavedPushRuleStore,
+    SlavedReceiptsStore,
+    SlavedAccountDataStore,
+    SlavedPresenceStore,
+    SlavedApplicationServiceStore,
+    SlavedRegistrationStore,
+    SlavedFilteringStore,
+    SlavedClientIpStore,
+):
+    pass
+
+
+class SynchrotronPresence(object):
+    """Tracks the presence of users from the presence stream and tells the main
+    synapse which users are syncing against this process.
+    """
+
+    def __init__(self, hs):
+        self.hs = hs
+        self.http_client = hs.get_simple_http_client()
+        self.store = hs.get_datastore()
+        self.clock = hs.get_clock()
+        self.syncing_users_url = hs.config.replication_url + "/syncing_users"
+
+        active_presence = self.store.take_presence_startup_info()
+        self.user_to_current_state = {
+            state.user_id: state
+            for state in active_presence
+        }
+
+        # Keeps track of the number of *ongoing* syncs on this process.
+        self.user_to_num_current_syncs = {}
+
+        # An identifier for this process, so that the main synapse can tell
+        # which users stopped syncing if this process restarts.
+        self.process_id = random_string(16)
+        logger.info("Presence process_id is %r", self.process_id)
+
+        self._sending_sync = False
+        self._need_to_send_sync = False
+
+        self.clock.looping_call(
+            self._send_syncing_users_regularly, UPDATE_SYNCING_USERS_MS,
+        )
+
+        reactor.addSystemEventTrigger("before", "shutdown", self._on_shutdown)
+
+    def set_state(self, user, state):
+        # The main synapse brings users online when it's told that they have
+        # started syncing, so there's nothing more to do here.
+        pass
+
+    get_states = PresenceHandler.get_states.__func__
+    get_state = PresenceHandler.get_state.__func__
+    current_state_for_users = PresenceHandler.current_state_for_users.__func__
+    current_state_for_user = PresenceHandler.current_state_for_user.__func__
+
+    @defer.inlineCallbacks
+    def user_syncing(self, user_id, affect_presence):
+        if affect_presence:
+            curr_sync = self.user_to_num_current_syncs.get(user_id, 0)
+            self.user_to_num_current_syncs[user_id] = curr_sync + 1
+
+            # If the user wasn't already syncing then tell the main synapse
+            # straight away so that it can bring them online.
+            if not curr_sync:
+                preserve_fn(self._send_syncing_users_now)()
+
+        def _end():
+            # We don't tell the main synapse when users stop syncing straight
+            # away, as it gives them a grace period before timing them out
+            # anyway and they will usually start syncing again soon.
+            if affect_presence:
+                self.user_to_num_current_syncs[user_id] -= 1
+                if not self.user_to_num_current_syncs[user_id]:
+                    del self.user_to_num_current_syncs[user_id]
+
+        @contextlib.contextmanager
+        def _user_syncing():
+            try:
+                yield
+            finally:
+                _end()
+
+        defer.returnValue(_user_syncing())
+
+    @defer.inlineCallbacks
+    def _on_shutdown(self):
+        # Tell the main synapse that nobody is syncing against us any more.
+        self.user_to_num_current_syncs.clear()
+        yield self._send_syncing_users_now()
+
+    def _send_syncing_users_regularly(self):
+        # Only send an update if we aren't in the middle of sending one.
+        if not self._sending_sync:
+            preserve_fn(self._send_syncing_users_now)()
+
+    @defer.inlineCallbacks
+    def _send_syncing_users_now(self):
+        if self._sending_sync:
+            # Rather than race with the update we're already sending, send
+            # another update once it has finished.
+            self._need_to_send_sync = True
+            return
+
+        self._sending_sync = True
+        try:
+            while True:
+                self._need_to_send_sync = False
+                yield self.http_client.post_json_get_json(
+                    self.syncing_users_url, {
+                        "process_id": self.process_id,
+                        "syncing_users": self.user_to_num_current_syncs.keys(),
+                    }
+                )
+                if not self._need_to_send_sync:
+                    break
+        except:
+            logger.exception("Error sending syncing users to the master")
+        finally:
+            self._sending_sync = False
+
+    def process_replication(self, result):
+        stream = result.get("presence", {"rows": []})
+        for row in stream["rows"]:
+            (
+                position, user_id, state, last_active_ts,
+                last_federation_update_ts, last_user_sync_ts, status_msg,
+                currently_active
+            ) = row
+            self.user_to_current_state[user_id] = UserPresenceState(
+                user_id=user_id,
+                state=state,
+                last_active_ts=last_active_ts,
+                last_federation_update_ts=last_federation_update_ts,
+                last_user_sync_ts=last_user_sync_ts,
+                status_msg=status_msg,
+                currently_active=bool(currently_active),
+            )
+
+
+class SynchrotronTyping(object):
+    """Tracks which users are typing in which rooms from the typing stream."""
+
+    def __init__(self, hs):
+        self._latest_room_serial = 0
+        self._room_serials = {}
+        self._room_typing = {}
+
+    def stream_positions(self):
+        return {"typing": self._latest_room_serial}
+
+    def process_replication(self, result):
+        stream = result.get("typing")
+        if stream:
+            self._latest_room_serial = int(stream["position"])
+
+            for row in stream["rows"]:
+                position, room_id, typing_json = row
+                typing = json.loads(typing_json)
+                self._room_serials[room_id] = position
+                self._room_typing[room_id] = set(
+                    UserID.from_string(user_id) for user_id in typing
+                )
+
+
+class SynchrotronApplicationService(object):
+    def notify_interested_services(self, event):
+        # Application services are poked by the main synapse.
+        pass
+
+
+class SynchrotronHandlers(object):
+    """The subset of the handlers that the /sync and /events servlets need.
+
+    Most of the handlers either write to the database or keep state that only
+    makes sense on the main synapse, so they aren't available here.
+    """
+
+    def __init__(self, hs):
+        self.presence_handler = SynchrotronPresence(hs)
+        self.typing_notification_handler = SynchrotronTyping(hs)
+        self.room_member_handler = RoomMemberHandler(hs)
+        self.event_stream_handler = EventStreamHandler(hs)
+        self.sync_handler = SyncHandler(hs)
+        self.appservice_handler = SynchrotronApplicationService()
+
+
+class SynchrotronServer(HomeServer):
+    def get_db_conn(self, run_new_connection=True):
+        # Any param beginning with cp_ is a parameter for adbapi, and should
+        # not be passed to the database engine.
+        db_params = {
+            k: v for k, v in self.db_config.get("args", {}).items()
+            if not k.startswith("cp_")
+        }
+        db_conn = self.database_engine.module.connect(**db_params)
+
+        if run_new_connection:
+            self.database_engine.on_new_connection(db_conn)
+        return db_conn
+
+    def setup(self):
+        logger.info("Setting up.")
+        self.datastore = SynchrotronSlavedStore(self.get_db_conn(), self)
+        logger.info("Finished setting up.")
+
+    def build_handlers(self):
+        return SynchrotronHandlers(self)
+
+    def _listen_http(self, listener_config):
+        port = listener_config["port"]
+        bind_address = listener_config.get("bind_address", "")
+        site_tag = listener_config.get("tag", port)
+        resources = {}
+        for res in listener_config["resources"]:
+            for name in res["names"]:
+                if name == "metrics":
+                    resources[METRICS_PREFIX] = MetricsResource(self)
+                elif name == "client":
+                    resource = JsonResource(self, canonical_json=False)
+                    sync.register_servlets(self, resource)
+                    EventStreamRestServlet(self).register(resource)
+                    resources.update({
+                        "/_matrix/client/r0": resource,
+                        "/_matrix/client/unstable": resource,
+                        "/_matrix/client/v2_alpha": resource,
+                        "/_matrix/client/api/v1": resource,
+                    })
+
+        root_resource = create_resource_tree(resources, Resource())
+        reactor.listenTCP(
+            port,
+            SynapseSite(
+                "synapse.access.http.%s" % (site_tag,),
+                site_tag,
+                listener_config,
+                root_resource,
+            ),
+            interface=bind_address
+        )
+        logger.info("Synapse synchrotron now listening on port %d", port)
+
+    def start_listening(self):
+        for listener in self.config.listeners:
+            if listener["type"] == "http":
+                self._listen_http(listener)
+            elif listener["type"] == "manhole":
+                reactor.listenTCP(
+                    listener["port"],
+                    manhole(
+                        username="matrix",
+                        password="rabbithole",
+                        globals={"hs": self},
+                    ),
+                    interface=listener.get("bind_address", '127.0.0.1')
+                )
+            else:
+                logger.warn("Unrecognized listener type: %s", listener["type"])
+
+    @defer.inlineCallbacks
+    def replicate(self):
+        http_client = self.get_simple_http_client()
+        store = self.get_datastore()
+        replication_url = self.config.replication_url
+        notifier = self.get_notifier()
+        distributor = self.get_distributor()
+        presence_handler = self.get_handlers().presence_handler
+        typing_handler = self.get_handlers().typing_notification_handler
+
+        def notify_from_stream(
+            result, stream_name, stream_key, room=None, user=None
+        ):
+            stream = result.get(stream_name)
+            if stream:
+                position_index = stream["field_names"].index("position")
+                if room:
+                    room_index = stream["field_names"].index(room)
+                if user:
+                    user_index = stream["field_names"].index(user)
+
+                users = ()
+                rooms = ()
+                for row in stream["rows"]:
+                    position = row[position_index]
+
+                    if user:
+                        users = (row[user_index],)
+
+                    if room:
+                        rooms = (row[room_index],)
+
+                    notifier.on_new_event(
+                        stream_key, position, users=users, rooms=rooms
+                    )
+
+        @defer.inlineCallbacks
+        def notify(result):
+            stream = result.get("events")
+            if stream:
+                max_position = stream["position"]
+                for row in stream["rows"]:
+                    position = row[0]
+                    internal = json.loads(row[1])
+                    event_json = json.loads(row[2])
+                    event = FrozenEvent(event_json, internal_metadata_dict=internal)
+                    extra_users = ()
+                    if event.type == EventTypes.Member:
+                        extra_users = (event.state_key,)
+                        if (
+                            event.membership == Membership.JOIN
+                            and self.is_mine_id(event.state_key)
+                        ):
+                            # The notifier relies on this to start watching
+                            # the room for any of the user's ongoing syncs.
+                            yield user_joined_room(
+                                distributor,
+                                UserID.from_string(event.state_key),
+                                event.room_id,
+                            )
+                    notifier.on_new_room_event(
+                        event, position, max_position, extra_users
+                    )
+
+            stream = result.get("presence")
+            if stream:
+                for row in stream["rows"]:
+                    position, user_id = row[:2]
+                    rooms = yield store.get_rooms_for_user(user_id)
+                    observers = yield store.get_presence_list_observers_accepted(
+                        user_id
+                    )
+                    notifier.on_new_event(
+                        "presence_key", position,
+                        users=[user_id] + observers,
+                        rooms=[r.room_id for r in rooms],
+                    )
+
+            notify_from_stream(
+                result, "push_rules", "push_rules_key", user="user_id"
+            )
+            notify_from_stream(
+                result, "user_account_data", "account_data_key", user="user_id"
+            )
+            notify_from_stream(
+                result, "room_account_data", "account_data_key", user="user_id"
+            )
+            notify_from_stream(
+                result, "tag_account_data", "account_data_key", user="user_id"
+            )
+            notify_from_stream(
+                result, "receipts", "receipt_key", room="room_id"
+            )
+            notify_from_stream(
+                result, "typing", "typing_key", room="room_id"
+            )
+
+        def stream_positions():
+            args = store.stream_positions()
+            args.update(typing_handler.stream_positions())
+            return args
+
+        @defer.inlineCallbacks
+        def process_replication(result):
+            yield store.process_replication(result)
+            typing_handler.process_replication(result)
+            presence_handler.process_replication(result)
+            yield notify(result)
+
+        if self.config.replication_tcp_port:
+            start_replication(
+                self, "synchrotron", stream_positions, process_replication
+            )
+            return
+
+        while True:
+            try:
+                args = stream_positions()
+                args["timeout"] = 30000
+                result = yield http_client.get_json(replication_url, args=args)
+                yield process_replication(result)
+            except:
+                logger.exception("Error replicating from %r", replication_url)
+                yield sleep(5)
+
+
+def setup(config_options):
+    try:
+        config = SynchrotronConfig.load_config(
+            "Synapse synchrotron", config_options
+        )
+    except ConfigError as e:
+        sys.stderr.write("\n" + e.message + "\n")
+        sys.exit(1)
+
+    if not config:
+        sys.exit(0)
+
+    config.setup_logging()
+
+    database_engine = create_engine(config.database_config)
+
+    ss = SynchrotronServer(
+        config.server_name,
+        db_config=config.database_config,
+        config=config,
+        version_string=get_version_string("Synapse", synapse),
+        database_engine=database_engine,
+    )
+
+    ss.setup()
+    ss.start_listening()
+
+    change_resource_limit(ss.config.soft_file_limit)
+
+    @defer.inlineCallbacks
+    def start():
+        ss.get_datastore().start_profiling()
+        ss.get_state_handler().start_caching()
+
+        if ss.config.cache_warmup_rooms:
+            try:
+                yield ss.get_datastore().warm_caches(ss.config.cache_warmup_rooms)
+            except Exception:
+                logger.exception("Failed to warm caches")
+
+        ss.replicate()
+
+    reactor.callWhenRunning(start)
+
+    return ss
+
+
+if __name__ == '__main__':
+    with LoggingContext("main"):
+        ss = setup(sys.argv[1:])
+
+        if ss.config.daemonize:
+            def run():
+                with LoggingContext("run"):
+                    change_resource_limit(ss.config.soft_file_limit)
+                    reactor.run()
+
+            daemon = Daemonize(
+                app="synapse-synchrotron",
+                pid=ss.config.pid_file,
+                action=run,
+                auto_close_fds=False,
+                verbose=True,
+                logger=logger,
+            )
+
+            daemon.start()
+        else:
+            reactor.run()
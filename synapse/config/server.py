@@ -30,6 +30,35 @@ class ServerConfig(Config):
         self.use_frozen_dicts = config.get("use_frozen_dicts", True)
         self.start_pushers = config.get("start_pushers", True)
 
+        # The number of pushers to catch up on missed notifications at once
+        # when starting.
+        self.pusher_startup_concurrency = config.get(
+            "pusher_startup_concurrency", 10
+        )
+
+        # Whether to send federation traffic out in this process. This only
+        # applies to some federation traffic, and so shouldn't be used to
+        # "disable" federation
+        self.send_federation = config.get("send_federation", True)
+
+        # Limits for the pool of persistent connections used to send
+        # federation requests.
+        self.federation_connections_per_host = config.get(
+            "federation_connections_per_host", 10
+        )
+        self.federation_connection_idle_timeout = config.get(
+            "federation_connection_idle_timeout", 240
+        )
+
+        # Limits for the pool of persistent connections used to send
+        # notifications to push gateways.
+        self.push_gateway_connections_per_host = config.get(
+            "push_gateway_connections_per_host", 10
+        )
+        self.push_gateway_connection_idle_timeout = config.get(
+            "push_gateway_connection_idle_timeout", 240
+        )
+
         self.listeners = config.get("listeners", [])
 
         bind_port = config.get("bind_port")
@@ -148,6 +177,24 @@ class ServerConfig(Config):
         # hard limit.
         soft_file_limit: 0
 
+        # The number of idle connections to keep open to each remote server
+        # for sending federation requests, and how many seconds to keep them
+        # open for before closing them.
+        federation_connections_per_host: 10
+        federation_connection_idle_timeout: 240
+
+        # The number of idle connections to keep open to each push gateway,
+        # and how many seconds to keep them open for before closing them.
+        # Notifications for a user with a backlog are sent over up to this
+        # many connections at once.
+        push_gateway_connections_per_host: 10
+        push_gateway_connection_idle_timeout: 240
+
+        # The number of pushers that catch up on the notifications they
+        # missed while synapse was stopped at once. Pushers for the most
+        # recently active users are started first.
+        pusher_startup_concurrency: 10
+
         # List of ports that Synapse should listen on, their purpose and their
         # configuration.
         listeners:
@@ -206,6 +253,12 @@ class ServerConfig(Config):
           # - port: 9000
           #   bind_address: 127.0.0.1
           #   type: manhole
+
+          # Stream replication to workers over a persistent TCP connection on
+          # the given port, rather than them polling the replication resource.
+          # - port: 9092
+          #   bind_address: 127.0.0.1
+          #   type: replication
         """ % locals()
 
     def read_arguments(self, args):
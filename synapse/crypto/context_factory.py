@@ -13,13 +13,17 @@
 # limitations under the License.
 
 from twisted.internet import ssl
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
 from OpenSSL import SSL
 from twisted.internet._sslverify import _OpenSSLECCurve, _defaultCurveName
+from zope.interface import implementer
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+_CLOSE_NOTIFY = 0
+
 
 class ServerContextFactory(ssl.ContextFactory):
     """Factory for PyOpenSSL SSL contexts that are used to handle incoming
@@ -29,6 +33,14 @@ class ServerContextFactory(ssl.ContextFactory):
         self._context = SSL.Context(SSL.SSLv23_METHOD)
         self.configure_context(self._context, config)
 
+        # Connections to remote servers use a context of their own so that we
+        # can remember the TLS session of the last connection to each server
+        # and resume it next time, rather than doing a full handshake.
+        self._client_context = SSL.Context(SSL.SSLv23_METHOD)
+        self.configure_context(self._client_context, config)
+        self._client_context.set_info_callback(self._client_info_callback)
+        self._client_sessions = {}
+
     @staticmethod
     def configure_context(context, config):
         try:
@@ -47,3 +59,42 @@ class ServerContextFactory(ssl.ContextFactory):
 
     def getContext(self):
         return self._context
+
+    def client_connection_creator(self, destination):
+        """Returns an IOpenSSLClientConnectionCreator for connecting to the
+        given server which resumes the last TLS session used with it.
+        """
+        return _ClientConnectionCreator(self, destination)
+
+    def _client_connection_for_tls(self, destination):
+        connection = SSL.Connection(self._client_context, None)
+        connection.set_app_data(destination)
+
+        session = self._client_sessions.get(destination)
+        if session is not None:
+            connection.set_session(session)
+
+        return connection
+
+    def _client_info_callback(self, connection, where, ret):
+        # With TLS 1.3 the session ticket only arrives after the handshake,
+        # so we store the session again when the connection is closed.
+        closing = where & SSL.SSL_CB_ALERT and ret & 0xff == _CLOSE_NOTIFY
+        if where & SSL.SSL_CB_HANDSHAKE_DONE or closing:
+            try:
+                destination = connection.get_app_data()
+                self._client_sessions[destination] = connection.get_session()
+            except:
+                logger.exception("Failed to store TLS session")
+
+
+@implementer(IOpenSSLClientConnectionCreator)
+class _ClientConnectionCreator(object):
+    def __init__(self, context_factory, destination):
+        self._context_factory = context_factory
+        self._destination = destination
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        return self._context_factory._client_connection_for_tls(
+            self._destination
+        )
@@ -18,6 +18,8 @@ from synapse.api.errors import SynapseError, Codes
 from synapse.util.retryutils import get_retry_limiter
 from synapse.util import unwrapFirstError
 from synapse.util.async import ObservableDeferred
+from synapse.util.caches.descriptors import Cache, CACHE_SIZE_FACTOR
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.logcontext import (
     preserve_context_over_deferred, preserve_context_over_fn, PreserveLoggingContext,
     preserve_fn
@@ -40,13 +42,52 @@ import urllib
 import hashlib
 import logging
 
+import synapse.metrics
+
 
 logger = logging.getLogger(__name__)
 
+metrics = synapse.metrics.get_metrics_for(__name__)
+
+key_lookup_backoff_counter = metrics.register_counter("key_lookup_backoffs")
+
+# How long to wait before retrying a key lookup that failed, in milliseconds.
+# The interval is multiplied each time the lookup fails again, up to the max.
+MIN_KEY_LOOKUP_RETRY_INTERVAL = 60 * 1000
+MAX_KEY_LOOKUP_RETRY_INTERVAL = 60 * 60 * 1000
+KEY_LOOKUP_RETRY_MULTIPLIER = 2
+
+# The server names and key ids come from remote servers, so only remember the
+# most recent failures.
+MAX_KEY_LOOKUP_FAILURES = 10000
+
 
 KeyGroup = namedtuple("KeyGroup", ("server_name", "group_id", "key_ids"))
 
 
+def _verified_signature_cache_key(json_object, server_name, key_id):
+    """Returns the key used to remember that a signature on a JSON object has
+    already been verified.
+
+    The key covers everything that the signature covers, i.e. the canonical
+    JSON with the "signatures" and "unsigned" keys removed, so that a copy of
+    a signature attached to different content will never hit the cache.
+
+    Args:
+        json_object (dict): The signed JSON object.
+        server_name (str): The server that signed the object.
+        key_id (str): The id of the key used to sign the object.
+    Returns:
+        tuple: (server_name, key_id, digest)
+    """
+    signature = json_object["signatures"][server_name][key_id]
+    json_object_copy = dict(json_object)
+    del json_object_copy["signatures"]
+    json_object_copy.pop("unsigned", None)
+    digest = hashlib.sha256(encode_canonical_json(json_object_copy)).digest()
+    return (server_name, key_id, digest + str(signature))
+
+
 class Keyring(object):
     def __init__(self, hs):
         self.store = hs.get_datastore()
@@ -58,6 +99,39 @@ class Keyring(object):
 
         self.key_downloads = {}
 
+        # (server_name, key_id) -> (retry_ts, retry_interval) for keys we
+        # recently failed to fetch from anywhere.
+        self.key_lookup_failures = LruCache(MAX_KEY_LOOKUP_FAILURES)
+
+        # Keys waiting to be requested from the perspective servers, as a map
+        # of server_name -> set of key_ids, and a deferred that resolves with
+        # the results of the batched request.
+        self.pending_perspective_lookups = {}
+        self.pending_perspective_deferred = None
+
+        metrics.register_callback(
+            "key_lookups_in_flight",
+            lambda: len(self.key_downloads),
+        )
+        metrics.register_callback(
+            "pending_perspective_lookups",
+            lambda: len(self.pending_perspective_lookups),
+        )
+        metrics.register_callback(
+            "failed_key_lookups",
+            lambda: len(self.key_lookup_failures),
+        )
+
+        # The same event is often received several times, e.g. via /send,
+        # backfill and /state responses, so we remember which signatures we
+        # have already checked to avoid redoing the ed25519 verification.
+        self.verified_signatures = Cache(
+            name="verified_signatures",
+            max_entries=int(50000 * CACHE_SIZE_FACTOR),
+            keylen=3,
+            tree=True,
+        )
+
     def verify_json_for_server(self, server_name, json_object):
         return self.verify_json_objects_for_server(
             [(server_name, json_object)]
@@ -130,6 +204,12 @@ class Keyring(object):
 
             json_object = group_id_to_json[group.group_id]
 
+            cache_key = _verified_signature_cache_key(
+                json_object, server_name, key_id
+            )
+            if self.verified_signatures.get(cache_key, None):
+                return
+
             try:
                 verify_signed_json(json_object, server_name, verify_key)
             except:
@@ -141,6 +221,8 @@ class Keyring(object):
                     Codes.UNAUTHORIZED,
                 )
 
+            self.verified_signatures.prefill(cache_key, True)
+
         server_to_deferred = {
             server_name: defer.Deferred()
             for server_name, _ in server_and_json
@@ -189,6 +271,64 @@ class Keyring(object):
             for g_id in group_ids
         ]
 
+    def invalidate_verified_signatures(self, server_name, key_id=None):
+        """Forget any signatures we have verified for the given server, e.g.
+        because one of its keys has been replaced or revoked.
+
+        Args:
+            server_name (str): The server whose signatures to forget.
+            key_id (str|None): If given only forget signatures made with this
+                key, otherwise forget those made with any of the server's keys.
+        """
+        if key_id is None:
+            self.verified_signatures.invalidate_many((server_name,))
+        else:
+            self.verified_signatures.invalidate_many((server_name, key_id))
+
+    def _is_key_lookup_backing_off(self, server_name, key_ids):
+        """Checks if we recently failed to fetch all of the given keys and so
+        shouldn't try fetching them again yet.
+        """
+        now = self.clock.time_msec()
+        for key_id in key_ids:
+            retry_ts, _ = self.key_lookup_failures.get(
+                (server_name, key_id), (0, 0)
+            )
+            if retry_ts <= now:
+                return False
+
+        key_lookup_backoff_counter.inc()
+        return True
+
+    def _record_key_lookup_failure(self, server_name, key_ids):
+        """Records that we failed to fetch any of the given keys, so that we
+        back off before asking for them again.
+        """
+        now = self.clock.time_msec()
+        for key_id in key_ids:
+            _, retry_interval = self.key_lookup_failures.get(
+                (server_name, key_id), (0, 0)
+            )
+            if retry_interval:
+                retry_interval = min(
+                    retry_interval * KEY_LOOKUP_RETRY_MULTIPLIER,
+                    MAX_KEY_LOOKUP_RETRY_INTERVAL,
+                )
+            else:
+                retry_interval = MIN_KEY_LOOKUP_RETRY_INTERVAL
+
+            logger.info(
+                "Failed to find key %s for %s, not retrying for %dms",
+                key_id, server_name, retry_interval,
+            )
+            self.key_lookup_failures.set((server_name, key_id), (
+                now + retry_interval, retry_interval,
+            ))
+
+    def _record_key_lookup_success(self, server_name, key_ids):
+        for key_id in key_ids:
+            self.key_lookup_failures.pop((server_name, key_id), None)
+
     @defer.inlineCallbacks
     def wait_for_previous_lookups(self, server_names, server_to_deferred):
         """Waits for any previous key lookups for the given servers to finish.
@@ -236,34 +376,59 @@ class Keyring(object):
         def do_iterations():
             merged_results = {}
 
+            # Groups we still need to find a key for. Groups that have
+            # already been resolved (e.g. because they weren't signed with a
+            # supported algorithm) are skipped.
+            remaining_groups = {
+                group_id: group
+                for group_id, group in group_id_to_group.items()
+                if not group_id_to_deferred[group_id].called
+            }
+
             missing_keys = {}
-            for group in group_id_to_group.values():
+            for group in remaining_groups.values():
                 missing_keys.setdefault(group.server_name, set()).update(
                     group.key_ids
                 )
 
+            failed_groups = []
+
             for fn in key_fetch_fns:
                 results = yield fn(missing_keys.items())
-                merged_results.update(results)
+                for server_name, keys in results.items():
+                    merged_results.setdefault(server_name, {}).update(keys)
 
                 # We now need to figure out which groups we have keys for
                 # and which we don't
                 missing_groups = {}
-                for group in group_id_to_group.values():
+                for group_id, group in remaining_groups.items():
+                    server_keys = merged_results.get(group.server_name, {})
                     for key_id in group.key_ids:
-                        if key_id in merged_results[group.server_name]:
+                        if key_id in server_keys:
+                            del remaining_groups[group_id]
+                            self._record_key_lookup_success(
+                                group.server_name, group.key_ids
+                            )
                             with PreserveLoggingContext():
-                                group_id_to_deferred[group.group_id].callback((
-                                    group.group_id,
+                                group_id_to_deferred[group_id].callback((
+                                    group_id,
                                     group.server_name,
                                     key_id,
-                                    merged_results[group.server_name][key_id],
+                                    server_keys[key_id],
                                 ))
                             break
                     else:
-                        missing_groups.setdefault(
-                            group.server_name, []
-                        ).append(group)
+                        if self._is_key_lookup_backing_off(
+                            group.server_name, group.key_ids
+                        ):
+                            # We recently failed to fetch these keys, so
+                            # don't hammer remote servers by trying again.
+                            del remaining_groups[group_id]
+                            failed_groups.append(group)
+                        else:
+                            missing_groups.setdefault(
+                                group.server_name, []
+                            ).append(group)
 
                 if not missing_groups:
                     break
@@ -274,15 +439,24 @@ class Keyring(object):
                     )
                     for server_name, groups in missing_groups.items()
                 }
+            else:
+                # We've tried everything and still don't have keys for these
+                # groups, so back off before trying them again.
+                for group in remaining_groups.values():
+                    self._record_key_lookup_failure(
+                        group.server_name, group.key_ids
+                    )
+                    failed_groups.append(group)
 
-            for group in missing_groups.values():
-                group_id_to_deferred[group.group_id].errback(SynapseError(
-                    401,
-                    "No key for %s with id %s" % (
-                        group.server_name, group.key_ids,
-                    ),
-                    Codes.UNAUTHORIZED,
-                ))
+            for group in failed_groups:
+                with PreserveLoggingContext():
+                    group_id_to_deferred[group.group_id].errback(SynapseError(
+                        401,
+                        "No key for %s with id %s" % (
+                            group.server_name, group.key_ids,
+                        ),
+                        Codes.UNAUTHORIZED,
+                    ))
 
         def on_err(err):
             for deferred in group_id_to_deferred.values():
@@ -307,8 +481,61 @@ class Keyring(object):
 
         defer.returnValue(dict(res))
 
-    @defer.inlineCallbacks
     def get_keys_from_perspectives(self, server_name_and_key_ids):
+        """Fetches keys from the perspective servers.
+
+        Lookups requested in the same reactor tick are batched up into a
+        single query to each perspective server, rather than one query per
+        call.
+
+        Args:
+            server_name_and_key_ids (list): List of (server_name, key_ids)
+                pairs.
+        Returns:
+            Deferred: resolves to a dict of server_name -> key_id -> VerifyKey
+        """
+        if not self.perspective_servers:
+            return defer.succeed({})
+
+        server_names = set()
+        for server_name, key_ids in server_name_and_key_ids:
+            server_names.add(server_name)
+            self.pending_perspective_lookups.setdefault(
+                server_name, set()
+            ).update(key_ids)
+
+        if self.pending_perspective_deferred is None:
+            self.pending_perspective_deferred = ObservableDeferred(
+                defer.Deferred(), consumeErrors=True,
+            )
+            self.clock.call_later(0, self._do_pending_perspective_lookups)
+
+        d = self.pending_perspective_deferred.observe()
+        d.addCallback(lambda keys: {
+            server_name: server_keys
+            for server_name, server_keys in keys.items()
+            if server_name in server_names
+        })
+        return preserve_context_over_deferred(d)
+
+    def _do_pending_perspective_lookups(self):
+        server_name_and_key_ids = self.pending_perspective_lookups.items()
+        deferred = self.pending_perspective_deferred
+
+        self.pending_perspective_lookups = {}
+        self.pending_perspective_deferred = None
+
+        logger.debug(
+            "Requesting keys for %d servers from perspectives",
+            len(server_name_and_key_ids),
+        )
+
+        preserve_fn(self._get_keys_from_perspectives_now)(
+            server_name_and_key_ids
+        ).chainDeferred(deferred)
+
+    @defer.inlineCallbacks
+    def _get_keys_from_perspectives_now(self, server_name_and_key_ids):
         @defer.inlineCallbacks
         def get_key(perspective_name, perspective_keys):
             try:
@@ -370,9 +597,24 @@ class Keyring(object):
 
             defer.returnValue(keys)
 
+        @defer.inlineCallbacks
+        def get_key_or_none(server_name, key_ids):
+            # Don't let a single dead server fail the lookups for every other
+            # server in the batch.
+            try:
+                keys = yield get_key(server_name, key_ids)
+                defer.returnValue(keys)
+            except Exception as e:
+                logger.info(
+                    "Unable to get key %r for %r: %s %s",
+                    key_ids, server_name,
+                    type(e).__name__, str(e.message),
+                )
+                defer.returnValue({})
+
         results = yield defer.gatherResults(
             [
-                get_key(server_name, key_ids)
+                get_key_or_none(server_name, key_ids)
                 for server_name, key_ids in server_name_and_key_ids
             ],
             consumeErrors=True,
@@ -682,6 +924,11 @@ class Keyring(object):
             A deferred that completes when the keys are stored.
         """
         # TODO(markjh): Store whether the keys have expired.
+        # Any signatures we verified with a previous version of these keys
+        # can no longer be trusted.
+        for key_id in verify_keys:
+            self.invalidate_verified_signatures(server_name, key_id)
+
         yield defer.gatherResults(
             [
                 preserve_fn(self.store.store_server_verify_key)(
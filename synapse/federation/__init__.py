@@ -17,10 +17,9 @@
 """
 
 from .replication import ReplicationLayer
-from .transport.client import TransportLayerClient
 
 
 def initialize_http_replication(homeserver):
-    transport = TransportLayerClient(homeserver)
+    transport = homeserver.get_federation_transport_client()
 
     return ReplicationLayer(homeserver, transport)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A federation sender that forwards things to be sent across replication to
+a federation sender worker, rather than sending them itself.
+
+It is used in place of the TransactionQueue on the main process when
+`send_federation` is disabled. Everything that would have been queued up for
+sending is instead appended to the "federation" replication stream as a row of
+(position, type, content), where type is one of "pdu", "edu" or "failure".
+The worker feeds those rows into its own TransactionQueue with
+`process_rows_for_federation`.
+
+Rows are only kept in memory for a limited time, and are lost on restart, so
+PDUs are also added to the federation outbox before being put in the stream.
+The worker sends anything it missed from the outbox, while missed EDUs and
+failures are dropped.
+"""
+
+from synapse.api.errors import FederationError
+from synapse.events import FrozenEvent
+from synapse.util.logcontext import PreserveLoggingContext, preserve_fn
+
+from .transaction_queue import TransactionQueue
+from .units import Edu
+
+from twisted.internet import defer
+
+import synapse.metrics
+
+import bisect
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+metrics = synapse.metrics.get_metrics_for(__name__)
+
+# How long to keep rows around for the worker to fetch, in milliseconds.
+KEEP_ROWS_FOR_MS = 5 * 60 * 1000
+
+
+class FederationRemoteSendQueue(object):
+    """A drop in replacement for TransactionQueue that sends things across
+    replication instead.
+    """
+
+    def __init__(self, hs):
+        self.server_name = hs.hostname
+        self.clock = hs.get_clock()
+        self.notifier = hs.get_notifier()
+        self.store = hs.get_datastore()
+
+        # List of (position, ts, type, content), ordered by position.
+        self.rows = []
+
+        # HACK to get a position that is larger than any we used before a
+        # restart, so that the worker doesn't miss anything.
+        self.pos = int(self.clock.time_msec())
+
+        metrics.register_callback("queue_size", lambda: len(self.rows))
+
+        self.clock.looping_call(self._clear_queue, 30 * 1000)
+
+    def _clear_queue(self):
+        """Drops rows that are old enough that the worker should have already
+        fetched them.
+        """
+        horizon = self.clock.time_msec() - KEEP_ROWS_FOR_MS
+        index = 0
+        while index < len(self.rows) and self.rows[index][1] < horizon:
+            index += 1
+
+        if index:
+            logger.debug("Dropping %d old federation rows", index)
+            del self.rows[:index]
+
+    def _add_row(self, row_type, content):
+        self.pos += 1
+        self.rows.append((self.pos, self.clock.time_msec(), row_type, content))
+
+        with PreserveLoggingContext():
+            self.notifier.on_new_replication_data()
+
+    can_send_to = TransactionQueue.can_send_to.__func__
+
+    def enqueue_pdu(self, pdu, destinations, order):
+        destinations = [d for d in set(destinations) if self.can_send_to(d)]
+        if not destinations:
+            return
+
+        preserve_fn(self._persist_and_add_pdu)(pdu, destinations)
+
+    @defer.inlineCallbacks
+    def _persist_and_add_pdu(self, pdu, destinations):
+        persisted = False
+        try:
+            yield self.store.add_pdu_to_federation_outbox(
+                pdu.event_id, destinations,
+            )
+            persisted = True
+        except Exception:
+            logger.exception(
+                "Failed to add %s to the federation outbox", pdu.event_id,
+            )
+
+        self._add_row("pdu", {
+            "event": pdu.get_pdu_json(),
+            "internal": pdu.internal_metadata.get_dict(),
+            "destinations": destinations,
+            "in_outbox": persisted,
+        })
+
+    def enqueue_edu(self, edu):
+        self._add_row("edu", {
+            "origin": edu.origin,
+            "destination": edu.destination,
+            "edu_type": edu.edu_type,
+            "content": edu.content,
+        })
+
+    def enqueue_failure(self, failure, destination):
+        self._add_row("failure", {
+            "destination": destination,
+            "failure": failure.get_dict(),
+        })
+
+    def get_current_token(self):
+        return self.pos
+
+    def get_replication_rows(self, from_token, to_token, limit):
+        """Get rows to be sent over federation between the two tokens
+
+        Args:
+            from_token (int): Rows after this position are returned. -1 means
+                all rows we still have.
+            to_token (int): Rows up to and including this position are
+                returned.
+            limit (int): The maximum number of rows to return.
+
+        Returns:
+            list: of (position, type, content) tuples.
+        """
+        index = bisect.bisect_left(self.rows, (from_token + 1,))
+
+        rows = []
+        for position, _, row_type, content in self.rows[index:]:
+            if position > to_token or len(rows) >= limit:
+                break
+            rows.append((position, row_type, content))
+
+        return rows
+
+
+def process_rows_for_federation(transaction_queue, rows):
+    """Sends the rows from the "federation" replication stream using the given
+    TransactionQueue.
+
+    Args:
+        transaction_queue (TransactionQueue)
+        rows (list): The rows from the "federation" replication stream.
+    """
+    for position, row_type, content in rows:
+        if row_type == "pdu":
+            event = FrozenEvent(
+                content["event"], internal_metadata_dict=content["internal"],
+            )
+            transaction_queue.enqueue_outbox_pdu(
+                event, content["destinations"], position, content["in_outbox"],
+            )
+        elif row_type == "edu":
+            transaction_queue.enqueue_edu(Edu(**content))
+        elif row_type == "failure":
+            transaction_queue.enqueue_failure(
+                FederationError(**content["failure"]), content["destination"],
+            )
+        else:
+            logger.warn("Unrecognized federation row type: %r", row_type)
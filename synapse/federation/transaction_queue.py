@@ -21,7 +21,7 @@ from .units import Transaction
 
 from synapse.api.errors import HttpResponseException
 from synapse.util.logutils import log_function
-from synapse.util.logcontext import PreserveLoggingContext
+from synapse.util.logcontext import PreserveLoggingContext, preserve_fn
 from synapse.util.retryutils import (
     get_retry_limiter, NotRetryingDestination,
 )
@@ -34,6 +34,25 @@ logger = logging.getLogger(__name__)
 
 metrics = synapse.metrics.get_metrics_for(__name__)
 
+dropped_edus_counter = metrics.register_counter("dropped_edus")
+
+# The maximum number of PDUs we hold in memory for a destination. Any further
+# PDUs are only kept in the federation outbox in the database, and are loaded
+# from there once we have caught up.
+MAX_PENDING_PDUS_PER_DESTINATION = 1000
+
+# EDUs aren't persisted, so if a destination can't keep up we drop the oldest
+# ones rather than growing without limit.
+MAX_PENDING_EDUS_PER_DESTINATION = 1000
+
+# The maximum number of PDUs to load from the outbox for each transaction when
+# catching up a destination.
+MAX_OUTBOX_PDUS_PER_TRANSACTION = 50
+
+# How often to retry sending to destinations that have PDUs in the outbox, in
+# milliseconds.
+CATCH_UP_RETRY_INTERVAL = 60 * 1000
+
 
 class TransactionQueue(object):
     """This class makes sure we only have one transaction in flight at
@@ -76,10 +95,35 @@ class TransactionQueue(object):
             "pending_edus",
             lambda: sum(map(len, edus.values())),
         )
+        metrics.register_callback(
+            "pending_pdus_by_destination",
+            lambda: {(dest,): len(p) for dest, p in pdus.items()},
+            labels=["destination"],
+        )
+        metrics.register_callback(
+            "pending_edus_by_destination",
+            lambda: {(dest,): len(e) for dest, e in edus.items()},
+            labels=["destination"],
+        )
 
         # destination -> list of tuple(failure, deferred)
         self.pending_failures_by_dest = {}
 
+        # destination -> list of tuple(pending pdu, deferred, order) for PDUs
+        # that we failed to add to the federation outbox, and so have to be
+        # sent from memory even if the destination is catching up.
+        self.unpersisted_pdus_by_dest = {}
+
+        # Destinations with PDUs in the federation outbox that aren't in
+        # pending_pdus_by_dest, e.g. because we've restarted, we failed to
+        # send to the destination or it has too many PDUs queued up.
+        self.destinations_to_catch_up = set()
+
+        metrics.register_callback(
+            "catch_up_destinations",
+            lambda: len(self.destinations_to_catch_up),
+        )
+
         # HACK to get unique tx id
         self._next_txn_id = int(self._clock.time_msec())
 
@@ -118,27 +162,149 @@ class TransactionQueue(object):
         if not destinations:
             return
 
-        deferreds = []
+        preserve_fn(self._persist_and_enqueue_pdu)(pdu, destinations, order)
+
+    def enqueue_outbox_pdu(self, pdu, destinations, order, persisted):
+        """Queues up a PDU that the main synapse has already tried to add to
+        the federation outbox, when sending federation from a worker.
+
+        Args:
+            pdu (FrozenEvent)
+            destinations (list): The servers to send the PDU to.
+            order (int)
+            persisted (bool): Whether the PDU was added to the outbox.
+        """
+        destinations = set(
+            dest for dest in destinations if self.can_send_to(dest)
+        )
+        self._enqueue_pdu(pdu, destinations, order, persisted)
 
+    @defer.inlineCallbacks
+    def _persist_and_enqueue_pdu(self, pdu, destinations, order):
+        # We write the PDU to the outbox before queuing it up in memory, so
+        # that anything in pending_pdus_by_dest is also in the outbox.
+        persisted = False
+        try:
+            yield self.store.add_pdu_to_federation_outbox(
+                pdu.event_id, destinations,
+            )
+            persisted = True
+        except Exception:
+            logger.exception(
+                "Failed to add %s to the federation outbox", pdu.event_id,
+            )
+
+        self._enqueue_pdu(pdu, destinations, order, persisted)
+
+    def _enqueue_pdu(self, pdu, destinations, order, persisted):
         for destination in destinations:
-            deferred = defer.Deferred()
-            self.pending_pdus_by_dest.setdefault(destination, []).append(
-                (pdu, deferred, order)
+            pending_pdus = self.pending_pdus_by_dest.setdefault(destination, [])
+
+            if not persisted:
+                self.unpersisted_pdus_by_dest.setdefault(destination, []).append(
+                    (pdu, self._new_pending_deferred(destination, "pdu"), order)
+                )
+            elif (
+                destination in self.destinations_to_catch_up
+                or len(pending_pdus) >= MAX_PENDING_PDUS_PER_DESTINATION
+            ):
+                # We'll pick the PDU up from the outbox once we've sent
+                # everything before it.
+                self.destinations_to_catch_up.add(destination)
+            else:
+                pending_pdus.append(
+                    (pdu, self._new_pending_deferred(destination, "pdu"), order)
+                )
+
+            with PreserveLoggingContext():
+                self._attempt_new_transaction(destination)
+
+    def _new_pending_deferred(self, destination, kind):
+        deferred = defer.Deferred()
+
+        def log_failure(f):
+            logger.warn(
+                "Failed to send %s to %s: %s", kind, destination, f.value,
             )
 
-            def chain(failure):
-                if not deferred.called:
-                    deferred.errback(failure)
+        deferred.addErrback(log_failure)
+        return deferred
+
+    def start_catching_up(self):
+        """Starts sending any PDUs left in the federation outbox, e.g. from
+        before a restart, and periodically retries destinations we failed to
+        send to.
+        """
+        @defer.inlineCallbacks
+        def start():
+            yield self.catch_up_from_outbox()
+            self._clock.looping_call(
+                self._retry_catch_up_destinations, CATCH_UP_RETRY_INTERVAL,
+            )
+
+        preserve_fn(start)()
 
-            def log_failure(f):
-                logger.warn("Failed to send pdu to %s: %s", destination, f.value)
+    @defer.inlineCallbacks
+    def catch_up_from_outbox(self):
+        """Starts sending to every destination with PDUs in the federation
+        outbox, e.g. because the PDUs were added by another process.
+        """
+        destinations = yield self.store.get_destinations_with_federation_outbox()
+        self.destinations_to_catch_up.update(
+            d for d in destinations if self.can_send_to(d)
+        )
 
-            deferred.addErrback(log_failure)
+        logger.info(
+            "Catching up %d destinations from the federation outbox",
+            len(self.destinations_to_catch_up),
+        )
 
+        self._retry_catch_up_destinations()
+
+    def _retry_catch_up_destinations(self):
+        for destination in list(self.destinations_to_catch_up):
             with PreserveLoggingContext():
-                self._attempt_new_transaction(destination).addErrback(chain)
+                self._attempt_new_transaction(destination)
+
+    @defer.inlineCallbacks
+    def _get_pending_pdus_from_outbox(self, destination):
+        """Loads the oldest PDUs from the outbox for a destination that is
+        catching up.
+
+        Returns:
+            Deferred: resolves to a tuple of the list of
+            (pdu, deferred, order) to send, and the list of event_ids that
+            were loaded from the outbox.
+        """
+        event_ids = yield self.store.get_federation_outbox(
+            destination, MAX_OUTBOX_PDUS_PER_TRANSACTION,
+        )
+
+        if len(event_ids) < MAX_OUTBOX_PDUS_PER_TRANSACTION:
+            # New PDUs are queued in memory from now on, but PDUs that were
+            # only added to the outbox while we were reading it would be left
+            # there, so check again and keep catching up if there were any.
+            self.destinations_to_catch_up.discard(destination)
+            latest_event_ids = yield self.store.get_federation_outbox(
+                destination, MAX_OUTBOX_PDUS_PER_TRANSACTION,
+            )
+            if set(latest_event_ids) - set(event_ids):
+                self.destinations_to_catch_up.add(destination)
+
+        events = yield self.store.get_events(event_ids, allow_rejected=True)
+
+        pending_pdus = []
+        for order, event_id in enumerate(event_ids):
+            event = events.get(event_id)
+            if not event:
+                continue
+
+            event.unsigned.pop("invite_room_state", None)
+            pending_pdus.append(
+                (event, self._new_pending_deferred(destination, "pdu"), order)
+            )
 
-            deferreds.append(deferred)
+        defer.returnValue((pending_pdus, event_ids))
 
     # NO inlineCallbacks
     def enqueue_edu(self, edu):
@@ -148,9 +314,15 @@ class TransactionQueue(object):
             return
 
         deferred = defer.Deferred()
-        self.pending_edus_by_dest.setdefault(destination, []).append(
-            (edu, deferred)
-        )
+        pending_edus = self.pending_edus_by_dest.setdefault(destination, [])
+        pending_edus.append((edu, deferred))
+
+        if len(pending_edus) > MAX_PENDING_EDUS_PER_DESTINATION:
+            _, dropped = pending_edus.pop(0)
+            dropped_edus_counter.inc()
+            dropped.errback(RuntimeError(
+                "Dropped EDU as too many are queued for %s" % (destination,)
+            ))
 
         def chain(failure):
             if not deferred.called:
@@ -212,6 +384,7 @@ class TransactionQueue(object):
             return
 
         pending_pdus = self.pending_pdus_by_dest.pop(destination, [])
+        unpersisted_pdus = self.unpersisted_pdus_by_dest.pop(destination, [])
         pending_edus = self.pending_edus_by_dest.pop(destination, [])
         pending_failures = self.pending_failures_by_dest.pop(destination, [])
 
@@ -219,15 +392,57 @@ class TransactionQueue(object):
             logger.debug("TX [%s] len(pending_pdus_by_dest[dest]) = %d",
                          destination, len(pending_pdus))
 
-        if not pending_pdus and not pending_edus and not pending_failures:
-            logger.debug("TX [%s] Nothing to send", destination)
-            return
+        catching_up = destination in self.destinations_to_catch_up
+
+        if not (pending_pdus or unpersisted_pdus or pending_edus or
+                pending_failures):
+            if not catching_up:
+                logger.debug("TX [%s] Nothing to send", destination)
+                return
+
+        # Whether the PDUs we're sending are in the outbox and so should be
+        # removed from it once they've been sent.
+        pdus_in_outbox = catching_up or bool(pending_pdus)
+
+        # Whether we should immediately try sending another transaction once
+        # this one has finished. We don't if we failed to send this one, as
+        # anything left will be retried from the outbox later.
+        send_next = True
+
+        deferreds = []
 
         try:
             self.pending_transactions[destination] = 1
 
             logger.debug("TX [%s] _attempt_new_transaction", destination)
 
+            limiter = yield get_retry_limiter(
+                destination,
+                self._clock,
+                self.store,
+            )
+
+            if catching_up:
+                # Everything in pending_pdus is also in the outbox, so we
+                # just send the oldest PDUs in the outbox instead.
+                pending_pdus, outbox_event_ids = (
+                    yield self._get_pending_pdus_from_outbox(destination)
+                )
+            else:
+                outbox_event_ids = [x[0].event_id for x in pending_pdus]
+
+            # PDUs that aren't in the outbox won't be sent later, so they go
+            # out with this transaction.
+            pending_pdus = pending_pdus + unpersisted_pdus
+
+            if not pending_pdus and not pending_edus and not pending_failures:
+                logger.debug("TX [%s] Nothing to send", destination)
+                if outbox_event_ids:
+                    yield self.store.delete_from_federation_outbox(
+                        destination, outbox_event_ids,
+                    )
+                return
+
             # Sort based on the order field
             pending_pdus.sort(key=lambda t: t[2])
 
@@ -241,12 +456,6 @@ class TransactionQueue(object):
 
             txn_id = str(self._next_txn_id)
 
-            limiter = yield get_retry_limiter(
-                destination,
-                self._clock,
-                self.store,
-            )
-
             logger.debug(
                 "TX [%s] {%s} Attempting new transaction"
                 " (pdus: %d, edus: %d, failures: %d)",
@@ -330,6 +539,17 @@ class TransactionQueue(object):
 
             logger.debug("TX [%s] Marked as delivered", destination)
 
+            if pdus_in_outbox:
+                if code < 500:
+                    # The remote server has dealt with the PDUs, so we don't
+                    # need to send them again.
+                    yield self.store.delete_from_federation_outbox(
+                        destination, outbox_event_ids,
+                    )
+                else:
+                    self.destinations_to_catch_up.add(destination)
+                    send_next = False
+
             logger.debug("TX [%s] Yielding to callbacks...", destination)
 
             for deferred in deferreds:
@@ -346,20 +566,19 @@ class TransactionQueue(object):
                     pass
 
             logger.debug("TX [%s] Yielded to callbacks", destination)
-        except NotRetryingDestination:
+        except NotRetryingDestination as e:
             logger.info(
                 "TX [%s] not ready for retry yet - "
                 "dropping transaction for now",
                 destination,
             )
-        except RuntimeError as e:
-            # We capture this here as there as nothing actually listens
-            # for this finishing functions deferred.
-            logger.warn(
-                "TX [%s] Problem in _attempt_transaction: %s",
-                destination,
-                e,
-            )
+            if pdus_in_outbox:
+                self.destinations_to_catch_up.add(destination)
+            send_next = False
+
+            # PDUs that aren't in the outbox can't be retried later.
+            for _, deferred, _ in unpersisted_pdus:
+                deferred.errback(e)
         except Exception as e:
             # We capture this here as there as nothing actually listens
             # for this finishing functions deferred.
@@ -369,6 +588,10 @@ class TransactionQueue(object):
                 e,
             )
 
+            if pdus_in_outbox:
+                self.destinations_to_catch_up.add(destination)
+            send_next = False
+
             for deferred in deferreds:
                 if not deferred.called:
                     deferred.errback(e)
@@ -378,4 +601,5 @@ class TransactionQueue(object):
             self.pending_transactions.pop(destination, None)
 
             # Check to see if there is anything else to send.
-            self._attempt_new_transaction(destination)
+            if send_next:
+                self._attempt_new_transaction(destination)
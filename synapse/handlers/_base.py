@@ -19,9 +19,8 @@ from synapse.api.errors import LimitExceededError, SynapseError, AuthError
 from synapse.crypto.event_signing import add_hashes_and_signatures
 from synapse.api.constants import Membership, EventTypes
 from synapse.types import UserID, RoomAlias, Requester
-from synapse.push.action_generator import ActionGenerator
 
-from synapse.util.logcontext import PreserveLoggingContext, preserve_fn
+from synapse.util.logcontext import PreserveLoggingContext
 
 import logging
 
@@ -95,15 +94,10 @@ class BaseHandler(object):
             row["event_id"] for rows in forgotten for row in rows
         )
 
-        def allowed(event, user_id, is_peeking):
+        def visibility_for_event(event, state):
+            """Returns the history visibility that applies to the event, or
+            None if everyone can see it.
             """
-            Args:
-                event (synapse.events.EventBase): event to check
-                user_id (str)
-                is_peeking (bool)
-            """
-            state = event_id_to_state[event.event_id]
-
             # get the room_visibility at the time of the event.
             visibility_event = state.get((EventTypes.RoomHistoryVisibility, ""), None)
             if visibility_event:
@@ -116,7 +110,7 @@ class BaseHandler(object):
 
             # if it was world_readable, it's easy: everyone can read it
             if visibility == "world_readable":
-                return True
+                return None
 
             # Always allow history visibility events on boundaries. This is done
             # by setting the effective visibility to the least restrictive
@@ -133,31 +127,36 @@ class BaseHandler(object):
                 if old_priority < new_priority:
                     visibility = prev_visibility
 
-            # likewise, if the event is the user's own membership event, use
-            # the 'most joined' membership
-            membership = None
-            if event.type == EventTypes.Member and event.state_key == user_id:
-                membership = event.content.get("membership", None)
-                if membership not in MEMBERSHIP_PRIORITY:
-                    membership = "leave"
+            return visibility
 
-                prev_content = event.unsigned.get("prev_content", {})
-                prev_membership = prev_content.get("membership", None)
-                if prev_membership not in MEMBERSHIP_PRIORITY:
-                    prev_membership = "leave"
+        def own_membership(event):
+            """For a user's own membership event, use the 'most joined' of the
+            old and new membership.
+            """
+            membership = event.content.get("membership", None)
+            if membership not in MEMBERSHIP_PRIORITY:
+                membership = "leave"
 
-                new_priority = MEMBERSHIP_PRIORITY.index(membership)
-                old_priority = MEMBERSHIP_PRIORITY.index(prev_membership)
-                if old_priority < new_priority:
-                    membership = prev_membership
+            prev_content = event.unsigned.get("prev_content", {})
+            prev_membership = prev_content.get("membership", None)
+            if prev_membership not in MEMBERSHIP_PRIORITY:
+                prev_membership = "leave"
 
-            # otherwise, get the user's membership at the time of the event.
-            if membership is None:
-                membership_event = state.get((EventTypes.Member, user_id), None)
-                if membership_event:
-                    if membership_event.event_id not in event_id_forgotten:
-                        membership = membership_event.membership
+            new_priority = MEMBERSHIP_PRIORITY.index(membership)
+            old_priority = MEMBERSHIP_PRIORITY.index(prev_membership)
+            if old_priority < new_priority:
+                membership = prev_membership
 
+            return membership
+
+        def allowed(visibility, membership, is_peeking):
+            """
+            Args:
+                visibility (str): The history visibility for the event.
+                membership (str|None): The user's membership at the time of the
+                    event.
+                is_peeking (bool)
+            """
             # if the user was a member of the room at the time of the event,
             # they can see it.
             if membership == Membership.JOIN:
@@ -182,14 +181,48 @@ class BaseHandler(object):
                 # we don't know when they left.
                 return not is_peeking
 
-        defer.returnValue({
-            user_id: [
-                event
-                for event in events
-                if allowed(event, user_id, is_peeking)
-            ]
-            for user_id, is_peeking in user_tuples
-        })
+        results = {user_id: [] for user_id, _ in user_tuples}
+
+        for event in events:
+            state = event_id_to_state[event.event_id]
+
+            visibility = visibility_for_event(event, state)
+            if visibility is None:
+                for user_id, _ in user_tuples:
+                    results[user_id].append(event)
+                continue
+
+            own_membership_user_id = None
+            if event.type == EventTypes.Member:
+                own_membership_user_id = event.state_key
+
+            # Whether the event is visible only depends on the user's
+            # membership at the time of the event and whether they're peeking,
+            # so it is only worked out once for each combination of those.
+            allowed_by_class = {}
+
+            for user_id, is_peeking in user_tuples:
+                membership = None
+                if user_id == own_membership_user_id:
+                    membership = own_membership(event)
+                else:
+                    # otherwise, get the user's membership at the time of the
+                    # event.
+                    membership_event = state.get((EventTypes.Member, user_id), None)
+                    if membership_event:
+                        if membership_event.event_id not in event_id_forgotten:
+                            membership = membership_event.membership
+
+                key = (membership, is_peeking)
+                is_allowed = allowed_by_class.get(key, None)
+                if is_allowed is None:
+                    is_allowed = allowed(visibility, membership, is_peeking)
+                    allowed_by_class[key] = is_allowed
+
+                if is_allowed:
+                    results[user_id].append(event)
+
+        defer.returnValue(results)
 
     @defer.inlineCallbacks
     def _filter_events_for_client(self, user_id, events, is_peeking=False):
@@ -401,20 +434,13 @@ class BaseHandler(object):
                 "Changing the room create event is forbidden",
             )
 
-        action_generator = ActionGenerator(self.hs)
-        yield action_generator.handle_push_actions_for_event(
-            event, context, self
-        )
-
         (event_stream_id, max_stream_id) = yield self.store.persist_event(
             event, context=context
         )
 
-        # this intentionally does not yield: we don't care about the result
-        # and don't need to wait for it.
-        preserve_fn(self.hs.get_pusherpool().on_new_notifications)(
-            event_stream_id, max_stream_id
-        )
+        # The push actions are computed in the background, rather than making
+        # the sender wait for every member's push rules to be evaluated.
+        self.hs.get_action_generator().on_new_events(max_stream_id)
 
         destinations = set()
         for k, s in context.current_state.items():
@@ -26,7 +26,7 @@ from synapse.api.errors import (
 from synapse.api.constants import EventTypes, Membership, RejectedReason
 from synapse.events.validator import EventValidator
 from synapse.util import unwrapFirstError
-from synapse.util.logcontext import PreserveLoggingContext, preserve_fn
+from synapse.util.logcontext import PreserveLoggingContext
 from synapse.util.logutils import log_function
 from synapse.util.async import run_on_reactor
 from synapse.util.frozenutils import unfreeze
@@ -39,7 +39,6 @@ from synapse.events.utils import prune_event
 
 from synapse.util.retryutils import NotRetryingDestination
 
-from synapse.push.action_generator import ActionGenerator
 from synapse.util.distributor import user_joined_room
 
 from twisted.internet import defer
@@ -796,6 +795,7 @@ class FederationHandler(BaseHandler):
             event,
             context=context,
         )
+        self.hs.get_action_generator().on_new_events(max_stream_id)
 
         target_user = UserID.from_string(event.state_key)
         with PreserveLoggingContext():
@@ -847,6 +847,7 @@ class FederationHandler(BaseHandler):
             event,
             context=context,
         )
+        self.hs.get_action_generator().on_new_events(max_stream_id)
 
         target_user = UserID.from_string(event.state_key)
         self.notifier.on_new_room_event(
@@ -1112,23 +1113,14 @@ class FederationHandler(BaseHandler):
             auth_events=auth_events,
         )
 
-        if not event.internal_metadata.is_outlier():
-            action_generator = ActionGenerator(self.hs)
-            yield action_generator.handle_push_actions_for_event(
-                event, context, self
-            )
-
         event_stream_id, max_stream_id = yield self.store.persist_event(
             event,
             context=context,
             backfilled=backfilled,
         )
 
-        # this intentionally does not yield: we don't care about the result
-        # and don't need to wait for it.
-        preserve_fn(self.hs.get_pusherpool().on_new_notifications)(
-            event_stream_id, max_stream_id
-        )
+        if not backfilled:
+            self.hs.get_action_generator().on_new_events(max_stream_id)
 
         defer.returnValue((context, event_stream_id, max_stream_id))
 
@@ -1159,6 +1151,11 @@ class FederationHandler(BaseHandler):
             backfilled=backfilled,
         )
 
+        if not backfilled:
+            self.hs.get_action_generator().on_new_events(
+                self.store.get_room_max_stream_ordering()
+            )
+
     @defer.inlineCallbacks
     def _persist_auth_tree(self, auth_events, state, event):
         """Checks the auth chain is valid (and passes auth checks) for the
@@ -1227,6 +1224,7 @@ class FederationHandler(BaseHandler):
             event, new_event_context,
             current_state=state,
         )
+        self.hs.get_action_generator().on_new_events(max_stream_id)
 
         defer.returnValue((event_stream_id, max_stream_id))
 
@@ -29,6 +29,7 @@ from synapse.api.errors import SynapseError
 from synapse.api.constants import PresenceState
 from synapse.storage.presence import UserPresenceState
 
+from synapse.util.async import Linearizer
 from synapse.util.logcontext import preserve_fn
 from synapse.util.logutils import log_function
 from synapse.util.metrics import Measure
@@ -70,6 +71,10 @@ FEDERATION_TIMEOUT = 30 * 60 * 1000
 # How often to resend presence to remote servers
 FEDERATION_PING_INTERVAL = 25 * 60 * 1000
 
+# How long we wait to hear from an external process, e.g. a synchrotron, about
+# the users syncing against it before assuming it has gone away.
+EXTERNAL_PROCESS_EXPIRY = 5 * 60 * 1000
+
 assert LAST_ACTIVE_GRANULARITY < IDLE_TIMER
 
 
@@ -164,6 +169,13 @@ class PresenceHandler(BaseHandler):
         # a user will never go offline.
         self.user_to_num_current_syncs = {}
 
+        # Keeps track of the users syncing against other processes, e.g. a
+        # synchrotron. Maps from process ID to the set of syncing user IDs and
+        # to the time we last heard from the process.
+        self.external_process_to_current_syncs = {}
+        self.external_process_last_updated_ms = {}
+        self.external_sync_linearizer = Linearizer()
+
         # Start a LoopingCall in 30s that fires every 5s.
         # The initial delay is to allow disconnected clients a chance to
         # reconnect before we treat them as offline.
@@ -274,21 +286,42 @@ class PresenceHandler(BaseHandler):
             # Fetch the list of users that *may* have timed out. Things may have
             # changed since the timeout was set, so we won't necessarily have to
             # take any action.
-            users_to_check = self.wheel_timer.fetch(now)
+            users_to_check = set(self.wheel_timer.fetch(now))
+
+            # Forget about any external processes we haven't heard from in a
+            # while, and check whether the users that were syncing against
+            # them have now timed out.
+            expired_process_ids = [
+                process_id for process_id, last_update
+                in self.external_process_last_updated_ms.items()
+                if now - last_update > EXTERNAL_PROCESS_EXPIRY
+            ]
+            for process_id in expired_process_ids:
+                users_to_check.update(
+                    self.external_process_to_current_syncs.pop(process_id, ())
+                )
+                self.external_process_last_updated_ms.pop(process_id)
 
             states = [
                 self.user_to_current_state.get(
                     user_id, UserPresenceState.default(user_id)
                 )
-                for user_id in set(users_to_check)
+                for user_id in users_to_check
             ]
 
             timers_fired_counter.inc_by(len(states))
 
+            user_to_num_current_syncs = dict(self.user_to_num_current_syncs)
+            for syncing_user_ids in self.external_process_to_current_syncs.values():
+                for user_id in syncing_user_ids & users_to_check:
+                    user_to_num_current_syncs[user_id] = (
+                        user_to_num_current_syncs.get(user_id, 0) + 1
+                    )
+
             changes = handle_timeouts(
                 states,
                 is_mine_fn=self.hs.is_mine_id,
-                user_to_num_current_syncs=self.user_to_num_current_syncs,
+                user_to_num_current_syncs=user_to_num_current_syncs,
                 now=now,
             )
 
@@ -365,6 +398,52 @@ class PresenceHandler(BaseHandler):
 
         defer.returnValue(_user_syncing())
 
+    @defer.inlineCallbacks
+    def update_external_syncs(self, process_id, syncing_user_ids):
+        """Update the set of users syncing against an external process, e.g. a
+        synchrotron.
+
+        Users that have started syncing are brought online, and the last sync
+        time of users that are still syncing, or have stopped syncing, is
+        bumped so that the usual grace period applies when they stop.
+
+        Args:
+            process_id (str): An identifier for the external process.
+            syncing_user_ids (set(str)): The users currently syncing against
+                the process.
+        """
+        with (yield self.external_sync_linearizer.queue(process_id)):
+            prev_syncing_user_ids = self.external_process_to_current_syncs.get(
+                process_id, set()
+            )
+
+            updates = []
+            now = self.clock.time_msec()
+
+            for user_id in syncing_user_ids - prev_syncing_user_ids:
+                prev_state = yield self.current_state_for_user(user_id)
+                if prev_state.state == PresenceState.OFFLINE:
+                    updates.append(prev_state.copy_and_replace(
+                        state=PresenceState.ONLINE,
+                        last_active_ts=now,
+                        last_user_sync_ts=now,
+                    ))
+                else:
+                    updates.append(prev_state.copy_and_replace(
+                        last_user_sync_ts=now,
+                    ))
+
+            for user_id in prev_syncing_user_ids:
+                prev_state = yield self.current_state_for_user(user_id)
+                updates.append(prev_state.copy_and_replace(
+                    last_user_sync_ts=now,
+                ))
+
+            self.external_process_to_current_syncs[process_id] = syncing_user_ids
+            self.external_process_last_updated_ms[process_id] = now
+
+            yield self._update_states(updates)
+
     @defer.inlineCallbacks
     def current_state_for_user(self, user_id):
         """Get the current presence state for a user.
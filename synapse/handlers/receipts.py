@@ -16,8 +16,11 @@
 from ._base import BaseHandler
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
-from synapse.util.logcontext import PreserveLoggingContext
+from synapse.util.logcontext import (
+    PreserveLoggingContext, preserve_fn, preserve_context_over_deferred,
+)
 
 import logging
 
@@ -36,6 +39,16 @@ class ReceiptsHandler(BaseHandler):
         )
         self.clock = self.hs.get_clock()
 
+        # Receipts from clients that are waiting to be persisted, keyed by
+        # (room_id, receipt_type, user_id). Receipts that arrive while the
+        # previous batch is being persisted are queued here, so that a client
+        # that sends a receipt for every message only has its latest receipt
+        # persisted and sent over federation.
+        self._pending_receipts = {}
+        # Deferreds to resolve once the pending receipts have been handled.
+        self._pending_receipts_waiters = []
+        self._handling_receipts = False
+
     @defer.inlineCallbacks
     def received_client_receipt(self, room_id, receipt_type, user_id,
                                 event_id):
@@ -52,10 +65,43 @@ class ReceiptsHandler(BaseHandler):
             }
         }
 
-        is_new = yield self._handle_new_receipts([receipt])
+        self._pending_receipts[(room_id, receipt_type, user_id)] = receipt
+        d = defer.Deferred()
+        self._pending_receipts_waiters.append(d)
+
+        if not self._handling_receipts:
+            preserve_fn(self._handle_pending_receipts)()
 
-        if is_new:
-            self._push_remotes([receipt])
+        yield preserve_context_over_deferred(d)
+
+    @defer.inlineCallbacks
+    def _handle_pending_receipts(self):
+        if self._handling_receipts:
+            return
+
+        try:
+            self._handling_receipts = True
+            while self._pending_receipts:
+                receipts = self._pending_receipts.values()
+                self._pending_receipts = {}
+                waiters = self._pending_receipts_waiters
+                self._pending_receipts_waiters = []
+
+                try:
+                    new_receipts = yield self._handle_new_receipts(receipts)
+                    if new_receipts:
+                        preserve_fn(self._push_remotes)(new_receipts)
+                except:
+                    failure = Failure()
+                    with PreserveLoggingContext():
+                        for d in waiters:
+                            d.errback(failure)
+                else:
+                    with PreserveLoggingContext():
+                        for d in waiters:
+                            d.callback(None)
+        finally:
+            self._handling_receipts = False
 
     @defer.inlineCallbacks
     def _received_remote_receipt(self, origin, content):
@@ -79,33 +125,21 @@ class ReceiptsHandler(BaseHandler):
     @defer.inlineCallbacks
     def _handle_new_receipts(self, receipts):
         """Takes a list of receipts, stores them and informs the notifier.
-        """
-        min_batch_id = None
-        max_batch_id = None
-
-        for receipt in receipts:
-            room_id = receipt["room_id"]
-            receipt_type = receipt["receipt_type"]
-            user_id = receipt["user_id"]
-            event_ids = receipt["event_ids"]
-            data = receipt["data"]
-
-            res = yield self.store.insert_receipt(
-                room_id, receipt_type, user_id, event_ids, data
-            )
 
-            if not res:
-                # res will be None if this read receipt is 'old'
-                defer.returnValue(False)
-
-            stream_id, max_persisted_id = res
+        Returns:
+            Deferred[list]: The receipts that were newer than the existing
+            receipts for their room and user.
+        """
+        res = yield self.store.insert_receipts(receipts)
+        if not res:
+            defer.returnValue([])
 
-            if min_batch_id is None or stream_id < min_batch_id:
-                min_batch_id = stream_id
-            if max_batch_id is None or max_persisted_id > max_batch_id:
-                max_batch_id = max_persisted_id
+        new_receipts, min_batch_id, max_batch_id = res
+        if not new_receipts:
+            # The receipts were all 'old'
+            defer.returnValue([])
 
-        affected_room_ids = list(set([r["room_id"] for r in receipts]))
+        affected_room_ids = list(set([r["room_id"] for r in new_receipts]))
 
         with PreserveLoggingContext():
             self.notifier.on_new_event(
@@ -116,45 +150,47 @@ class ReceiptsHandler(BaseHandler):
                 min_batch_id, max_batch_id, affected_room_ids
             )
 
-            defer.returnValue(True)
+        defer.returnValue(new_receipts)
 
     @defer.inlineCallbacks
     def _push_remotes(self, receipts):
         """Given a list of receipts, works out which remote servers should be
-        poked and pokes them.
+        poked and pokes them. Each server is sent a single EDU with all of the
+        receipts for the rooms it is in.
         """
-        # TODO: Some of this stuff should be coallesced.
+        receipts_by_room = {}
         for receipt in receipts:
-            room_id = receipt["room_id"]
-            receipt_type = receipt["receipt_type"]
-            user_id = receipt["user_id"]
-            event_ids = receipt["event_ids"]
-            data = receipt["data"]
+            receipts_by_room.setdefault(receipt["room_id"], []).append(receipt)
 
-            remotedomains = set()
+        rm_handler = self.hs.get_handlers().room_member_handler
 
-            rm_handler = self.hs.get_handlers().room_member_handler
+        content_by_domain = {}
+        for room_id, room_receipts in receipts_by_room.items():
+            remotedomains = set()
             yield rm_handler.fetch_room_distributions_into(
                 room_id, localusers=None, remotedomains=remotedomains
             )
 
-            logger.debug("Sending receipt to: %r", remotedomains)
+            logger.debug("Sending receipts in %s to: %r", room_id, remotedomains)
 
             for domain in remotedomains:
-                self.federation.send_edu(
-                    destination=domain,
-                    edu_type="m.receipt",
-                    content={
-                        room_id: {
-                            receipt_type: {
-                                user_id: {
-                                    "event_ids": event_ids,
-                                    "data": data,
-                                }
-                            }
-                        },
-                    },
-                )
+                room_content = content_by_domain.setdefault(
+                    domain, {}
+                ).setdefault(room_id, {})
+                for receipt in room_receipts:
+                    room_content.setdefault(receipt["receipt_type"], {})[
+                        receipt["user_id"]
+                    ] = {
+                        "event_ids": receipt["event_ids"],
+                        "data": receipt["data"],
+                    }
+
+        for domain, content in content_by_domain.items():
+            self.federation.send_edu(
+                destination=domain,
+                edu_type="m.receipt",
+                content=content,
+            )
 
     @defer.inlineCallbacks
     def get_receipts_for_room(self, room_id, to_key):
@@ -59,8 +59,14 @@ class SimpleHttpClient(object):
     """
     A simple, no-frills HTTP client with methods that wrap up common ways of
     using HTTP in Matrix
+
+    Args:
+        hs (synapse.server.HomeServer)
+        pool (twisted.web.client.HTTPConnectionPool|None): A pool of
+            persistent connections to use. If None then a new connection is
+            made for each request.
     """
-    def __init__(self, hs):
+    def __init__(self, hs, pool=None):
         self.hs = hs
         # The default context factory in Twisted 14.0.0 (which we require) is
         # BrowserLikePolicyForHTTPS which will do regular cert validation
@@ -68,7 +74,8 @@ class SimpleHttpClient(object):
         self.agent = Agent(
             reactor,
             connectTimeout=15,
-            contextFactory=hs.get_http_client_context_factory()
+            contextFactory=hs.get_http_client_context_factory(),
+            pool=pool,
         )
         self.user_agent = hs.version_string
         if hs.config.user_agent_suffix:
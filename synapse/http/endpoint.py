@@ -14,11 +14,14 @@
 # limitations under the License.
 
 from twisted.internet.endpoints import SSL4ClientEndpoint, TCP4ClientEndpoint
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.internet.error import ConnectError
 from twisted.names import client, dns
 from twisted.names.error import DNSNameError, DomainError
 
+from synapse.util.async import ObservableDeferred
+from synapse.util.caches import cache_counter, caches_by_name
+
 import collections
 import logging
 import random
@@ -29,6 +32,24 @@ logger = logging.getLogger(__name__)
 
 
 SERVER_CACHE = {}
+caches_by_name["srv_cache"] = SERVER_CACHE
+
+# Names which we were told don't exist, mapped to when we should look them up
+# again.
+NEGATIVE_SERVER_CACHE = {}
+
+# (id(dns_client), id(cache), service_name) -> ObservableDeferred for lookups
+# that are in progress.
+_PENDING_LOOKUPS = {}
+
+# How long before a cached record expires we start refreshing it, so that
+# requests to busy destinations don't have to wait for DNS.
+PREFETCH_SECONDS = 60
+
+NEGATIVE_CACHE_SECONDS = 5 * 60
+
+# How often the SERVER_CACHE is written to the database.
+PERSIST_INTERVAL_MS = 10 * 60 * 1000
 
 
 _Server = collections.namedtuple(
@@ -185,20 +206,82 @@ class SRVClientEndpoint(object):
         defer.returnValue(connection)
 
 
-@defer.inlineCallbacks
-def resolve_service(service_name, dns_client=client, cache=SERVER_CACHE, clock=time):
+def resolve_service(service_name, dns_client=client, cache=SERVER_CACHE,
+                    clock=time, negative_cache=NEGATIVE_SERVER_CACHE):
+    """Look up the servers for an SRV record, using the cache where possible.
+
+    Cached records that are about to expire are refreshed in the background
+    while the cached servers are returned, and names that don't exist are
+    remembered for NEGATIVE_CACHE_SECONDS. Concurrent lookups of the same
+    name share a single query.
+
+    Returns:
+        Deferred: resolves to a list of _Server, sorted by priority.
+    """
+    now = int(clock.time())
+
     cache_entry = cache.get(service_name, None)
     if cache_entry:
-        if all(s.expires > int(clock.time()) for s in cache_entry):
-            servers = list(cache_entry)
-            defer.returnValue(servers)
+        expires = min(s.expires for s in cache_entry)
+        if expires > now:
+            cache_counter.inc_hits("srv_cache")
+            if expires - now < PREFETCH_SECONDS:
+                _lookup_service(
+                    service_name, dns_client, cache, clock, negative_cache,
+                ).addErrback(
+                    lambda f: logger.warn(
+                        "Failed to refresh %r: %s", service_name, f.value
+                    )
+                )
+            return defer.succeed(list(cache_entry))
+
+    if service_name in negative_cache:
+        if negative_cache[service_name] > now:
+            cache_counter.inc_hits("srv_cache")
+            return defer.succeed([])
+        del negative_cache[service_name]
+
+    cache_counter.inc_misses("srv_cache")
+    return _lookup_service(
+        service_name, dns_client, cache, clock, negative_cache,
+    )
+
+
+def _lookup_service(service_name, dns_client, cache, clock, negative_cache):
+    """Query DNS for the service, sharing the result with any lookup of the
+    same name that is already in progress.
+    """
+    key = (id(dns_client), id(cache), service_name)
+    pending = _PENDING_LOOKUPS.get(key)
+    if pending is None:
+        d = _fetch_service(
+            service_name, dns_client, cache, clock, negative_cache
+        )
 
+        def remove(r):
+            _PENDING_LOOKUPS.pop(key, None)
+            return r
+        d.addBoth(remove)
+
+        pending = ObservableDeferred(d, consumeErrors=True)
+        if not d.called:
+            _PENDING_LOOKUPS[key] = pending
+
+    return pending.observe()
+
+
+@defer.inlineCallbacks
+def _fetch_service(service_name, dns_client, cache, clock, negative_cache):
     servers = []
 
     try:
         try:
             answers, _, _ = yield dns_client.lookupService(service_name)
         except DNSNameError:
+            now = int(clock.time())
+            cache.pop(service_name, None)
+            _prune_negative_cache(negative_cache, now)
+            negative_cache[service_name] = now + NEGATIVE_CACHE_SECONDS
             defer.returnValue([])
 
         if (len(answers) == 1
@@ -235,6 +318,7 @@ def resolve_service(service_name, dns_client=client, cache=SERVER_CACHE, clock=t
 
         servers.sort()
         cache[service_name] = list(servers)
+        negative_cache.pop(service_name, None)
     except DomainError as e:
         # We failed to resolve the name (other than a NameError)
         # Try something in the cache, else rereaise
@@ -249,3 +333,75 @@ def resolve_service(service_name, dns_client=client, cache=SERVER_CACHE, clock=t
             raise e
 
     defer.returnValue(servers)
+
+
+def _prune_negative_cache(negative_cache, now):
+    """Remove the names whose negative results have expired, since names that
+    aren't looked up again would otherwise never be removed.
+    """
+    expired = [
+        service_name for service_name, retry_ts in negative_cache.items()
+        if retry_ts <= now
+    ]
+    for service_name in expired:
+        del negative_cache[service_name]
+
+
+@defer.inlineCallbacks
+def load_server_cache(store, cache=SERVER_CACHE):
+    """Fill the cache with the records that were persisted by
+    persist_server_cache. Expired records are kept, since they are still used
+    if the DNS lookup fails.
+    """
+    rows = yield store.get_srv_cache()
+    loaded = {}
+    for row in rows:
+        loaded.setdefault(row["service_name"], []).append(_Server(
+            host=row["host"],
+            port=row["port"],
+            priority=row["priority"],
+            weight=row["weight"],
+            expires=row["expires"],
+        ))
+
+    for service_name, servers in loaded.items():
+        if service_name not in cache:
+            servers.sort()
+            cache[service_name] = servers
+
+    logger.info("Loaded SRV records for %d services", len(loaded))
+
+
+def persist_server_cache(store, cache=SERVER_CACHE):
+    """Write the cache to the database so that it can be loaded again after a
+    restart.
+    """
+    return store.store_srv_cache([
+        {
+            "service_name": service_name,
+            "host": server.host,
+            "port": server.port,
+            "priority": server.priority,
+            "weight": server.weight,
+            "expires": server.expires,
+        }
+        for service_name, servers in cache.items()
+        for server in servers
+    ])
+
+
+def setup_server_cache_persistence(hs):
+    """Load the persisted SRV records and keep them up to date in the
+    database, for the process that sends federation traffic.
+    """
+    store = hs.get_datastore()
+
+    def persist():
+        return persist_server_cache(store).addErrback(
+            lambda f: logger.warn("Failed to persist SRV cache: %s", f.value)
+        )
+
+    reactor.addSystemEventTrigger("before", "shutdown", persist)
+    hs.get_clock().looping_call(persist, PERSIST_INTERVAL_MS)
+
+    return load_server_cache(store)
@@ -54,6 +54,14 @@ incoming_responses_counter = metrics.register_counter(
     "responses",
     labels=["method", "code"],
 )
+request_timer = metrics.register_distribution(
+    "request_time",
+    labels=["destination"],
+)
+
+connections_opened_counter = metrics.register_counter("connections_opened")
+connections_reused_counter = metrics.register_counter("connections_reused")
+connections_closed_counter = metrics.register_counter("connections_closed")
 
 
 MAX_LONG_RETRIES = 10
@@ -69,7 +77,46 @@ class MatrixFederationEndpointFactory(object):
 
         return matrix_federation_endpoint(
             reactor, destination, timeout=10,
-            ssl_context_factory=self.tls_server_context_factory
+            ssl_context_factory=(
+                self.tls_server_context_factory.client_connection_creator(
+                    destination
+                )
+            )
+        )
+
+
+class MatrixFederationConnectionPool(HTTPConnectionPool):
+    """A pool of persistent connections to remote servers which counts how
+    many connections are opened, reused from the pool and closed by the pool.
+    """
+
+    def getConnection(self, key, endpoint):
+        connections = self._connections.get(key, [])
+        if any(c.state == "QUIESCENT" for c in connections):
+            connections_reused_counter.inc()
+        return super(MatrixFederationConnectionPool, self).getConnection(
+            key, endpoint
+        )
+
+    def _newConnection(self, key, endpoint):
+        connections_opened_counter.inc()
+        return super(MatrixFederationConnectionPool, self)._newConnection(
+            key, endpoint
+        )
+
+    def _putConnection(self, key, connection):
+        connections = self._connections.get(key, [])
+        if len(connections) == self.maxPersistentPerHost:
+            # The pool is full so the oldest idle connection will be dropped.
+            connections_closed_counter.inc()
+        return super(MatrixFederationConnectionPool, self)._putConnection(
+            key, connection
+        )
+
+    def _removeConnection(self, key, connection):
+        connections_closed_counter.inc()
+        return super(MatrixFederationConnectionPool, self)._removeConnection(
+            key, connection
         )
 
 
@@ -86,8 +133,11 @@ class MatrixFederationHttpClient(object):
         self.hs = hs
         self.signing_key = hs.config.signing_key[0]
         self.server_name = hs.hostname
-        pool = HTTPConnectionPool(reactor)
-        pool.maxPersistentPerHost = 10
+        pool = MatrixFederationConnectionPool(reactor)
+        pool.maxPersistentPerHost = hs.config.federation_connections_per_host
+        pool.cachedConnectionTimeout = (
+            hs.config.federation_connection_idle_timeout
+        )
         self.agent = Agent.usingEndpointFactory(
             reactor, MatrixFederationEndpointFactory(hs), pool=pool
         )
@@ -155,9 +205,15 @@ class MatrixFederationHttpClient(object):
                             time_out=timeout / 1000. if timeout else 60,
                         )
 
-                    response = yield preserve_context_over_fn(
-                        send_request,
-                    )
+                    start = self.clock.time_msec()
+                    try:
+                        response = yield preserve_context_over_fn(
+                            send_request,
+                        )
+                    finally:
+                        request_timer.inc_by(
+                            self.clock.time_msec() - start, destination
+                        )
 
                     log_result = "%d %s" % (response.code, response.phrase,)
                     break
@@ -15,8 +15,10 @@
 
 from twisted.internet import defer
 
-from .bulk_push_rule_evaluator import evaluator_for_event
+from .bulk_push_rule_evaluator import evaluator_for_event, RulesForRoom
 
+from synapse.util.caches.descriptors import Cache, CACHE_SIZE_FACTOR
+from synapse.util.logcontext import LoggingContext, preserve_fn
 from synapse.util.metrics import Measure
 
 import logging
@@ -24,11 +26,51 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _state_before_event(event, state_after, replaced_events):
+    """Works out the state before an event from the state after it.
+
+    Args:
+        event (FrozenEvent)
+        state_after (dict): (type, state_key) -> event, including `event` if
+            it is a state event.
+        replaced_events (dict): event_id -> event for the state events that
+            were replaced.
+
+    Returns:
+        dict: (type, state_key) -> event
+    """
+    if not event.is_state():
+        return state_after
+
+    state = dict(state_after)
+    key = (event.type, event.state_key)
+    replaced = replaced_events.get(event.unsigned.get("replaces_state"))
+    if replaced is not None:
+        state[key] = replaced
+    else:
+        state.pop(key, None)
+    return state
+
+
 class ActionGenerator:
+    """Computes the push actions for new events.
+
+    This happens in the background once the events have been persisted so
+    that sending an event doesn't wait for the push rules of everyone in the
+    room to be evaluated. The events are processed in stream order, and the
+    pushers are told about new actions once all the events before them have
+    been processed, so that a pusher never skips past an event whose actions
+    haven't been added yet.
+    """
+
+    # The number of events to process in each batch.
+    BATCH_SIZE = 100
+
     def __init__(self, hs):
         self.hs = hs
         self.clock = hs.get_clock()
         self.store = hs.get_datastore()
+        self.notifier = hs.get_notifier()
         # really we want to get all user ids and all profile tags too,
         # since we want the actions for each profile tag for every user and
         # also actions for a client with no profile tag for each user.
@@ -36,17 +78,129 @@ class ActionGenerator:
         # event stream, so we just run the rules for a client with no profile
         # tag (ie. we just need all the users).
 
+        # Maps room_id to the RulesForRoom for that room, so that we don't
+        # have to fetch the push rules of every user in the room for each
+        # event.
+        self.rules_for_room_cache = Cache(
+            "rules_for_room", max_entries=int(10000 * CACHE_SIZE_FACTOR),
+        )
+
+        # The position in the events stream up to which events have been
+        # persisted, and so can have their push actions computed.
+        self._max_stream_ordering = 0
+        self._processing = False
+
+    def _get_rules_for_room(self, room_id):
+        rules_for_room = self.rules_for_room_cache.get(room_id, None)
+        if rules_for_room is None:
+            rules_for_room = RulesForRoom(room_id)
+            self.rules_for_room_cache.prefill(room_id, rules_for_room)
+        return rules_for_room
+
+    def start(self):
+        """Computes the push actions for any events that were persisted
+        before the server was last stopped.
+        """
+        self.on_new_events(self.store.get_room_max_stream_ordering())
+
+    def on_new_events(self, max_stream_ordering):
+        """Called when new events have been persisted.
+
+        Args:
+            max_stream_ordering (int): The position in the events stream up
+                to which all events have been persisted.
+        """
+        self._max_stream_ordering = max(
+            max_stream_ordering, self._max_stream_ordering
+        )
+        if not self._processing:
+            preserve_fn(self._process)()
+
     @defer.inlineCallbacks
-    def handle_push_actions_for_event(self, event, context, handler):
-        with Measure(self.clock, "handle_push_actions_for_event"):
-            bulk_evaluator = yield evaluator_for_event(
-                event, self.hs, self.store
-            )
-
-            actions_by_user = yield bulk_evaluator.action_for_event_by_user(
-                event, handler, context.current_state
-            )
-
-            context.push_actions = [
-                (uid, actions) for uid, actions in actions_by_user.items()
-            ]
+    def _process(self):
+        if self._processing:
+            return
+
+        with LoggingContext("push.action_generator._process"):
+            try:
+                self._processing = True
+                while True:
+                    position = self.store.get_push_actions_stream_token()
+                    if position >= self._max_stream_ordering:
+                        break
+
+                    with Measure(self.clock, "push_actions_for_events"):
+                        yield self._process_batch(
+                            position, self._max_stream_ordering
+                        )
+            except:
+                logger.exception("Exception computing push actions")
+            finally:
+                self._processing = False
+
+    @defer.inlineCallbacks
+    def _process_batch(self, position, max_stream_ordering):
+        upto, rows = yield self.store.get_events_for_push_actions(
+            position, max_stream_ordering, self.BATCH_SIZE
+        )
+
+        event_ids = [event_id for _, event_id in rows]
+        # Rejected events aren't returned, and don't get push actions.
+        event_map = yield self.store.get_events(event_ids)
+        state_by_event = yield self.store.get_state_for_events(
+            [event_id for event_id in event_ids if event_id in event_map],
+            types=None,
+        )
+        # The push rules are run against the state before each event, as it
+        # was when the event was sent, but the state groups store the state
+        # after it.
+        replaced_events = yield self.store.get_events([
+            event.unsigned["replaces_state"] for event in event_map.values()
+            if event.is_state() and "replaces_state" in event.unsigned
+        ])
+
+        handler = self.hs.get_handlers().message_handler
+
+        actions_for_events = []
+        for stream_ordering, event_id in rows:
+            event = event_map.get(event_id)
+            if event is None:
+                continue
+
+            try:
+                current_state = _state_before_event(
+                    event, state_by_event[event_id], replaced_events
+                )
+                actions_by_user = yield self._get_actions_for_event(
+                    event, current_state, handler
+                )
+            except:
+                # Carry on with the rest of the events, otherwise one event
+                # would stop every push notification from being sent.
+                logger.exception(
+                    "Failed to compute push actions for %s", event_id
+                )
+                continue
+
+            actions_for_events.append((
+                event, stream_ordering, actions_by_user.items(),
+            ))
+
+        yield self.store.add_push_actions_for_events(actions_for_events, upto)
+
+        self.notifier.on_new_replication_data()
+        preserve_fn(self.hs.get_pusherpool().on_new_notifications)(
+            position + 1, upto
+        )
+
+    @defer.inlineCallbacks
+    def _get_actions_for_event(self, event, current_state, handler):
+        bulk_evaluator = yield evaluator_for_event(
+            event, self.hs, self.store,
+            self._get_rules_for_room(event.room_id),
+        )
+
+        actions_by_user = yield bulk_evaluator.action_for_event_by_user(
+            event, handler, current_state
+        )
+        defer.returnValue(actions_by_user)
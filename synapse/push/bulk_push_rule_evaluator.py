@@ -19,57 +19,166 @@ import ujson as json
 from twisted.internet import defer
 
 from .baserules import list_with_base_rules
-from .push_rule_evaluator import PushRuleEvaluatorForEvent
+from .push_rule_evaluator import PushRuleEvaluatorForEvent, PushRules
 
-from synapse.api.constants import EventTypes
+from synapse.api.constants import EventTypes, Membership
+from synapse.util.caches.lrucache import LruCache
 
 
 logger = logging.getLogger(__name__)
 
 
 def decode_rule_json(rule):
+    rule = dict(rule)
     rule['conditions'] = json.loads(rule['conditions'])
     rule['actions'] = json.loads(rule['actions'])
     return rule
 
 
-@defer.inlineCallbacks
-def _get_rules(room_id, user_ids, store):
-    rules_by_user = yield store.bulk_get_push_rules(user_ids)
-    rules_enabled_by_user = yield store.bulk_get_push_rules_enabled(user_ids)
+# Compiled PushRules, keyed by _rules_key. Most users never change their push
+# rules so will share the entry for the server defaults.
+push_rules_cache = LruCache(5000)
+
 
-    rules_by_user = {
-        uid: list_with_base_rules([
-            decode_rule_json(rule_list)
-            for rule_list in rules_by_user.get(uid, [])
-        ])
-        for uid in user_ids
-    }
+def _rules_key(raw_rules, enabled_map):
+    """A key that identifies a set of push rules, so that users with the same
+    rules can share the compiled PushRules.
+
+    Args:
+        raw_rules (list): The user's rows from the push_rules table.
+        enabled_map (dict): The user's rule_id -> enabled map.
+    """
+    return (
+        tuple(
+            (
+                r['rule_id'], r['priority_class'], r['priority'],
+                r['conditions'], r['actions'],
+            )
+            for r in raw_rules
+        ),
+        tuple(sorted(enabled_map.items())),
+    )
+
+
+def _compile_rules(raw_rules, enabled_map):
+    rules = list_with_base_rules([
+        decode_rule_json(rule) for rule in raw_rules
+    ])
 
     # We apply the rules-enabled map here: bulk_get_push_rules doesn't
     # fetch disabled rules, but this won't account for any server default
     # rules the user has disabled, so we need to do this too.
+    for i, rule in enumerate(rules):
+        rule_id = rule['rule_id']
+
+        if rule_id in enabled_map:
+            if rule.get('enabled', True) != bool(enabled_map[rule_id]):
+                # Rules are cached across users.
+                rule = dict(rule)
+                rule['enabled'] = bool(enabled_map[rule_id])
+                rules[i] = rule
+
+    return PushRules(rules)
+
+
+@defer.inlineCallbacks
+def _get_rules(room_id, user_ids, store):
+    """Get the compiled push rules for each user.
+
+    Returns:
+        Deferred[dict]: A map from user_id to PushRules. Users with the same
+        rules get the same PushRules object.
+    """
+    rules_by_user = yield store.bulk_get_push_rules(user_ids)
+    rules_enabled_by_user = yield store.bulk_get_push_rules_enabled(user_ids)
+
+    compiled_by_user = {}
     for uid in user_ids:
-        if uid not in rules_enabled_by_user:
-            continue
+        raw_rules = rules_by_user.get(uid, [])
+        enabled_map = rules_enabled_by_user.get(uid, {})
 
-        user_enabled_map = rules_enabled_by_user[uid]
+        key = _rules_key(raw_rules, enabled_map)
+        push_rules = push_rules_cache.get(key, None)
+        if push_rules is None:
+            push_rules = _compile_rules(raw_rules, enabled_map)
+            push_rules_cache[key] = push_rules
 
-        for i, rule in enumerate(rules_by_user[uid]):
-            rule_id = rule['rule_id']
+        compiled_by_user[uid] = push_rules
 
-            if rule_id in user_enabled_map:
-                if rule.get('enabled', True) != bool(user_enabled_map[rule_id]):
-                    # Rules are cached across users.
-                    rule = dict(rule)
-                    rule['enabled'] = bool(user_enabled_map[rule_id])
-                    rules_by_user[uid][i] = rule
+    defer.returnValue(compiled_by_user)
 
-    defer.returnValue(rules_by_user)
+
+class RulesForRoom(object):
+    """The compiled push rules for the users in a room that we run push rules
+    for. These are kept between events, and only the rules for users who have
+    newly joined the room, or whose rules have changed according to the push
+    rules stream, are fetched from the database.
+    """
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.rules_by_user = {}
+
+        # The position in the push rules stream that rules_by_user is up to
+        # date with, or None if we haven't fetched any rules yet.
+        self.push_rules_stream_id = None
+
+    @defer.inlineCallbacks
+    def get_rules(self, user_ids, store):
+        """
+        Args:
+            user_ids (list): The users to get the push rules of.
+            store (DataStore)
+
+        Returns:
+            Deferred[dict]: A map from user_id to PushRules.
+        """
+        # Get the position before fetching anything, so that any changes
+        # that race with the fetch are picked up next time.
+        stream_id, _ = store.get_push_rules_stream_token()
+
+        if self.push_rules_stream_id is None:
+            changed = set(user_ids)
+        else:
+            changed = set(store.push_rules_stream_cache.get_entities_changed(
+                user_ids, self.push_rules_stream_id,
+            ))
+
+        cached = self.rules_by_user
+        to_fetch = [
+            uid for uid in user_ids if uid in changed or uid not in cached
+        ]
+
+        fetched = {}
+        if to_fetch:
+            fetched = yield _get_rules(self.room_id, to_fetch, store)
+
+        # Users who are no longer in the room are dropped.
+        rules_by_user = {}
+        for uid in user_ids:
+            rules = fetched.get(uid)
+            rules_by_user[uid] = rules if rules is not None else cached[uid]
+
+        self.rules_by_user = rules_by_user
+        self.push_rules_stream_id = stream_id
+
+        defer.returnValue(rules_by_user)
 
 
 @defer.inlineCallbacks
-def evaluator_for_event(event, hs, store):
+def evaluator_for_event(event, hs, store, rules_for_room=None):
+    """
+    Args:
+        event (FrozenEvent)
+        hs (HomeServer)
+        store (DataStore)
+        rules_for_room (RulesForRoom|None): The cached rules for the event's
+            room, which will be updated. If None the rules of all the users are
+            fetched from the database.
+
+    Returns:
+        Deferred[BulkPushRuleEvaluator]
+    """
     room_id = event.room_id
 
     # users in the room who have pushers need to get push rules run because
@@ -103,7 +212,9 @@ def evaluator_for_event(event, hs, store):
 
     user_ids = list(user_ids)
 
-    rules_by_user = yield _get_rules(room_id, user_ids, store)
+    if rules_for_room is None:
+        rules_for_room = RulesForRoom(room_id)
+    rules_by_user = yield rules_for_room.get_rules(user_ids, store)
 
     defer.returnValue(BulkPushRuleEvaluator(
         room_id, rules_by_user, user_ids, store
@@ -115,9 +226,10 @@ class BulkPushRuleEvaluator:
     Runs push rules for all users in a room.
     This is faster than running PushRuleEvaluator for each user because it
     fetches all the rules for all the users in one (batched) db query
-    rather than doing multiple queries per-user. It currently uses
-    the same logic to run the actual rules, but could be optimised further
-    (see https://matrix.org/jira/browse/SYN-562)
+    rather than doing multiple queries per-user. Users with the same rules
+    share compiled PushRules, so the conditions that don't depend on the user
+    are only checked once per distinct set of rules (see
+    https://matrix.org/jira/browse/SYN-562)
     """
     def __init__(self, room_id, rules_by_user, users_in_room, store):
         self.room_id = room_id
@@ -140,11 +252,19 @@ class BulkPushRuleEvaluator:
             user_tuples, [event], {event.event_id: current_state}
         )
 
-        room_members = yield self.store.get_users_in_room(self.room_id)
+        # Count the members from the state before the event, rather than the
+        # room as it is now, as push actions can be computed a while after the
+        # event was sent.
+        member_count = sum(
+            1 for (event_type, _), ev in current_state.items()
+            if event_type == EventTypes.Member
+            and ev.content.get("membership") == Membership.JOIN
+        )
 
-        evaluator = PushRuleEvaluatorForEvent(event, len(room_members))
+        evaluator = PushRuleEvaluatorForEvent(event, member_count)
 
-        condition_cache = {}
+        # Maps PushRules to the result of running them against the event
+        pending_by_rules = {}
 
         display_names = {}
         for ev in current_state.values():
@@ -153,8 +273,6 @@ class BulkPushRuleEvaluator:
                 display_names[ev.state_key] = nm
 
         for uid, rules in self.rules_by_user.items():
-            display_name = display_names.get(uid, None)
-
             filtered = filtered_by_user[uid]
             if len(filtered) == 0:
                 continue
@@ -162,36 +280,13 @@ class BulkPushRuleEvaluator:
             if filtered[0].sender == uid:
                 continue
 
-            for rule in rules:
-                if 'enabled' in rule and not rule['enabled']:
-                    continue
-
-                matches = _condition_checker(
-                    evaluator, rule['conditions'], uid, display_name, condition_cache
-                )
-                if matches:
-                    actions = [x for x in rule['actions'] if x != 'dont_notify']
-                    if actions and 'notify' in actions:
-                        actions_by_user[uid] = actions
-                    break
-        defer.returnValue(actions_by_user)
-
-
-def _condition_checker(evaluator, conditions, uid, display_name, cache):
-    for cond in conditions:
-        _id = cond.get("_id", None)
-        if _id:
-            res = cache.get(_id, None)
-            if res is False:
-                return False
-            elif res is True:
-                continue
-
-        res = evaluator.matches(cond, uid, display_name)
-        if _id:
-            cache[_id] = bool(res)
+            pending = pending_by_rules.get(rules)
+            if pending is None:
+                pending = rules.evaluate(evaluator)
+                pending_by_rules[rules] = pending
 
-        if not res:
-            return False
+            actions = pending.actions_for_user(uid, display_names.get(uid, None))
+            if actions:
+                actions_by_user[uid] = actions
 
-    return True
+        defer.returnValue(actions_by_user)
@@ -21,11 +21,18 @@ import logging
 import push_rule_evaluator
 import push_tools
 
-from synapse.util.logcontext import LoggingContext
+from synapse.util import unwrapFirstError
+from synapse.util.logcontext import LoggingContext, preserve_fn
 from synapse.util.metrics import Measure
+import synapse.metrics
 
 logger = logging.getLogger(__name__)
 
+metrics = synapse.metrics.get_metrics_for(__name__)
+
+# Not labelled by URL, as the URLs are given by clients.
+request_timer = metrics.register_distribution("request_time")
+
 
 class HttpPusher(object):
     INITIAL_BACKOFF_SEC = 1  # in seconds because that's what Twisted takes
@@ -34,6 +41,10 @@ class HttpPusher(object):
     # This one's in ms because we compare it against the clock
     GIVE_UP_AFTER_MS = 24 * 60 * 60 * 1000
 
+    # The number of notifications to send to the push gateway at once when
+    # catching up on a backlog.
+    BATCH_SIZE = 10
+
     def __init__(self, hs, pusherdict):
         self.hs = hs
         self.store = self.hs.get_datastore()
@@ -51,6 +62,15 @@ class HttpPusher(object):
         self.timed_call = None
         self.processing = False
 
+        # The number of notifications after last_stream_ordering that are
+        # waiting to be sent.
+        self.backlog = 0
+
+        # The stream orderings of notifications that were sent after an
+        # earlier notification in the same batch failed, so that they aren't
+        # sent again when the failed one is retried.
+        self.sent_stream_orderings = set()
+
         # This is the highest stream ordering we know it's safe to process.
         # When new events arrive, we'll be given a window of new events: we
         # should honour this rather than just looking for anything higher
@@ -75,7 +95,7 @@ class HttpPusher(object):
                 "'url' required in data for HTTP pusher"
             )
         self.url = self.data['url']
-        self.http_client = hs.get_simple_http_client()
+        self.http_client = hs.get_push_http_client()
         self.data_minus_url = {}
         self.data_minus_url.update(self.data)
         del self.data_minus_url['url']
@@ -143,75 +163,158 @@ class HttpPusher(object):
         unprocessed = yield self.store.get_unread_push_actions_for_user_in_range(
             self.user_id, self.last_stream_ordering, self.max_stream_ordering
         )
+        self._update_backlog(unprocessed)
+
+        # The notifications in each batch are sent at once, but we only move
+        # last_stream_ordering past the ones that were sent before the first
+        # failure so that the failed one is retried.
+        while unprocessed:
+            batch = unprocessed[:self.BATCH_SIZE]
+            unprocessed = unprocessed[self.BATCH_SIZE:]
+
+            results = yield self._process_batch(batch)
+
+            failed = None
+            for push_action, processed in zip(batch, results):
+                if failed is not None:
+                    if processed:
+                        self.sent_stream_orderings.add(
+                            push_action['stream_ordering']
+                        )
+                elif processed:
+                    self.last_stream_ordering = push_action['stream_ordering']
+                else:
+                    failed = push_action
 
-        for push_action in unprocessed:
-            processed = yield self._process_one(push_action)
-            if processed:
-                self.backoff_delay = HttpPusher.INITIAL_BACKOFF_SEC
-                self.last_stream_ordering = push_action['stream_ordering']
-                yield self.store.update_pusher_last_stream_ordering_and_success(
-                    self.app_id, self.pushkey, self.user_id,
-                    self.last_stream_ordering,
-                    self.clock.time_msec()
-                )
-                if self.failing_since:
-                    self.failing_since = None
-                    yield self.store.update_pusher_failing_since(
-                        self.app_id, self.pushkey, self.user_id,
-                        self.failing_since
-                    )
-            else:
-                if not self.failing_since:
-                    self.failing_since = self.clock.time_msec()
-                    yield self.store.update_pusher_failing_since(
-                        self.app_id, self.pushkey, self.user_id,
-                        self.failing_since
-                    )
+            if failed is None or failed is not batch[0]:
+                yield self._on_success()
+            self._update_backlog(batch + unprocessed)
 
-                if (
-                    self.failing_since and
-                    self.failing_since <
-                    self.clock.time_msec() - HttpPusher.GIVE_UP_AFTER_MS
-                ):
-                    # we really only give up so that if the URL gets
-                    # fixed, we don't suddenly deliver a load
-                    # of old notifications.
-                    logger.warn("Giving up on a notification to user %s, "
-                                "pushkey %s",
-                                self.user_id, self.pushkey)
-                    self.backoff_delay = HttpPusher.INITIAL_BACKOFF_SEC
-                    self.last_stream_ordering = push_action['stream_ordering']
-                    yield self.store.update_pusher_last_stream_ordering(
-                        self.app_id,
-                        self.pushkey,
-                        self.user_id,
-                        self.last_stream_ordering
-                    )
+            if failed is None:
+                continue
 
-                    self.failing_since = None
-                    yield self.store.update_pusher_failing_since(
-                        self.app_id,
-                        self.pushkey,
-                        self.user_id,
-                        self.failing_since
-                    )
-                else:
-                    logger.info("Push failed: delaying for %ds", self.backoff_delay)
-                    self.timed_call = reactor.callLater(self.backoff_delay, self.on_timer)
-                    self.backoff_delay = min(self.backoff_delay * 2, self.MAX_BACKOFF_SEC)
-                    break
+            gave_up = yield self._on_failure(failed)
+            if not gave_up:
+                break
+
+            # Carry on with the rest of the batch. Any that were sent are in
+            # sent_stream_orderings so won't be sent again.
+            unprocessed = [
+                push_action for push_action in batch
+                if push_action['stream_ordering'] > self.last_stream_ordering
+            ] + unprocessed
+            self._update_backlog(unprocessed)
+
+    def _update_backlog(self, push_actions):
+        self.backlog = len([
+            push_action for push_action in push_actions
+            if push_action['stream_ordering'] > self.last_stream_ordering
+        ])
+
+    @defer.inlineCallbacks
+    def _on_success(self):
+        self.backoff_delay = HttpPusher.INITIAL_BACKOFF_SEC
+        self.sent_stream_orderings = set(
+            stream_ordering for stream_ordering in self.sent_stream_orderings
+            if stream_ordering > self.last_stream_ordering
+        )
+        yield self.store.update_pusher_last_stream_ordering_and_success(
+            self.app_id, self.pushkey, self.user_id,
+            self.last_stream_ordering,
+            self.clock.time_msec()
+        )
+        if self.failing_since:
+            self.failing_since = None
+            yield self.store.update_pusher_failing_since(
+                self.app_id, self.pushkey, self.user_id,
+                self.failing_since
+            )
 
     @defer.inlineCallbacks
-    def _process_one(self, push_action):
-        if 'notify' not in push_action['actions']:
+    def _on_failure(self, push_action):
+        """Handles a notification that couldn't be sent, either by scheduling
+        a retry or, if it has been failing for too long, by skipping it.
+
+        Returns:
+            Deferred[bool]: True if the notification was skipped.
+        """
+        if not self.failing_since:
+            self.failing_since = self.clock.time_msec()
+            yield self.store.update_pusher_failing_since(
+                self.app_id, self.pushkey, self.user_id,
+                self.failing_since
+            )
+
+        if (
+            self.failing_since and
+            self.failing_since <
+            self.clock.time_msec() - HttpPusher.GIVE_UP_AFTER_MS
+        ):
+            # we really only give up so that if the URL gets
+            # fixed, we don't suddenly deliver a load
+            # of old notifications.
+            logger.warn("Giving up on a notification to user %s, "
+                        "pushkey %s",
+                        self.user_id, self.pushkey)
+            self.backoff_delay = HttpPusher.INITIAL_BACKOFF_SEC
+            self.last_stream_ordering = push_action['stream_ordering']
+            yield self.store.update_pusher_last_stream_ordering(
+                self.app_id,
+                self.pushkey,
+                self.user_id,
+                self.last_stream_ordering
+            )
+
+            self.failing_since = None
+            yield self.store.update_pusher_failing_since(
+                self.app_id,
+                self.pushkey,
+                self.user_id,
+                self.failing_since
+            )
             defer.returnValue(True)
+        else:
+            logger.info("Push failed: delaying for %ds", self.backoff_delay)
+            self.timed_call = reactor.callLater(self.backoff_delay, self.on_timer)
+            self.backoff_delay = min(self.backoff_delay * 2, self.MAX_BACKOFF_SEC)
+            defer.returnValue(False)
 
-        tweaks = push_rule_evaluator.tweaks_for_actions(push_action['actions'])
-        badge = yield push_tools.get_badge_count(self.hs.get_datastore(), self.user_id)
+    @defer.inlineCallbacks
+    def _process_batch(self, push_actions):
+        """Sends a batch of notifications to the push gateway at once.
 
-        event = yield self.store.get_event(push_action['event_id'], allow_none=True)
+        Returns:
+            Deferred[list[bool]]: Whether each notification was processed.
+        """
+        to_send = [
+            push_action for push_action in push_actions
+            if 'notify' in push_action['actions']
+            and push_action['stream_ordering'] not in self.sent_stream_orderings
+        ]
+        if not to_send:
+            defer.returnValue([True] * len(push_actions))
+
+        # The badge is the same for every notification in the batch.
+        badge = yield push_tools.get_badge_count(self.store, self.user_id)
+        event_map = yield self.store.get_events(
+            [push_action['event_id'] for push_action in to_send]
+        )
+
+        results = yield defer.gatherResults([
+            preserve_fn(self._process_one)(
+                push_action, event_map.get(push_action['event_id']), badge
+            )
+            if push_action in to_send else defer.succeed(True)
+            for push_action in push_actions
+        ], consumeErrors=True).addErrback(unwrapFirstError)
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    def _process_one(self, push_action, event, badge):
         if event is None:
             defer.returnValue(True)  # It's been redacted
+
+        tweaks = push_rule_evaluator.tweaks_for_actions(push_action['actions'])
         rejected = yield self.dispatch_push(event, tweaks, badge)
         if rejected is False:
             defer.returnValue(False)
@@ -284,7 +387,7 @@ class HttpPusher(object):
         if not notification_dict:
             defer.returnValue([])
         try:
-            resp = yield self.http_client.post_json_get_json(self.url, notification_dict)
+            resp = yield self._post_json(notification_dict)
         except:
             logger.warn("Failed to push %s ", self.url)
             defer.returnValue(False)
@@ -315,7 +418,7 @@ class HttpPusher(object):
             }
         }
         try:
-            resp = yield self.http_client.post_json_get_json(self.url, d)
+            resp = yield self._post_json(d)
         except:
             logger.exception("Failed to push %s ", self.url)
             defer.returnValue(False)
@@ -323,3 +426,12 @@ class HttpPusher(object):
         if 'rejected' in resp:
             rejected = resp['rejected']
         defer.returnValue(rejected)
+
+    @defer.inlineCallbacks
+    def _post_json(self, body):
+        start = self.clock.time_msec()
+        try:
+            resp = yield self.http_client.post_json_get_json(self.url, body)
+        finally:
+            request_timer.inc_by(self.clock.time_msec() - start)
+        defer.returnValue(resp)
@@ -71,58 +71,224 @@ class PushRuleEvaluatorForEvent(object):
         # Maps strings of e.g. 'content.body' -> event["content"]["body"]
         self._value_cache = _flatten_dict(event)
 
+        # Maps the key of a condition that doesn't depend on the user to
+        # whether it matches this event, so that it is only checked once
+        # however many users and rule sets share it.
+        self._condition_cache = {}
+
     def matches(self, condition, user_id, display_name):
-        if condition['kind'] == 'event_match':
-            return self._event_match(condition, user_id)
-        elif condition['kind'] == 'contains_display_name':
-            return self._contains_display_name(display_name)
-        elif condition['kind'] == 'room_member_count':
-            return _room_member_count(
-                self._event, condition, self._room_member_count
-            )
-        else:
-            return True
+        condition = _compile_condition(condition)
+        result = self.check_for_event(condition)
+        if result is None:
+            result = condition.matches_for_user(self, user_id, display_name)
+        return result
+
+    def check_for_event(self, condition):
+        """Checks the parts of a compiled condition that don't depend on the
+        user.
+
+        Returns:
+            True or False if the condition matches or doesn't match for every
+            user, or None if it depends on the user.
+        """
+        key = condition.cache_key
+        try:
+            return self._condition_cache[key]
+        except KeyError:
+            result = condition.matches_for_event(self)
+            self._condition_cache[key] = result
+            return result
+
+    def _get_body(self):
+        return self._event["content"].get("body", None)
+
+    def _get_value(self, dotted_key):
+        return self._value_cache.get(dotted_key, None)
 
-    def _event_match(self, condition, user_id):
-        pattern = condition.get('pattern', None)
 
+class PushRules(object):
+    """A list of push rules, compiled so that they can be run against lots of
+    events. Users with the same rules should share the same PushRules, so that
+    the parts of the rules that don't depend on the user are only run once per
+    event.
+    """
+
+    def __init__(self, rules):
+        """
+        Args:
+            rules (list): The user's rules in priority order, i.e. after
+                list_with_base_rules.
+        """
+        self.rules = []
+        for rule in rules:
+            if 'enabled' in rule and not rule['enabled']:
+                continue
+
+            actions = [x for x in rule['actions'] if x != 'dont_notify']
+            if not actions or 'notify' not in actions:
+                actions = None
+
+            self.rules.append((
+                [_compile_condition(c) for c in rule['conditions']],
+                actions,
+            ))
+
+    def evaluate(self, evaluator):
+        """Runs the rules against an event as far as possible without knowing
+        the user.
+
+        Args:
+            evaluator (PushRuleEvaluatorForEvent)
+
+        Returns:
+            PendingPushActions
+        """
+        remaining = []
+        for conditions, actions in self.rules:
+            user_conditions = []
+            for condition in conditions:
+                result = evaluator.check_for_event(condition)
+                if result is False:
+                    break
+                elif result is None:
+                    user_conditions.append(condition)
+            else:
+                remaining.append((user_conditions, actions))
+                if not user_conditions:
+                    # This rule matches for everyone, so none of the later
+                    # rules will be reached.
+                    break
+
+        return PendingPushActions(evaluator, remaining)
+
+
+class PendingPushActions(object):
+    """The result of running PushRules against an event, which gives the
+    actions for each user with those rules.
+    """
+
+    def __init__(self, evaluator, remaining):
+        self._evaluator = evaluator
+        self._remaining = remaining
+
+    def actions_for_user(self, user_id, display_name):
+        """
+        Returns:
+            The list of actions if the event should notify the user, otherwise
+            None.
+        """
+        for conditions, actions in self._remaining:
+            for condition in conditions:
+                if not condition.matches_for_user(
+                    self._evaluator, user_id, display_name
+                ):
+                    break
+            else:
+                return actions
+        return None
+
+
+class _EventMatchCondition(object):
+    def __init__(self, condition):
+        self.key = condition['key']
+        self.pattern = condition.get('pattern', None)
+        self.pattern_type = condition.get('pattern_type', None)
+        self.word_boundary = self.key == 'content.body'
+        self.cache_key = (
+            'event_match', self.key, self.pattern, self.pattern_type,
+        )
+
+    def matches_for_event(self, evaluator):
+        value = self._get_value(evaluator)
+        if value is None:
+            return False
+
+        if self.pattern:
+            return bool(_glob_matches(self.pattern, value, self.word_boundary))
+
+        if self.pattern_type in ("user_id", "user_localpart"):
+            return None
+
+        logger.warn("event_match condition with no pattern")
+        return False
+
+    def matches_for_user(self, evaluator, user_id, display_name):
+        value = self._get_value(evaluator)
+        if value is None:
+            return False
+
+        pattern = self.pattern
         if not pattern:
-            pattern_type = condition.get('pattern_type', None)
-            if pattern_type == "user_id":
+            if self.pattern_type == "user_id":
                 pattern = user_id
-            elif pattern_type == "user_localpart":
+            elif self.pattern_type == "user_localpart":
                 pattern = UserID.from_string(user_id).localpart
 
         if not pattern:
             logger.warn("event_match condition with no pattern")
             return False
 
-        # XXX: optimisation: cache our pattern regexps
-        if condition['key'] == 'content.body':
-            body = self._event["content"].get("body", None)
-            if not body:
-                return False
+        return bool(_glob_matches(pattern, value, self.word_boundary))
+
+    def _get_value(self, evaluator):
+        if self.word_boundary:
+            return evaluator._get_body() or None
+        return evaluator._get_value(self.key)
 
-            return _glob_matches(pattern, body, word_boundary=True)
-        else:
-            haystack = self._get_value(condition['key'])
-            if haystack is None:
-                return False
 
-            return _glob_matches(pattern, haystack)
+class _ContainsDisplayNameCondition(object):
+    cache_key = ('contains_display_name',)
 
-    def _contains_display_name(self, display_name):
+    def matches_for_event(self, evaluator):
+        if not evaluator._get_body():
+            return False
+        return None
+
+    def matches_for_user(self, evaluator, user_id, display_name):
         if not display_name:
             return False
 
-        body = self._event["content"].get("body", None)
+        body = evaluator._get_body()
         if not body:
             return False
 
-        return _glob_matches(display_name, body, word_boundary=True)
+        return bool(_glob_matches(display_name, body, word_boundary=True))
 
-    def _get_value(self, dotted_key):
-        return self._value_cache.get(dotted_key, None)
+
+class _RoomMemberCountCondition(object):
+    def __init__(self, condition):
+        self.condition = condition
+        self.cache_key = ('room_member_count', condition.get('is', None))
+
+    def matches_for_event(self, evaluator):
+        return bool(_room_member_count(
+            evaluator._event, self.condition, evaluator._room_member_count
+        ))
+
+    def matches_for_user(self, evaluator, user_id, display_name):
+        return self.matches_for_event(evaluator)
+
+
+class _UnknownCondition(object):
+    def __init__(self, condition):
+        self.cache_key = ('unknown', condition['kind'])
+
+    def matches_for_event(self, evaluator):
+        return True
+
+    def matches_for_user(self, evaluator, user_id, display_name):
+        return True
+
+
+def _compile_condition(condition):
+    if condition['kind'] == 'event_match':
+        return _EventMatchCondition(condition)
+    elif condition['kind'] == 'contains_display_name':
+        return _ContainsDisplayNameCondition()
+    elif condition['kind'] == 'room_member_count':
+        return _RoomMemberCountCondition(condition)
+    else:
+        return _UnknownCondition(condition)
 
 
 def _glob_matches(glob, value, word_boundary=False):
@@ -137,6 +303,17 @@ def _glob_matches(glob, value, word_boundary=False):
     Returns:
         bool
     """
+    matcher = glob_matcher_cache.get((glob, word_boundary), None)
+    if matcher is None:
+        matcher = _glob_to_matcher(glob, word_boundary)
+        glob_matcher_cache[(glob, word_boundary)] = matcher
+
+    return matcher(value)
+
+
+def _glob_to_matcher(glob, word_boundary):
+    """Converts a glob into a function that tests whether a string matches it.
+    """
     try:
         if IS_GLOB.search(glob):
             r = re.escape(glob)
@@ -156,28 +333,25 @@ def _glob_matches(glob, value, word_boundary=False):
             )
             if word_boundary:
                 r = r"\b%s\b" % (r,)
-                r = _compile_regex(r)
-
-                return r.search(value)
+                return re.compile(r, flags=re.IGNORECASE).search
             else:
                 r = r + "$"
-                r = _compile_regex(r)
-
-                return r.match(value)
+                return re.compile(r, flags=re.IGNORECASE).match
         elif word_boundary:
             r = re.escape(glob)
             r = r"\b%s\b" % (r,)
-            r = _compile_regex(r)
-
-            return r.search(value)
+            return re.compile(r, flags=re.IGNORECASE).search
         else:
-            return value.lower() == glob.lower()
+            glob = glob.lower()
+            return lambda value: value.lower() == glob
     except re.error:
         logger.warn("Failed to parse glob to regex: %r", glob)
-        return False
+        return lambda value: False
 
 
-def _flatten_dict(d, prefix=[], result={}):
+def _flatten_dict(d, prefix=[], result=None):
+    if result is None:
+        result = {}
     for key, value in d.items():
         if isinstance(value, basestring):
             result[".".join(prefix + [key])] = value.lower()
@@ -187,14 +361,4 @@ def _flatten_dict(d, prefix=[], result={}):
     return result
 
 
-regex_cache = LruCache(5000)
-
-
-def _compile_regex(regex_str):
-    r = regex_cache.get(regex_str, None)
-    if r:
-        return r
-
-    r = re.compile(regex_str, flags=re.IGNORECASE)
-    regex_cache[regex_str] = r
-    return r
+glob_matcher_cache = LruCache(5000)
@@ -18,27 +18,16 @@ from twisted.internet import defer
 
 @defer.inlineCallbacks
 def get_badge_count(store, user_id):
-    invites, joins = yield defer.gatherResults([
+    invites, joins, notif_counts = yield defer.gatherResults([
         store.get_invited_rooms_for_user(user_id),
         store.get_rooms_for_user(user_id),
+        store.get_unread_notif_counts_for_user(user_id),
     ], consumeErrors=True)
 
-    my_receipts_by_room = yield store.get_receipts_for_user(
-        user_id, "m.read",
-    )
-
     badge = len(invites)
 
     for r in joins:
-        if r.room_id in my_receipts_by_room:
-            last_unread_event_id = my_receipts_by_room[r.room_id]
-
-            notifs = yield (
-                store.get_unread_event_push_actions_by_room_for_user(
-                    r.room_id, user_id, last_unread_event_id
-                )
-            )
-            badge += notifs["notify_count"]
+        badge += notif_counts.get(r.room_id, 0)
     defer.returnValue(badge)
 
 
@@ -19,21 +19,34 @@ from twisted.internet import defer
 import pusher
 from synapse.push import PusherConfigException
 from synapse.util.logcontext import preserve_fn
-from synapse.util.async import run_on_reactor
+from synapse.util.async import concurrently_execute, run_on_reactor
+import synapse.metrics
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+metrics = synapse.metrics.get_metrics_for(__name__)
+
 
 class PusherPool:
     def __init__(self, _hs):
         self.hs = _hs
         self.start_pushers = _hs.config.start_pushers
+        self.startup_concurrency = _hs.config.pusher_startup_concurrency
         self.store = self.hs.get_datastore()
         self.clock = self.hs.get_clock()
         self.pushers = {}
 
+        # Email pushers don't keep track of a backlog.
+        def count_backlog():
+            return sum(
+                getattr(p, "backlog", 0)
+                for byuser in self.pushers.values()
+                for p in byuser.values()
+            )
+        metrics.register_callback("backlog", count_backlog)
+
     @defer.inlineCallbacks
     def start(self):
         pushers = yield self.store.get_all_pushers()
@@ -182,6 +195,20 @@ class PusherPool:
             logger.info("Not starting pushers because they are disabled in the config")
             return
         logger.info("Starting %d pushers", len(pushers))
+
+        # Start the pushers for the most recently active users first. Clients
+        # set their pushers again when they start, so the time a pusher was
+        # set or last sent a notification tells us roughly when its user was
+        # last active without having to query for it.
+        pushers = sorted(
+            pushers,
+            key=lambda pusherdict: max(
+                pusherdict['ts'], pusherdict['last_success'] or 0
+            ),
+            reverse=True,
+        )
+
+        started = []
         for pusherdict in pushers:
             try:
                 p = pusher.create_pusher(self.hs, pusherdict)
@@ -198,9 +225,26 @@ class PusherPool:
                 if appid_pushkey in byuser:
                     byuser[appid_pushkey].on_stop()
                 byuser[appid_pushkey] = p
-                preserve_fn(p.on_started)()
+                started.append(p)
 
-        logger.info("Started pushers")
+        # Each pusher catches up on the notifications it missed when it
+        # starts, so only start a few at a time to avoid every pusher
+        # querying the database at once. Pushers that are given new
+        # notifications before they are started handle them straight away.
+        preserve_fn(concurrently_execute)(
+            self._start_pusher, started, self.startup_concurrency,
+        )
+
+    @defer.inlineCallbacks
+    def _start_pusher(self, p):
+        appid_pushkey = "%s:%s" % (p.app_id, p.pushkey)
+        if self.pushers.get(p.user_id, {}).get(appid_pushkey) is not p:
+            # The pusher was removed or replaced before it was started.
+            return
+        try:
+            yield p.on_started()
+        except:
+            logger.exception("Exception starting pusher %s", p.name)
 
     @defer.inlineCallbacks
     def remove_pusher(self, app_id, pushkey, user_id):
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.api.errors import SynapseError
+from synapse.http.server import respond_with_json, request_handler
+from synapse.http.servlet import parse_json_object_from_request
+
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+from twisted.internet import defer
+
+
+class FederationSendResource(Resource):
+    """
+    HTTP endpoint for handing incoming federation transactions, which have
+    already been authenticated by a federation reader, to the main synapse.
+
+    The request body is a JSON object with the transaction under
+    "transaction". The response is a JSON object with the "code" and
+    "response" that should be returned to the remote server.
+    """
+
+    def __init__(self, hs):
+        Resource.__init__(self)  # Resource is old-style, so no super()
+
+        self.version_string = hs.version_string
+        self.federation = hs.get_replication_layer()
+        self.clock = hs.get_clock()
+
+    def render_POST(self, request):
+        self._async_render_POST(request)
+        return NOT_DONE_YET
+
+    @request_handler()
+    @defer.inlineCallbacks
+    def _async_render_POST(self, request):
+        content = parse_json_object_from_request(request)
+
+        code, response = yield self.federation.on_incoming_transaction(
+            content["transaction"]
+        )
+
+        respond_with_json(request, 200, {
+            "code": code,
+            "response": response,
+        })
+
+
+class FederationQueryResource(Resource):
+    """
+    HTTP endpoint for answering federation queries received by a federation
+    reader that it can't answer itself.
+
+    The request body is a JSON object with the "query_type" and "args" of the
+    query. The response is a JSON object with the "code" and "response" that
+    should be returned to the remote server.
+    """
+
+    def __init__(self, hs):
+        Resource.__init__(self)  # Resource is old-style, so no super()
+
+        self.version_string = hs.version_string
+        self.federation = hs.get_replication_layer()
+        self.clock = hs.get_clock()
+
+    def render_POST(self, request):
+        self._async_render_POST(request)
+        return NOT_DONE_YET
+
+    @request_handler()
+    @defer.inlineCallbacks
+    def _async_render_POST(self, request):
+        content = parse_json_object_from_request(request)
+
+        try:
+            code, response = yield self.federation.on_query_request(
+                content["query_type"], content["args"]
+            )
+        except SynapseError as e:
+            code, response = e.code, e.error_dict()
+
+        respond_with_json(request, 200, {
+            "code": code,
+            "response": response,
+        })
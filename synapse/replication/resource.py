@@ -15,7 +15,13 @@
 
 from synapse.http.servlet import parse_integer, parse_string
 from synapse.http.server import request_handler, finish_request
+from synapse.replication.backfill_resource import BackfillResource
+from synapse.replication.federation_resource import (
+    FederationQueryResource, FederationSendResource,
+)
+from synapse.replication.presence_resource import PresenceResource
 from synapse.replication.pusher_resource import PusherResource
+from synapse.replication.stream_buffer import StreamRowBuffer
 
 from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET
@@ -40,6 +46,8 @@ STREAM_NAMES = (
     ("push_rules",),
     ("pushers",),
     ("state",),
+    ("federation",),
+    ("push_actions",),
 )
 
 
@@ -69,6 +77,12 @@ class ReplicationResource(Resource):
     * "backfill": Old events that have been backfilled from other servers.
     * "push_rules": Per user changes to push rules.
     * "pushers": Per user changes to their pushers.
+    * "state": New state groups.
+    * "federation": Things to be sent over federation by a federation sender
+      worker. Only available if the server isn't sending federation itself.
+    * "push_actions": The users with new push actions, by the stream ordering
+      of the event. Push actions are added after the events are persisted,
+      so this stream lags behind the "events" stream.
 
     The API takes two additional query parameters:
 
@@ -113,8 +127,30 @@ class ReplicationResource(Resource):
         self.typing_handler = hs.get_handlers().typing_notification_handler
         self.notifier = hs.notifier
         self.clock = hs.get_clock()
+        self.config = hs.get_config()
+
+        if not self.config.send_federation:
+            self.federation_sender = hs.get_federation_sender()
+
+        # Every worker polls for the same recent rows, so keep them in memory
+        # rather than querying the database once per worker.
+        self.events_buffer = StreamRowBuffer(
+            "replication_events_buffer", self._fetch_events, num_tables=3,
+            descending_tables=(1,),
+        )
+        self.receipts_buffer = StreamRowBuffer(
+            "replication_receipts_buffer", self._fetch_receipts, num_tables=1,
+        )
+        self.state_buffer = StreamRowBuffer(
+            "replication_state_buffer", self.store.get_all_new_state_groups,
+            num_tables=2,
+        )
 
         self.putChild("remove_pushers", PusherResource(hs))
+        self.putChild("federation_send", FederationSendResource(hs))
+        self.putChild("federation_query", FederationQueryResource(hs))
+        self.putChild("syncing_users", PresenceResource(hs))
+        self.putChild("backfill", BackfillResource(hs))
 
     def render_GET(self, request):
         self._async_render_GET(request)
@@ -127,6 +163,12 @@ class ReplicationResource(Resource):
         push_rules_token, room_stream_token = self.store.get_push_rules_stream_token()
         pushers_token = self.store.get_pushers_stream_token()
         state_token = self.store.get_state_stream_token()
+        push_actions_token = self.store.get_push_actions_stream_token()
+
+        if self.config.send_federation:
+            federation_token = 0
+        else:
+            federation_token = self.federation_sender.get_current_token()
 
         defer.returnValue(_ReplicationToken(
             room_stream_token,
@@ -138,6 +180,8 @@ class ReplicationResource(Resource):
             push_rules_token,
             pushers_token,
             state_token,
+            federation_token,
+            push_actions_token,
         ))
 
     @request_handler()
@@ -177,6 +221,8 @@ class ReplicationResource(Resource):
         yield self.push_rules(writer, current_token, limit, request_streams)
         yield self.pushers(writer, current_token, limit, request_streams)
         yield self.state(writer, current_token, limit, request_streams)
+        self.federation(writer, current_token, limit, request_streams)
+        yield self.push_actions(writer, current_token, limit, request_streams)
         self.streams(writer, current_token, request_streams)
 
         logger.info("Replicated %d rows", writer.total)
@@ -217,19 +263,25 @@ class ReplicationResource(Resource):
                 request_events = current_token.events
             if request_backfill is None:
                 request_backfill = current_token.backfill
+            new_forward_events, forward_ex_outliers, state_resets = (
+                yield self.events_buffer.get_rows(
+                    request_events, current_token.events, limit
+                )
+            )
+            # Backfill is rare, so it isn't worth buffering.
             res = yield self.store.get_all_new_events(
-                request_backfill, request_events,
+                request_backfill, current_token.events,
                 current_token.backfill, current_token.events,
                 limit
             )
-            writer.write_header_and_rows("events", res.new_forward_events, (
+            writer.write_header_and_rows("events", new_forward_events, (
                 "position", "internal", "json", "state_group"
             ))
             writer.write_header_and_rows("backfill", res.new_backfill_events, (
                 "position", "internal", "json", "state_group"
             ))
             writer.write_header_and_rows(
-                "forward_ex_outliers", res.forward_ex_outliers,
+                "forward_ex_outliers", forward_ex_outliers,
                 ("position", "event_id", "state_group")
             )
             writer.write_header_and_rows(
@@ -237,9 +289,19 @@ class ReplicationResource(Resource):
                 ("position", "event_id", "state_group")
             )
             writer.write_header_and_rows(
-                "state_resets", res.state_resets, ("position",)
+                "state_resets", state_resets, ("position",)
             )
 
+    def _fetch_events(self, from_position, to_position, limit):
+        backfill_token = self.store.get_current_backfill_token()
+        d = self.store.get_all_new_events(
+            backfill_token, from_position, backfill_token, to_position, limit
+        )
+        d.addCallback(lambda res: (
+            res.new_forward_events, res.forward_ex_outliers, res.state_resets,
+        ))
+        return d
+
     @defer.inlineCallbacks
     def presence(self, writer, current_token, request_streams):
         current_position = current_token.presence
@@ -258,7 +320,7 @@ class ReplicationResource(Resource):
 
     @defer.inlineCallbacks
     def typing(self, writer, current_token, request_streams):
-        current_position = current_token.presence
+        current_position = current_token.typing
 
         request_typing = request_streams.get("typing")
 
@@ -277,7 +339,7 @@ class ReplicationResource(Resource):
         request_receipts = request_streams.get("receipts")
 
         if request_receipts is not None:
-            receipts_rows = yield self.store.get_all_updated_receipts(
+            receipts_rows, = yield self.receipts_buffer.get_rows(
                 request_receipts, current_position, limit
             )
             writer.write_header_and_rows("receipts", receipts_rows, (
@@ -357,9 +419,7 @@ class ReplicationResource(Resource):
 
         if state is not None:
             state_groups, state_group_state = (
-                yield self.store.get_all_new_state_groups(
-                    state, current_position, limit
-                )
+                yield self.state_buffer.get_rows(state, current_position, limit)
             )
             writer.write_header_and_rows("state_groups", state_groups, (
                 "position", "room_id", "event_id"
@@ -368,6 +428,43 @@ class ReplicationResource(Resource):
                 "position", "type", "state_key", "event_id"
             ))
 
+    @defer.inlineCallbacks
+    def push_actions(self, writer, current_token, limit, request_streams):
+        current_position = current_token.push_actions
+
+        push_actions = request_streams.get("push_actions")
+
+        if push_actions is not None and push_actions < current_position:
+            position, rows = yield self.store.get_all_push_action_updates(
+                push_actions, current_position, limit
+            )
+            # The position can be past the last row, as most events don't
+            # have any push actions.
+            writer.write_header_and_rows("push_actions", rows, (
+                "position", "room_id", "user_id",
+            ), position=position)
+
+    def _fetch_receipts(self, from_position, to_position, limit):
+        d = self.store.get_all_updated_receipts(from_position, to_position, limit)
+        d.addCallback(lambda rows: (rows,))
+        return d
+
+    def federation(self, writer, current_token, limit, request_streams):
+        if self.config.send_federation:
+            return
+
+        current_position = current_token.federation
+
+        federation = request_streams.get("federation")
+
+        if federation is not None and federation != current_position:
+            federation_rows = self.federation_sender.get_replication_rows(
+                federation, current_position, limit,
+            )
+            writer.write_header_and_rows("federation", federation_rows, (
+                "position", "type", "content",
+            ))
+
 
 class _Writer(object):
     """Writes the streams as a JSON object as the response to the request"""
@@ -376,7 +473,9 @@ class _Writer(object):
         self.total = 0
 
     def write_header_and_rows(self, name, rows, fields, position=None):
-        if not rows:
+        # A stream whose position can move past its last row is written even
+        # if there are no rows, otherwise the position would never advance.
+        if not rows and position is None:
             return
 
         if position is None:
@@ -396,7 +495,7 @@ class _Writer(object):
 
 class _ReplicationToken(collections.namedtuple("_ReplicationToken", (
     "events", "presence", "typing", "receipts", "account_data", "backfill",
-    "push_rules", "pushers", "state"
+    "push_rules", "pushers", "state", "federation", "push_actions",
 ))):
     __slots__ = []
 
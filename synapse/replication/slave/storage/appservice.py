@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ._base import BaseSlavedStore
+
+from synapse.storage import DataStore
+from synapse.storage.appservice import ApplicationServiceStore
+
+
+class SlavedApplicationServiceStore(BaseSlavedStore):
+    def __init__(self, db_conn, hs):
+        super(SlavedApplicationServiceStore, self).__init__(db_conn, hs)
+        self.services_cache = ApplicationServiceStore.load_appservices(
+            hs.hostname,
+            hs.config.app_service_config_files
+        )
+
+    get_app_services = DataStore.get_app_services.__func__
+    get_app_service_by_user_id = DataStore.get_app_service_by_user_id.__func__
+    get_app_service_by_token = DataStore.get_app_service_by_token.__func__
+    get_app_service_rooms = DataStore.get_app_service_rooms.__func__
+    _get_app_service_rooms_txn = DataStore._get_app_service_rooms_txn.__func__
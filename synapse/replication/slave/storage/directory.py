@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .events import SlavedEventStore
+
+from synapse.api.constants import EventTypes
+from synapse.storage.directory import DirectoryStore
+
+
+class SlavedDirectoryStore(SlavedEventStore):
+    get_aliases_for_room = DirectoryStore.__dict__["get_aliases_for_room"]
+
+    def invalidate_caches_for_event(self, event, backfilled, reset_state):
+        super(SlavedDirectoryStore, self).invalidate_caches_for_event(
+            event, backfilled, reset_state
+        )
+
+        # The main synapse sends an aliases event whenever the aliases for a
+        # room are changed, so use that to invalidate the cached aliases.
+        if event.type == EventTypes.Aliases:
+            self.get_aliases_for_room.invalidate((event.room_id,))
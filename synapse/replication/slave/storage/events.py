@@ -23,10 +23,16 @@ from synapse.storage.roommember import RoomMemberStore
 from synapse.storage.event_federation import EventFederationStore
 from synapse.storage.event_push_actions import EventPushActionsStore
 from synapse.storage.state import StateStore
+from synapse.storage.stream import StreamStore
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 
+from twisted.internet import defer
+
+import logging
 import ujson as json
 
+logger = logging.getLogger(__name__)
+
 # So, um, we want to borrow a load of functions intended for reading from
 # a DataStore, but we don't want to take functions that either write to the
 # DataStore or are cached and don't have cache invalidation logic.
@@ -57,12 +63,21 @@ class SlavedEventStore(BaseSlavedStore):
             "EventsRoomStreamChangeCache", min_event_val,
             prefilled_cache=event_cache_prefill,
         )
+        self._membership_stream_cache = StreamChangeCache(
+            "MembershipStreamChangeCache", events_max,
+        )
+        self._push_actions_stream_position = (
+            self._get_push_actions_stream_position(db_conn)
+        )
 
     # Cached functions can't be accessed through a class instance so we need
     # to reach inside the __dict__ to extract them.
     get_room_name_and_aliases = RoomStore.__dict__["get_room_name_and_aliases"]
     get_rooms_for_user = RoomMemberStore.__dict__["get_rooms_for_user"]
     get_users_in_room = RoomMemberStore.__dict__["get_users_in_room"]
+    get_joined_hosts_for_room = RoomMemberStore.__dict__[
+        "get_joined_hosts_for_room"
+    ]
     get_latest_event_ids_in_room = EventFederationStore.__dict__[
         "get_latest_event_ids_in_room"
     ]
@@ -75,6 +90,29 @@ class SlavedEventStore(BaseSlavedStore):
     get_unread_event_push_actions_by_room_for_user = (
         EventPushActionsStore.__dict__["get_unread_event_push_actions_by_room_for_user"]
     )
+    get_unread_notif_counts_for_user = (
+        EventPushActionsStore.__dict__["get_unread_notif_counts_for_user"]
+    )
+    _get_state_group_for_event = (
+        StateStore.__dict__["_get_state_group_for_event"]
+    )
+    _get_state_group_for_events = (
+        StateStore.__dict__["_get_state_group_for_events"]
+    )
+    _get_state_group_from_group = (
+        StateStore.__dict__["_get_state_group_from_group"]
+    )
+    _get_state_groups_from_groups = (
+        StateStore.__dict__["_get_state_groups_from_groups"]
+    )
+    get_recent_event_ids_for_room = (
+        StreamStore.__dict__["get_recent_event_ids_for_room"]
+    )
+
+    # Forgetting a room doesn't go over replication, but it only hides history
+    # from users who have already left the room.
+    who_forgot_in_room = RoomMemberStore.__dict__["who_forgot_in_room"]
+    did_forget = RoomMemberStore.__dict__["did_forget"]
 
     get_unread_push_actions_for_user_in_range = (
         DataStore.get_unread_push_actions_for_user_in_range.__func__
@@ -82,7 +120,20 @@ class SlavedEventStore(BaseSlavedStore):
     get_push_action_users_in_range = (
         DataStore.get_push_action_users_in_range.__func__
     )
+    get_push_actions_stream_token = (
+        DataStore.get_push_actions_stream_token.__func__
+    )
+    _get_push_actions_stream_position = (
+        DataStore._get_push_actions_stream_position.__func__
+    )
+    _count_unread_push_actions_txn = (
+        DataStore._count_unread_push_actions_txn.__func__
+    )
+    _count_unread_push_actions_for_receipt_txn = (
+        DataStore._count_unread_push_actions_for_receipt_txn.__func__
+    )
     get_event = DataStore.get_event.__func__
+    get_events = DataStore.get_events.__func__
     get_current_state = DataStore.get_current_state.__func__
     get_current_state_for_key = DataStore.get_current_state_for_key.__func__
     get_rooms_for_user_where_membership_is = (
@@ -92,11 +143,32 @@ class SlavedEventStore(BaseSlavedStore):
         DataStore.get_membership_changes_for_user.__func__
     )
     get_room_events_max_id = DataStore.get_room_events_max_id.__func__
+    get_state_groups = DataStore.get_state_groups.__func__
+    get_state_for_events = DataStore.get_state_for_events.__func__
+    get_state_for_event = DataStore.get_state_for_event.__func__
+    get_auth_chain = DataStore.get_auth_chain.__func__
+    get_auth_chain_ids = DataStore.get_auth_chain_ids.__func__
+    get_backfill_events = DataStore.get_backfill_events.__func__
+    get_missing_events = DataStore.get_missing_events.__func__
     get_room_events_stream_for_room = (
         DataStore.get_room_events_stream_for_room.__func__
     )
+    get_room_events_stream_for_rooms = (
+        DataStore.get_room_events_stream_for_rooms.__func__
+    )
+    get_recent_events_for_room = DataStore.get_recent_events_for_room.__func__
+    get_stream_token_for_event = DataStore.get_stream_token_for_event.__func__
+    get_appservice_room_stream = DataStore.get_appservice_room_stream.__func__
+    paginate_room_events = DataStore.paginate_room_events.__func__
+    get_events_around = DataStore.get_events_around.__func__
+    get_topological_token_for_event = (
+        DataStore.get_topological_token_for_event.__func__
+    )
+    get_max_topological_token_for_stream_and_room = (
+        DataStore.get_max_topological_token_for_stream_and_room.__func__
+    )
 
-    _set_before_and_after = DataStore._set_before_and_after
+    _set_before_and_after = staticmethod(DataStore._set_before_and_after)
 
     _get_events = DataStore._get_events.__func__
     _get_events_from_cache = DataStore._get_events_from_cache.__func__
@@ -114,11 +186,72 @@ class SlavedEventStore(BaseSlavedStore):
         DataStore._get_rooms_for_user_where_membership_is_txn.__func__
     )
     _get_members_rows_txn = DataStore._get_members_rows_txn.__func__
+    _get_joined_hosts_for_room_txn = (
+        DataStore._get_joined_hosts_for_room_txn.__func__
+    )
+    _get_state_for_groups = DataStore._get_state_for_groups.__func__
+    _get_all_state_from_cache = DataStore._get_all_state_from_cache.__func__
+    _get_some_state_from_cache = DataStore._get_some_state_from_cache.__func__
+    _get_auth_chain_ids_txn = DataStore._get_auth_chain_ids_txn.__func__
+    _get_backfill_events = DataStore._get_backfill_events.__func__
+    _get_missing_events = DataStore._get_missing_events.__func__
+    _get_max_topological_txn = DataStore._get_max_topological_txn.__func__
+    _get_events_around_txn = DataStore._get_events_around_txn.__func__
+
+    @defer.inlineCallbacks
+    def warm_caches(self, room_limit, event_limit=20, stream_window=10000):
+        """Preload the caches for the rooms that have been most active over
+        the last `stream_window` positions of the events stream, so that a
+        freshly started worker doesn't have to fetch every room's recent
+        events and current state from the database one request at a time.
+
+        This should finish before the worker starts replicating so that the
+        events it loads are invalidated by any redactions that arrive over
+        replication afterwards.
+
+        Args:
+            room_limit (int): The maximum number of rooms to warm.
+            event_limit (int): The number of recent events to load per room.
+            stream_window (int): How far back in the events stream to look
+                when picking the most active rooms.
+        """
+        current_token = self._stream_id_gen.get_current_token()
+
+        def get_most_active_rooms_txn(txn):
+            sql = (
+                "SELECT room_id FROM events"
+                " WHERE ? < stream_ordering AND stream_ordering <= ?"
+                " AND outlier = ?"
+                " GROUP BY room_id"
+                " ORDER BY COUNT(*) DESC"
+                " LIMIT ?"
+            )
+            txn.execute(sql, (
+                current_token - stream_window, current_token, False, room_limit,
+            ))
+            return [r[0] for r in txn.fetchall()]
+
+        room_ids = yield self.runInteraction(
+            "get_most_active_rooms", get_most_active_rooms_txn
+        )
+
+        end_token = "s%d" % (current_token,)
+        for room_id in room_ids:
+            yield self.get_recent_events_for_room(
+                room_id, limit=event_limit, end_token=end_token,
+            )
+
+            yield self.get_current_state(room_id)
+            yield self.get_users_in_room(room_id)
+            yield self.get_joined_hosts_for_room(room_id)
+
+        logger.info("Warmed caches for %d rooms", len(room_ids))
 
     def stream_positions(self):
         result = super(SlavedEventStore, self).stream_positions()
         result["events"] = self._stream_id_gen.get_current_token()
         result["backfill"] = -self._backfill_id_gen.get_current_token()
+        result["push_actions"] = self._push_actions_stream_position
         return result
 
     def process_replication(self, result):
@@ -154,6 +287,23 @@ class SlavedEventStore(BaseSlavedStore):
                 event_id = row[1]
                 self._invalidate_get_event_cache(event_id)
 
+        stream = result.get("push_actions")
+        if stream:
+            self._push_actions_stream_position = stream["position"]
+            for position, room_id, user_id in stream["rows"]:
+                self.get_unread_event_push_actions_by_room_for_user.invalidate_many(
+                    (room_id, user_id)
+                )
+                self.get_unread_notif_counts_for_user.invalidate((user_id,))
+
+        # The unread notification counts depend on the users' read receipts.
+        stream = result.get("receipts")
+        if stream:
+            for row in stream["rows"]:
+                position, room_id, receipt_type, user_id = row[:4]
+                if receipt_type == "m.read":
+                    self.get_unread_notif_counts_for_user.invalidate((user_id,))
+
         return super(SlavedEventStore, self).process_replication(result)
 
     def _process_replication_row(self, row, backfilled, state_resets):
@@ -170,7 +320,7 @@ class SlavedEventStore(BaseSlavedStore):
             self._get_current_state_for_key.invalidate_all()
             self.get_rooms_for_user.invalidate_all()
             self.get_users_in_room.invalidate((event.room_id,))
-            # self.get_joined_hosts_for_room.invalidate((event.room_id,))
+            self.get_joined_hosts_for_room.invalidate((event.room_id,))
             self.get_room_name_and_aliases.invalidate((event.room_id,))
 
         self._invalidate_get_event_cache(event.event_id)
@@ -186,20 +336,20 @@ class SlavedEventStore(BaseSlavedStore):
                 event.room_id, event.internal_metadata.stream_ordering
             )
 
-        # self.get_unread_event_push_actions_by_room_for_user.invalidate_many(
-        #     (event.room_id,)
-        # )
-
         if event.type == EventTypes.Redaction:
             self._invalidate_get_event_cache(event.redacts)
+            # We don't know which users had push actions for the redacted
+            # event.
+            self.get_unread_notif_counts_for_user.invalidate_all()
 
         if event.type == EventTypes.Member:
             self.get_rooms_for_user.invalidate((event.state_key,))
-            # self.get_joined_hosts_for_room.invalidate((event.room_id,))
+            self.get_joined_hosts_for_room.invalidate((event.room_id,))
             self.get_users_in_room.invalidate((event.room_id,))
-            # self._membership_stream_cache.entity_has_changed(
-            #    event.state_key, event.internal_metadata.stream_ordering
-            # )
+            if not backfilled:
+                self._membership_stream_cache.entity_has_changed(
+                    event.state_key, event.internal_metadata.stream_ordering
+                )
             self.get_invited_rooms_for_user.invalidate((event.state_key,))
 
         if not event.is_state():
@@ -220,4 +370,3 @@ class SlavedEventStore(BaseSlavedStore):
             self.get_room_name_and_aliases.invalidate(
                 (event.room_id,)
             )
-            pass
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ._base import BaseSlavedStore
+
+from synapse.storage import DataStore
+from synapse.storage.registration import RegistrationStore
+
+
+class SlavedRegistrationStore(BaseSlavedStore):
+    # Access tokens can be deleted on the master, e.g. on logout, and there is
+    # no replication stream to tell us so. So we take the uncached function
+    # rather than risk accepting a token that has been revoked.
+    get_user_by_access_token = RegistrationStore.__dict__[
+        "get_user_by_access_token"
+    ].orig
+
+    # A user's guest status never changes once they have registered.
+    is_guest = RegistrationStore.__dict__["is_guest"]
+
+    _query_for_auth = DataStore._query_for_auth.__func__
+    get_user_by_id = DataStore.get_user_by_id.__func__
+    is_server_admin = DataStore.is_server_admin.__func__
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ._base import BaseSlavedStore
+
+from synapse.storage import DataStore
+from synapse.storage.transactions import TransactionStore
+from synapse.storage.util.id_generators import IdGenerator
+
+from twisted.internet import reactor
+
+# Unlike the other slaved stores this one writes to the database. When a
+# federation sender worker is in use the main synapse doesn't send any
+# federation traffic, so the worker is the only thing writing to the
+# sent_transactions, destinations, federation_stream_position and srv_cache
+# tables. The main synapse still adds PDUs to the federation_outbox, which the
+# worker removes them from once they have been sent.
+
+
+class TransactionSlavedStore(BaseSlavedStore):
+
+    def __init__(self, db_conn, hs):
+        super(TransactionSlavedStore, self).__init__(db_conn, hs)
+
+        self._transaction_id_gen = IdGenerator(db_conn, "sent_transactions", "id")
+
+        # See TransactionStore.__init__
+        self.inflight_transactions = {}
+        self.new_delivered_transactions = {}
+        self.update_delivered_transactions = {}
+        self.last_transaction = {}
+
+        reactor.addSystemEventTrigger("before", "shutdown", self._persist_in_mem_txns)
+        hs.get_clock().looping_call(
+            self._persist_in_mem_txns,
+            1000,
+        )
+
+    get_destination_retry_timings = TransactionStore.__dict__[
+        "get_destination_retry_timings"
+    ]
+
+    _get_destination_retry_timings = (
+        DataStore._get_destination_retry_timings.__func__
+    )
+    set_destination_retry_timings = (
+        DataStore.set_destination_retry_timings.__func__
+    )
+    _set_destination_retry_timings = (
+        DataStore._set_destination_retry_timings.__func__
+    )
+
+    prep_send_transaction = DataStore.prep_send_transaction.__func__
+    _get_prevs_txn = DataStore._get_prevs_txn.__func__
+    delivered_txn = DataStore.delivered_txn.__func__
+    _persist_in_mem_txns = DataStore._persist_in_mem_txns.__func__
+
+    get_federation_outbox = DataStore.get_federation_outbox.__func__
+    delete_from_federation_outbox = (
+        DataStore.delete_from_federation_outbox.__func__
+    )
+    get_destinations_with_federation_outbox = (
+        DataStore.get_destinations_with_federation_outbox.__func__
+    )
+    get_federation_out_pos = DataStore.get_federation_out_pos.__func__
+    update_federation_out_pos = DataStore.update_federation_out_pos.__func__
+
+    get_srv_cache = DataStore.get_srv_cache.__func__
+    store_srv_cache = DataStore.store_srv_cache.__func__
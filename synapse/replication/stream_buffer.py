@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches import cache_counter, caches_by_name
+from synapse.util.caches.response_cache import ResponseCache
+
+from twisted.internet import defer
+
+import bisect
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StreamRowBuffer(object):
+    """An in-memory buffer of the most recent rows of a replication stream.
+
+    Workers tend to poll for a stream from the same position, so rather than
+    every worker running the same query against the database the rows are kept
+    in memory and only workers that have fallen behind the start of the buffer
+    hit the database. Identical queries that are in flight at the same time
+    are also only run once.
+
+    A stream is made up of one or more tables of rows, each of which has its
+    position as its first column. The buffer holds every row with a position
+    in ``(start, end]``, and drops the oldest rows once it holds more than
+    ``max_rows`` rows across all of its tables.
+
+    Args:
+        name (str): Name of the buffer, for metrics.
+        fetch (callable): Called with ``(from_position, to_position, limit)``
+            and returns a deferred list of tables of rows from the database.
+        num_tables (int): The number of tables ``fetch`` returns.
+        limited_tables (tuple): The indexes of the tables that ``fetch`` stops
+            returning rows for once it reaches the limit. Every other table is
+            assumed to have all the rows up to the last row returned in any of
+            the limited tables.
+        descending_tables (tuple): The indexes of the tables that ``fetch``
+            returns in descending order of position.
+        max_rows (int): The total number of rows to keep in memory.
+    """
+
+    def __init__(self, name, fetch, num_tables, limited_tables=(0,),
+                 descending_tables=(), max_rows=1000):
+        self.name = name
+        self.fetch = fetch
+        self.limited_tables = limited_tables
+        self.descending_tables = descending_tables
+        self.max_rows = max_rows
+
+        self.start = None
+        self.end = None
+        self._positions = [[] for _ in range(num_tables)]
+        self._rows = [[] for _ in range(num_tables)]
+
+        self._pending = ResponseCache()
+
+        caches_by_name[name] = self
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._rows)
+
+    def get_rows(self, from_position, to_position, limit):
+        """Get the rows in the stream after ``from_position`` up to and
+        including ``to_position``, in the same form as ``fetch``.
+        """
+        if from_position >= to_position:
+            return defer.succeed([[] for _ in self._rows])
+
+        if self.start is not None:
+            if self.start <= from_position and to_position <= self.end:
+                cache_counter.inc_hits(self.name)
+                return defer.succeed(
+                    self._get_buffered_rows(from_position, to_position, limit)
+                )
+
+        cache_counter.inc_misses(self.name)
+
+        key = (from_position, to_position, limit)
+        result = self._pending.get(key)
+        if result is None:
+            result = self._pending.set(
+                key, self._fetch_rows(from_position, to_position, limit)
+            )
+        return result
+
+    @defer.inlineCallbacks
+    def _fetch_rows(self, from_position, to_position, limit):
+        tables = yield self.fetch(from_position, to_position, limit)
+
+        # Work out how far the fetched rows are complete up to.
+        upper_bound = to_position
+        for index in self.limited_tables:
+            rows = tables[index]
+            if len(rows) >= limit:
+                upper_bound = min(upper_bound, rows[-1][0])
+
+        if self.start is None or from_position > self.end:
+            # Either we've not buffered anything yet or we've been left
+            # behind, so start buffering again from here.
+            self._clear(from_position)
+
+        if from_position <= self.end < upper_bound:
+            self._append(tables, upper_bound)
+
+        defer.returnValue(tables)
+
+    def _clear(self, position):
+        self.start = position
+        self.end = position
+        for positions, rows in zip(self._positions, self._rows):
+            del positions[:]
+            del rows[:]
+
+    def _append(self, tables, upper_bound):
+        for index, new_rows in enumerate(tables):
+            new_rows = sorted(
+                (row for row in new_rows if self.end < row[0] <= upper_bound),
+                key=lambda row: row[0],
+            )
+            self._positions[index].extend(row[0] for row in new_rows)
+            self._rows[index].extend(new_rows)
+        self.end = upper_bound
+
+        excess = len(self) - self.max_rows
+        if excess > 0:
+            # Drop the oldest rows in any of the tables, along with every
+            # other row up to the same position.
+            self.start = next(itertools.islice(
+                heapq.merge(*self._positions), excess - 1, None
+            ))
+            for positions, rows in zip(self._positions, self._rows):
+                index = bisect.bisect_right(positions, self.start)
+                del positions[:index]
+                del rows[:index]
+
+    def _get_buffered_rows(self, from_position, to_position, limit):
+        upper_bound = to_position
+        for index in self.limited_tables:
+            positions = self._positions[index]
+            lower = bisect.bisect_right(positions, from_position)
+            upper = bisect.bisect_right(positions, to_position)
+            if upper - lower >= limit:
+                upper_bound = min(upper_bound, positions[lower + limit - 1])
+
+        tables = []
+        for index, (positions, rows) in enumerate(zip(self._positions, self._rows)):
+            lower = bisect.bisect_right(positions, from_position)
+            upper = bisect.bisect_right(positions, upper_bound)
+            table = rows[lower:upper]
+            if index in self.descending_tables:
+                table.reverse()
+            tables.append(table)
+
+        return tables
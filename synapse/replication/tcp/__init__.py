@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A line based protocol for streaming replication over a persistent TCP
+connection.
+
+Each line is a command name, optionally followed by a space and the argument
+to the command. Workers connect to a "replication" listener on the main synapse
+and send:
+
+* ``NAME <name>``: A name for the worker to use in the logs.
+* ``REPLICATE <json>``: Subscribes to the streams given as a JSON object of
+  stream name to position, in the same form as the query parameters of the
+  HTTP replication API. A "limit" key limits the rows sent at once. Sending
+  ``REPLICATE`` again replaces the existing subscription.
+
+The main synapse sends:
+
+* ``SERVER <server_name>``: Sent when the connection is made.
+* ``RDATA <json>``: New rows for the subscribed streams, in the same form as
+  the response of the HTTP replication API.
+* ``PING <timestamp>``: Sent when there has been nothing else to send for a
+  while, so the worker can tell that the connection is still alive.
+* ``ERROR <message>``: Sent before closing the connection because of a bad
+  command.
+"""
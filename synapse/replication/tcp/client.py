@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The worker side of the TCP replication protocol.
+
+See ``synapse.replication.tcp`` for a description of the protocol.
+"""
+
+from synapse.util.async import Linearizer
+from synapse.util.logcontext import LoggingContext, preserve_fn
+
+from twisted.internet import defer, reactor
+from twisted.internet.protocol import ReconnectingClientFactory
+from twisted.protocols.basic import LineOnlyReceiver
+
+import ujson as json
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How long to wait without hearing anything from the main synapse before
+# assuming the connection is dead and reconnecting.
+PING_TIMEOUT_MS = 30 * 1000
+
+# How many batches of rows can be waiting to be processed before we stop
+# reading from the connection, so that the main synapse stops sending them.
+MAX_PENDING_BATCHES = 10
+
+
+def start_replication(hs, client_name, stream_positions, process_replication):
+    """Streams replication from the "replication" listener given by the
+    ``replication_tcp_host`` and ``replication_tcp_port`` of the worker config.
+
+    See ``ReplicationClientFactory`` for the arguments.
+    """
+    factory = ReplicationClientFactory(
+        hs, client_name, stream_positions, process_replication
+    )
+    reactor.connectTCP(
+        hs.config.replication_tcp_host, hs.config.replication_tcp_port, factory
+    )
+    return factory
+
+
+class ReplicationClientFactory(ReconnectingClientFactory):
+    """Connects to the replication listener of the main synapse and reconnects
+    whenever the connection is lost.
+
+    Args:
+        hs (synapse.server.HomeServer)
+        client_name (str): The name the worker uses in the logs of the main
+            synapse.
+        stream_positions (callable): Returns a dict of the positions of the
+            streams to subscribe to, like the query parameters to the HTTP
+            replication API. Called every time the worker (re)connects.
+        process_replication (callable): Called with each batch of rows, in the
+            same form as the response of the HTTP replication API. Batches
+            are processed one at a time and in order.
+    """
+
+    maxDelay = 5
+
+    def __init__(self, hs, client_name, stream_positions, process_replication):
+        self.clock = hs.get_clock()
+        self.client_name = client_name
+        self.stream_positions = stream_positions
+        self.process_replication = process_replication
+
+        self.linearizer = Linearizer()
+
+    def buildProtocol(self, addr):
+        logger.info("Connected to replication: %r", addr)
+        self.resetDelay()
+        return ReplicationClientProtocol(self)
+
+    def clientConnectionLost(self, connector, reason):
+        logger.error("Lost replication connection: %r", reason)
+        ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        logger.error("Failed to connect to replication: %r", reason)
+        ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason
+        )
+
+
+class ReplicationClientProtocol(LineOnlyReceiver):
+    delimiter = "\n"
+
+    # The rows for a stream are sent as a single line, so allow for large
+    # batches of events.
+    MAX_LENGTH = 100 * 1024 * 1024
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.clock = factory.clock
+        self.linearizer = factory.linearizer
+
+        self.last_received_ms = self.clock.time_msec()
+        self.check_ping = None
+
+        # Set if processing a batch of rows failed, so that we don't process
+        # any of the later batches sent on this connection.
+        self.failed = False
+
+        # The number of batches of rows received but not yet processed.
+        self.pending_batches = 0
+        self.paused = False
+
+    def connectionMade(self):
+        self.send_command("NAME", self.factory.client_name)
+        preserve_fn(self._subscribe)()
+
+        self.check_ping = self.clock.looping_call(
+            self._check_ping, PING_TIMEOUT_MS / 3
+        )
+
+    def connectionLost(self, reason):
+        if self.check_ping:
+            self.check_ping.stop()
+            self.check_ping = None
+
+    def send_command(self, command, arg):
+        self.sendLine("%s %s" % (command, arg))
+
+    @defer.inlineCallbacks
+    def _subscribe(self):
+        # Wait for any rows from a previous connection to be processed so
+        # that we subscribe from the right positions.
+        with (yield self.linearizer.queue("replication")):
+            positions = self.factory.stream_positions()
+            self.send_command("REPLICATE", json.dumps(positions))
+
+    def _check_ping(self):
+        if self.paused:
+            # We aren't reading anything, so we won't see the pings.
+            return
+        now = self.clock.time_msec()
+        if now - self.last_received_ms > PING_TIMEOUT_MS:
+            logger.info("Replication connection timed out, reconnecting")
+            self.transport.loseConnection()
+
+    def lineReceived(self, line):
+        self.last_received_ms = self.clock.time_msec()
+
+        command, _, arg = line.partition(" ")
+
+        if command == "RDATA":
+            self.pending_batches += 1
+            if self.pending_batches >= MAX_PENDING_BATCHES and not self.paused:
+                # Stop reading until we've caught up, which pushes back on
+                # the main synapse through TCP flow control.
+                logger.info("Replication is falling behind, pausing")
+                self.paused = True
+                self.transport.pauseProducing()
+            preserve_fn(self._process_rows)(json.loads(arg))
+        elif command == "ERROR":
+            logger.error("Replication error from main synapse: %s", arg)
+        elif command not in ("SERVER", "PING"):
+            logger.warn("Unknown replication command %r", command)
+
+    def lineLengthExceeded(self, line):
+        logger.error("Replication line too long, reconnecting")
+        self.transport.loseConnection()
+
+    @defer.inlineCallbacks
+    def _process_rows(self, result):
+        try:
+            with (yield self.linearizer.queue("replication")):
+                if self.failed:
+                    return
+                try:
+                    with LoggingContext("replication"):
+                        yield self.factory.process_replication(result)
+                except:
+                    # Reconnect so that we resubscribe from what we have
+                    # actually processed rather than silently skipping the
+                    # rows.
+                    logger.exception("Error processing replication rows")
+                    self.failed = True
+                    self.transport.loseConnection()
+        finally:
+            self.pending_batches -= 1
+            if self.paused and self.pending_batches < MAX_PENDING_BATCHES:
+                logger.info("Replication has caught up, resuming")
+                self.paused = False
+                self.last_received_ms = self.clock.time_msec()
+                self.transport.resumeProducing()
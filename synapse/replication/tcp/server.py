@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The main synapse side of the TCP replication protocol.
+
+See ``synapse.replication.tcp`` for a description of the protocol.
+"""
+
+from synapse.replication.resource import STREAM_NAMES
+from synapse.util.logcontext import preserve_fn
+
+from twisted.internet import defer
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import LineOnlyReceiver
+
+import ujson as json
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for new rows before sending a PING.
+PING_INTERVAL_MS = 5 * 1000
+
+# The default maximum number of rows to send for each stream at once.
+DEFAULT_LIMIT = 100
+
+
+class ReplicationStreamProtocolFactory(Factory):
+    """Accepts replication connections from workers."""
+
+    def __init__(self, hs):
+        self.server_name = hs.hostname
+        self.clock = hs.get_clock()
+        self.notifier = hs.get_notifier()
+        self.replication = hs.get_replication_resource()
+
+    def buildProtocol(self, addr):
+        return ReplicationStreamProtocol(self)
+
+
+class ReplicationStreamProtocol(LineOnlyReceiver):
+    """Pushes rows to a worker as they are written.
+
+    Rather than re-running every stream whenever the notifier fires, only the
+    streams whose current position is ahead of the position last sent to the
+    worker are queried.
+    """
+
+    delimiter = "\n"
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.clock = factory.clock
+        self.notifier = factory.notifier
+        self.replication = factory.replication
+
+        self.name = None
+        self.streams = {}
+        self.limit = DEFAULT_LIMIT
+
+        self.connected = False
+        self.replicating = False
+
+        # Set while the transport has asked us to stop writing because the
+        # worker isn't keeping up.
+        self.paused = None
+
+    def connectionMade(self):
+        self.connected = True
+        self.transport.registerProducer(self, True)
+        self.send_command("SERVER", self.factory.server_name)
+
+    def connectionLost(self, reason):
+        logger.info("Replication connection to %r lost: %s", self.name, reason)
+        self.connected = False
+        self.resumeProducing()
+
+    def pauseProducing(self):
+        if self.paused is None:
+            self.paused = defer.Deferred()
+
+    def resumeProducing(self):
+        paused, self.paused = self.paused, None
+        if paused is not None:
+            paused.callback(None)
+
+    def stopProducing(self):
+        self.transport.loseConnection()
+
+    def send_command(self, command, arg):
+        self.sendLine("%s %s" % (command, arg))
+
+    def send_error(self, message):
+        self.send_command("ERROR", message)
+        self.transport.loseConnection()
+
+    def lineReceived(self, line):
+        command, _, arg = line.partition(" ")
+
+        if command == "NAME":
+            self.name = arg
+        elif command == "REPLICATE":
+            try:
+                streams = json.loads(arg)
+            except ValueError:
+                self.send_error("Invalid JSON for REPLICATE")
+                return
+
+            if not isinstance(streams, dict):
+                self.send_error("REPLICATE takes a JSON object")
+                return
+
+            self.limit = int(streams.pop("limit", DEFAULT_LIMIT))
+            self.streams = streams
+            logger.info("Replicating %r to %r", streams, self.name)
+
+            if not self.replicating:
+                self.replicating = True
+                preserve_fn(self._replicate_forever)()
+        else:
+            self.send_error("Unknown command %r" % (command,))
+
+    def lineLengthExceeded(self, line):
+        self.send_error("Line too long")
+
+    @defer.inlineCallbacks
+    def _replicate_forever(self):
+        while self.connected:
+            if self.paused is not None:
+                yield self.paused
+                continue
+
+            try:
+                result = yield self.notifier.wait_for_replication(
+                    self._replicate, PING_INTERVAL_MS
+                )
+            except:
+                logger.exception("Error replicating to %r", self.name)
+                self.transport.loseConnection()
+                break
+
+            if not self.connected:
+                break
+
+            if result:
+                self.send_command("RDATA", json.dumps(result, ensure_ascii=False))
+                for name, stream in result.items():
+                    if name in self.streams:
+                        self.streams[name] = stream["position"]
+            else:
+                self.send_command("PING", self.clock.time_msec())
+
+    @defer.inlineCallbacks
+    def _replicate(self):
+        current_token = yield self.replication.current_replication_token()
+
+        streams = {}
+        for names, current_position in zip(STREAM_NAMES, current_token):
+            for name in names:
+                position = self.streams.get(name)
+                if position is not None and int(position) < current_position:
+                    streams[name] = int(position)
+
+        if self.streams.get("streams") not in (None, str(current_token)):
+            streams["streams"] = self.streams["streams"]
+
+        if not streams:
+            defer.returnValue({})
+
+        result = yield self.replication.replicate(streams, self.limit)
+        defer.returnValue(result)
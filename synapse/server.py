@@ -19,10 +19,14 @@
 # partial one for unit test mocking.
 
 # Imports required for the default HomeServer() implementation
-from twisted.web.client import BrowserLikePolicyForHTTPS
+from twisted.internet import reactor
+from twisted.web.client import BrowserLikePolicyForHTTPS, HTTPConnectionPool
 from twisted.enterprise import adbapi
 
 from synapse.federation import initialize_http_replication
+from synapse.federation.send_queue import FederationRemoteSendQueue
+from synapse.federation.transaction_queue import TransactionQueue
+from synapse.federation.transport.client import TransportLayerClient
 from synapse.http.client import SimpleHttpClient, InsecureInterceptableContextFactory
 from synapse.notifier import Notifier
 from synapse.api.auth import Auth
@@ -34,9 +38,11 @@ from synapse.util.distributor import Distributor
 from synapse.streams.events import EventSources
 from synapse.api.ratelimiting import Ratelimiter
 from synapse.crypto.keyring import Keyring
+from synapse.push.action_generator import ActionGenerator
 from synapse.push.pusherpool import PusherPool
 from synapse.events.builder import EventBuilderFactory
 from synapse.api.filtering import Filtering
+from synapse.replication.resource import ReplicationResource
 
 from synapse.http.matrixfederationclient import MatrixFederationHttpClient
 
@@ -97,6 +103,11 @@ class HomeServer(object):
         'filtering',
         'http_client_context_factory',
         'simple_http_client',
+        'push_http_client',
+        'federation_transport_client',
+        'federation_sender',
+        'replication_resource',
+        'action_generator',
     ]
 
     def __init__(self, hostname, **kwargs):
@@ -152,6 +163,16 @@ class HomeServer(object):
     def build_simple_http_client(self):
         return SimpleHttpClient(self)
 
+    def build_push_http_client(self):
+        # Pushers share a pool of persistent connections so that pushers
+        # sending to the same push gateway reuse each other's connections.
+        pool = HTTPConnectionPool(reactor)
+        pool.maxPersistentPerHost = self.config.push_gateway_connections_per_host
+        pool.cachedConnectionTimeout = (
+            self.config.push_gateway_connection_idle_timeout
+        )
+        return SimpleHttpClient(self, pool=pool)
+
     def build_v1auth(self):
         orf = Auth(self)
         # Matrix spec makes no reference to what HTTP status code is returned,
@@ -185,6 +206,21 @@ class HomeServer(object):
     def build_http_client(self):
         return MatrixFederationHttpClient(self)
 
+    def build_federation_transport_client(self):
+        return TransportLayerClient(self)
+
+    def build_federation_sender(self):
+        if self.config.send_federation:
+            return TransactionQueue(self, self.get_federation_transport_client())
+        else:
+            return FederationRemoteSendQueue(self)
+
+    def build_replication_resource(self):
+        return ReplicationResource(self)
+
+    def build_action_generator(self):
+        return ActionGenerator(self)
+
     def build_db_pool(self):
         name = self.db_config["name"]
 
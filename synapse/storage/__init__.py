@@ -117,6 +117,9 @@ class DataStore(RoomMemberStore, RoomStore,
         self._access_tokens_id_gen = IdGenerator(db_conn, "access_tokens", "id")
         self._refresh_tokens_id_gen = IdGenerator(db_conn, "refresh_tokens", "id")
         self._event_reports_id_gen = IdGenerator(db_conn, "event_reports", "id")
+        self._federation_outbox_id_gen = IdGenerator(
+            db_conn, "federation_outbox", "outbox_id"
+        )
         self._push_rule_id_gen = IdGenerator(db_conn, "push_rules", "id")
         self._push_rules_enable_id_gen = IdGenerator(db_conn, "push_rules_enable", "id")
         self._push_rules_stream_id_gen = ChainedIdGenerator(
@@ -173,6 +176,10 @@ class DataStore(RoomMemberStore, RoomStore,
             prefilled_cache=push_rules_prefill,
         )
 
+        self._push_actions_stream_position = (
+            self._get_push_actions_stream_position(db_conn)
+        )
+
         super(DataStore, self).__init__(hs)
 
     def take_presence_startup_info(self):
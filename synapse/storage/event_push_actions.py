@@ -15,20 +15,33 @@
 
 from ._base import SQLBaseStore
 from twisted.internet import defer
-from synapse.util.caches.descriptors import cachedInlineCallbacks
+from synapse.api.constants import EventTypes
+from synapse.util.caches.descriptors import cached, cachedInlineCallbacks
 
 import logging
 import ujson as json
 
 logger = logging.getLogger(__name__)
 
+# How often to delete the push actions that have been read.
+PRUNE_PUSH_ACTIONS_INTERVAL_MS = 60 * 60 * 1000
+
+# The number of stream orderings to prune in each transaction.
+PRUNE_PUSH_ACTIONS_BATCH = 10000
+
 
 class EventPushActionsStore(SQLBaseStore):
-    def _set_push_actions_for_event_and_users_txn(self, txn, event, tuples):
+    def __init__(self, hs):
+        super(EventPushActionsStore, self).__init__(hs)
+        self._pruning_push_actions = False
+
+    def _set_push_actions_for_event_and_users_txn(self, txn, event, tuples,
+                                                  stream_ordering):
         """
         Args:
             event: the event set actions for
             tuples: list of tuples of (user_id, actions)
+            stream_ordering (int): the stream ordering of the event
         """
         values = []
         for uid, actions in tuples:
@@ -37,7 +50,7 @@ class EventPushActionsStore(SQLBaseStore):
                 'event_id': event.event_id,
                 'user_id': uid,
                 'actions': json.dumps(actions),
-                'stream_ordering': event.internal_metadata.stream_ordering,
+                'stream_ordering': stream_ordering,
                 'topological_ordering': event.depth,
                 'notif': 1,
                 'highlight': 1 if _action_has_highlight(actions) else 0,
@@ -48,51 +61,271 @@ class EventPushActionsStore(SQLBaseStore):
                 self.get_unread_event_push_actions_by_room_for_user.invalidate_many,
                 (event.room_id, uid)
             )
+            txn.call_after(
+                self.get_unread_notif_counts_for_user.invalidate, (uid,)
+            )
         self._simple_insert_many_txn(txn, "event_push_actions", values)
+        self._update_push_summaries_txn(txn, values, 1)
 
-    @cachedInlineCallbacks(num_args=3, lru=True, tree=True, max_entries=5000)
-    def get_unread_event_push_actions_by_room_for_user(
-            self, room_id, user_id, last_read_event_id
-    ):
-        def _get_unread_event_push_actions_by_room(txn):
+    def _update_push_summaries_txn(self, txn, rows, sign):
+        """Add (or with a negative sign, remove) push actions from the unread
+        counts of the users whose last read receipt is before them.
+
+        Args:
+            rows (list[dict]): The event_push_actions rows.
+            sign (int): 1 if the rows were added, -1 if they were removed.
+        """
+        sql = (
+            "UPDATE event_push_summary"
+            " SET notif_count = notif_count + ?,"
+            " highlight_count = highlight_count + ?"
+            " WHERE user_id = ? AND room_id = ?"
+            " AND ("
+            "       topological_ordering < ?"
+            "       OR (topological_ordering = ? AND stream_ordering < ?)"
+            ")"
+        )
+        txn.executemany(sql, [
+            (
+                sign * row["notif"], sign * row["highlight"],
+                row["user_id"], row["room_id"],
+                row["topological_ordering"], row["topological_ordering"],
+                row["stream_ordering"],
+            )
+            for row in rows
+        ])
+
+    def _update_push_summary_for_receipt_txn(self, txn, room_id, user_id,
+                                             event_id):
+        """Recount a user's unread notifications in a room after they have
+        sent a read receipt for `event_id`.
+        """
+        txn.call_after(
+            self.get_unread_notif_counts_for_user.invalidate, (user_id,)
+        )
+
+        res = self._simple_select_one_txn(
+            txn,
+            table="events",
+            retcols=["topological_ordering", "stream_ordering"],
+            keyvalues={"event_id": event_id},
+            allow_none=True,
+        )
+        if res is None:
+            # We don't have the event yet, so the counts can't be worked out.
+            self._simple_delete_txn(
+                txn,
+                table="event_push_summary",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+            )
+            return
+
+        topological_ordering = res["topological_ordering"]
+        stream_ordering = res["stream_ordering"]
+
+        # Move the summary to the new receipt before counting, so that push
+        # actions being added at the same time either wait for this update
+        # and then see the new receipt, or are committed before the count.
+        txn.execute(
+            "UPDATE event_push_summary"
+            " SET event_id = ?, topological_ordering = ?, stream_ordering = ?"
+            " WHERE user_id = ? AND room_id = ?",
+            (event_id, topological_ordering, stream_ordering, user_id, room_id)
+        )
+        exists = txn.rowcount > 0
+
+        counts = self._count_unread_push_actions_txn(
+            txn, room_id, user_id, topological_ordering, stream_ordering
+        )
+
+        if exists:
+            self._simple_update_one_txn(
+                txn,
+                table="event_push_summary",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                updatevalues={
+                    "notif_count": counts["notify_count"],
+                    "highlight_count": counts["highlight_count"],
+                },
+            )
+        else:
+            self._simple_insert_txn(
+                txn,
+                table="event_push_summary",
+                values={
+                    "user_id": user_id,
+                    "room_id": room_id,
+                    "event_id": event_id,
+                    "topological_ordering": topological_ordering,
+                    "stream_ordering": stream_ordering,
+                    "notif_count": counts["notify_count"],
+                    "highlight_count": counts["highlight_count"],
+                },
+            )
+
+    def _count_unread_push_actions_txn(self, txn, room_id, user_id,
+                                       topological_ordering, stream_ordering):
+        sql = (
+            "SELECT sum(notif), sum(highlight)"
+            " FROM event_push_actions ea"
+            " WHERE"
+            " user_id = ?"
+            " AND room_id = ?"
+            " AND ("
+            "       topological_ordering > ?"
+            "       OR (topological_ordering = ? AND stream_ordering > ?)"
+            ")"
+        )
+        txn.execute(sql, (
+            user_id, room_id,
+            topological_ordering, topological_ordering, stream_ordering
+        ))
+        row = txn.fetchone()
+        if row:
+            return {
+                "notify_count": row[0] or 0,
+                "highlight_count": row[1] or 0,
+            }
+        else:
+            return {"notify_count": 0, "highlight_count": 0}
+
+    def _get_push_actions_stream_position(self, db_conn):
+        txn = db_conn.cursor()
+        txn.execute("SELECT stream_ordering FROM push_actions_stream_position")
+        position = txn.fetchone()[0]
+        txn.close()
+        return position
+
+    def get_push_actions_stream_token(self):
+        """The position in the events stream up to which push actions have
+        been added. Push actions are computed after the events have been
+        persisted, so this lags behind the events stream.
+        """
+        return self._push_actions_stream_position
+
+    def get_events_for_push_actions(self, last_id, current_id, limit):
+        """Get the events that push actions need to be computed for.
+
+        Args:
+            last_id (int): The position up to which push actions have been
+                added.
+            current_id (int): The position up to which events have been
+                persisted.
+            limit (int): The maximum number of events to return.
+
+        Returns:
+            Deferred[(int, list)]: The position the events are up to, and a
+            list of (stream_ordering, event_id) tuples in stream order.
+        """
+        def get_events_for_push_actions_txn(txn):
             sql = (
-                "SELECT stream_ordering, topological_ordering"
-                " FROM events"
-                " WHERE room_id = ? AND event_id = ?"
+                "SELECT stream_ordering, event_id FROM events"
+                " WHERE ? < stream_ordering AND stream_ordering <= ?"
+                " AND outlier = ?"
+                " ORDER BY stream_ordering ASC LIMIT ?"
             )
+            txn.execute(sql, (last_id, current_id, False, limit))
+            rows = txn.fetchall()
+            if len(rows) == limit:
+                return rows[-1][0], rows
+            return current_id, rows
+
+        return self.runInteraction(
+            "get_events_for_push_actions", get_events_for_push_actions_txn
+        )
+
+    def add_push_actions_for_events(self, actions_for_events, position):
+        """Store the push actions for a batch of events and advance the push
+        actions stream to `position`.
+
+        Args:
+            actions_for_events (list): A list of (event, stream_ordering,
+                list of (user_id, actions)) tuples.
+            position (int): The position in the events stream up to which
+                push actions have now been computed.
+        """
+        def add_push_actions_for_events_txn(txn):
+            for event, stream_ordering, tuples in actions_for_events:
+                if tuples:
+                    self._set_push_actions_for_event_and_users_txn(
+                        txn, event, tuples, stream_ordering,
+                    )
+
+                # The redacted event may have been persisted before its push
+                # actions were added, so they need removing here too.
+                if event.type == EventTypes.Redaction and event.redacts:
+                    self._remove_push_actions_for_event_id_txn(
+                        txn, event.room_id, event.redacts
+                    )
+
             txn.execute(
-                sql, (room_id, last_read_event_id)
+                "UPDATE push_actions_stream_position SET stream_ordering = ?",
+                (position,)
+            )
+            txn.call_after(self._advance_push_actions_stream, position)
+
+        return self.runInteraction(
+            "add_push_actions_for_events", add_push_actions_for_events_txn
+        )
+
+    def _advance_push_actions_stream(self, position):
+        self._push_actions_stream_position = max(
+            position, self._push_actions_stream_position
+        )
+
+    def get_all_push_action_updates(self, last_id, current_id, limit):
+        """Get the users with new push actions for replication.
+
+        Returns every row for at most `limit` events, so that a client that
+        resumes from the returned position doesn't miss the remaining users
+        for an event.
+
+        Returns:
+            Deferred[(int, list)]: The position the rows are up to, and a list
+            of (stream_ordering, room_id, user_id) tuples.
+        """
+        def get_all_push_action_updates_txn(txn):
+            sql = (
+                "SELECT DISTINCT stream_ordering FROM event_push_actions"
+                " WHERE ? < stream_ordering AND stream_ordering <= ?"
+                " ORDER BY stream_ordering ASC LIMIT ?"
+            )
+            txn.execute(sql, (last_id, current_id, limit))
+            orderings = txn.fetchall()
+            if len(orderings) == limit:
+                current_position = orderings[-1][0]
+            else:
+                current_position = current_id
+
+            sql = (
+                "SELECT stream_ordering, room_id, user_id FROM event_push_actions"
+                " WHERE ? < stream_ordering AND stream_ordering <= ?"
+                " ORDER BY stream_ordering ASC"
             )
-            results = txn.fetchall()
-            if len(results) == 0:
-                return {"notify_count": 0, "highlight_count": 0}
+            txn.execute(sql, (last_id, current_position))
+            return current_position, txn.fetchall()
 
-            stream_ordering = results[0][0]
-            topological_ordering = results[0][1]
+        return self.runInteraction(
+            "get_all_push_action_updates", get_all_push_action_updates_txn
+        )
 
+    @cachedInlineCallbacks(num_args=3, lru=True, tree=True, max_entries=5000)
+    def get_unread_event_push_actions_by_room_for_user(
+            self, room_id, user_id, last_read_event_id
+    ):
+        def _get_unread_event_push_actions_by_room(txn):
             sql = (
-                "SELECT sum(notif), sum(highlight)"
-                " FROM event_push_actions ea"
-                " WHERE"
-                " user_id = ?"
-                " AND room_id = ?"
-                " AND ("
-                "       topological_ordering > ?"
-                "       OR (topological_ordering = ? AND stream_ordering > ?)"
-                ")"
-            )
-            txn.execute(sql, (
-                user_id, room_id,
-                topological_ordering, topological_ordering, stream_ordering
-            ))
+                "SELECT notif_count, highlight_count FROM event_push_summary"
+                " WHERE user_id = ? AND room_id = ? AND event_id = ?"
+            )
+            txn.execute(sql, (user_id, room_id, last_read_event_id))
             row = txn.fetchone()
             if row:
-                return {
-                    "notify_count": row[0] or 0,
-                    "highlight_count": row[1] or 0,
-                }
-            else:
-                return {"notify_count": 0, "highlight_count": 0}
+                return {"notify_count": row[0], "highlight_count": row[1]}
+
+            return self._count_unread_push_actions_for_receipt_txn(
+                txn, room_id, user_id, last_read_event_id
+            )
 
         ret = yield self.runInteraction(
             "get_unread_event_push_actions_by_room",
@@ -100,6 +333,65 @@ class EventPushActionsStore(SQLBaseStore):
         )
         defer.returnValue(ret)
 
+    @cached(num_args=1, max_entries=5000)
+    def get_unread_notif_counts_for_user(self, user_id):
+        """Get the number of unread notifications the user has in each room
+        they have sent a read receipt in.
+
+        Returns:
+            Deferred[dict]: A map from room_id to the number of unread
+            notifications.
+        """
+        def get_unread_notif_counts_for_user_txn(txn):
+            sql = (
+                "SELECT r.room_id, r.event_id, s.event_id, s.notif_count"
+                " FROM receipts_linearized AS r"
+                " LEFT JOIN event_push_summary AS s"
+                " ON s.user_id = r.user_id AND s.room_id = r.room_id"
+                " WHERE r.user_id = ? AND r.receipt_type = ?"
+            )
+            txn.execute(sql, (user_id, "m.read"))
+
+            counts = {}
+            for room_id, receipt_event_id, summary_event_id, notif_count in (
+                txn.fetchall()
+            ):
+                if summary_event_id == receipt_event_id:
+                    counts[room_id] = notif_count
+                else:
+                    counts[room_id] = self._count_unread_push_actions_for_receipt_txn(
+                        txn, room_id, user_id, receipt_event_id
+                    )["notify_count"]
+            return counts
+
+        return self.runInteraction(
+            "get_unread_notif_counts_for_user",
+            get_unread_notif_counts_for_user_txn
+        )
+
+    def _count_unread_push_actions_for_receipt_txn(self, txn, room_id, user_id,
+                                                   event_id):
+        # There isn't a summary if the user hasn't sent a receipt since
+        # the summaries were added, so count the push actions instead.
+        sql = (
+            "SELECT stream_ordering, topological_ordering"
+            " FROM events"
+            " WHERE room_id = ? AND event_id = ?"
+        )
+        txn.execute(
+            sql, (room_id, event_id)
+        )
+        results = txn.fetchall()
+        if len(results) == 0:
+            return {"notify_count": 0, "highlight_count": 0}
+
+        stream_ordering = results[0][0]
+        topological_ordering = results[0][1]
+
+        return self._count_unread_push_actions_txn(
+            txn, room_id, user_id, topological_ordering, stream_ordering
+        )
+
     @defer.inlineCallbacks
     def get_push_action_users_in_range(self, min_stream_ordering, max_stream_ordering):
         def f(txn):
@@ -196,11 +488,94 @@ class EventPushActionsStore(SQLBaseStore):
             self.get_unread_event_push_actions_by_room_for_user.invalidate_many,
             (room_id,)
         )
+        rows = self._simple_select_list_txn(
+            txn,
+            table="event_push_actions",
+            keyvalues={"room_id": room_id, "event_id": event_id},
+            retcols=(
+                "room_id", "user_id", "topological_ordering", "stream_ordering",
+                "notif", "highlight",
+            ),
+        )
+        self._update_push_summaries_txn(txn, rows, -1)
+        for row in rows:
+            txn.call_after(
+                self.get_unread_notif_counts_for_user.invalidate,
+                (row["user_id"],)
+            )
+
         txn.execute(
             "DELETE FROM event_push_actions WHERE room_id = ? AND event_id = ?",
             (room_id, event_id)
         )
 
+    def start_pruning_push_actions(self):
+        self._clock.looping_call(
+            self._prune_read_push_actions, PRUNE_PUSH_ACTIONS_INTERVAL_MS
+        )
+
+    @defer.inlineCallbacks
+    def _prune_read_push_actions(self):
+        """Delete the push actions for events that users have read.
+
+        Only the push actions after a user's read receipt are used, either for
+        their unread counts or by their pushers, so the rest can go. Users
+        without a summary haven't sent a receipt since the summaries were
+        added, so their push actions are kept until they do.
+        """
+        if self._pruning_push_actions:
+            return
+
+        def get_range_txn(txn):
+            txn.execute(
+                "SELECT MIN(stream_ordering), MAX(stream_ordering)"
+                " FROM event_push_actions"
+            )
+            return txn.fetchone()
+
+        def prune_txn(txn, from_id, to_id):
+            sql = (
+                "DELETE FROM event_push_actions"
+                " WHERE ? <= stream_ordering AND stream_ordering < ?"
+                " AND EXISTS ("
+                "   SELECT 1 FROM event_push_summary AS s"
+                "   WHERE s.user_id = event_push_actions.user_id"
+                "   AND s.room_id = event_push_actions.room_id"
+                "   AND ("
+                "       event_push_actions.topological_ordering"
+                "           < s.topological_ordering"
+                "       OR ("
+                "           event_push_actions.topological_ordering"
+                "               = s.topological_ordering"
+                "           AND event_push_actions.stream_ordering"
+                "               <= s.stream_ordering"
+                "       )"
+                "   )"
+                " )"
+            )
+            txn.execute(sql, (from_id, to_id))
+            return txn.rowcount
+
+        try:
+            self._pruning_push_actions = True
+
+            min_id, max_id = yield self.runInteraction(
+                "get_push_actions_range", get_range_txn
+            )
+            if min_id is None:
+                return
+
+            deleted = 0
+            for from_id in xrange(min_id, max_id + 1, PRUNE_PUSH_ACTIONS_BATCH):
+                deleted += yield self.runInteraction(
+                    "prune_read_push_actions", prune_txn,
+                    from_id, from_id + PRUNE_PUSH_ACTIONS_BATCH,
+                )
+
+            logger.info("Pruned %d read push actions", deleted)
+        finally:
+            self._pruning_push_actions = False
+
 
 def _action_has_highlight(actions):
     for action in actions:
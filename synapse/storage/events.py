@@ -259,11 +259,6 @@ class EventsStore(SQLBaseStore):
                     event.depth, depth_updates.get(event.room_id, event.depth)
                 )
 
-            if context.push_actions:
-                self._set_push_actions_for_event_and_users_txn(
-                    txn, event, context.push_actions
-                )
-
         if event.type == EventTypes.Redaction and event.redacts is not None:
             self._remove_push_actions_for_event_id_txn(
                 txn, event.room_id, event.redacts
@@ -90,13 +90,27 @@ class ReceiptsStore(SQLBaseStore):
         room_ids = set(room_ids)
 
         if from_key:
-            room_ids = yield self._receipts_stream_cache.get_entities_changed(
+            # Only look up the rooms whose receipts have changed since
+            # from_key.
+            room_ids = self._receipts_stream_cache.get_entities_changed(
                 room_ids, from_key
             )
+            if not room_ids:
+                defer.returnValue([])
 
-        results = yield self._get_linearized_receipts_for_rooms(
-            room_ids, to_key, from_key=from_key
-        )
+            results = yield self._get_linearized_receipts_for_rooms(
+                room_ids, to_key, from_key=from_key
+            )
+        else:
+            # The per-room cache is keyed on to_key, which changes with every
+            # new receipt, so fetching every receipt for lots of rooms would
+            # just fill it with entries that won't be used again. Fetch them
+            # all at once without caching instead.
+            results = yield self.runInteraction(
+                "get_linearized_receipts_for_rooms",
+                self._get_linearized_receipts_for_rooms_txn,
+                list(room_ids), to_key,
+            )
 
         defer.returnValue([ev for res in results.values() for ev in res])
 
@@ -166,39 +180,41 @@ class ReceiptsStore(SQLBaseStore):
         if not room_ids:
             defer.returnValue({})
 
-        def f(txn):
-            if from_key:
-                sql = (
-                    "SELECT * FROM receipts_linearized WHERE"
-                    " room_id IN (%s) AND stream_id > ? AND stream_id <= ?"
-                ) % (
-                    ",".join(["?"] * len(room_ids))
-                )
-                args = list(room_ids)
-                args.extend([from_key, to_key])
-
-                txn.execute(sql, args)
-            else:
-                sql = (
-                    "SELECT * FROM receipts_linearized WHERE"
-                    " room_id IN (%s) AND stream_id <= ?"
-                ) % (
-                    ",".join(["?"] * len(room_ids))
-                )
+        results = yield self.runInteraction(
+            "_get_linearized_receipts_for_rooms",
+            self._get_linearized_receipts_for_rooms_txn,
+            list(room_ids), to_key, from_key,
+        )
+        defer.returnValue(results)
 
-                args = list(room_ids)
-                args.append(to_key)
+    def _get_linearized_receipts_for_rooms_txn(self, txn, room_ids, to_key,
+                                               from_key=None):
+        """Get the receipts for the rooms, fetching them in chunks of rooms.
 
-                txn.execute(sql, args)
+        Returns:
+            dict: A map from room_id to a list containing the m.receipt event
+            for the room, or an empty list if it has no receipts.
+        """
+        rows = []
+        for chunk in (room_ids[i:i + 100] for i in xrange(0, len(room_ids), 100)):
+            sql = (
+                "SELECT * FROM receipts_linearized WHERE"
+                " room_id IN (%s) AND stream_id <= ?"
+            ) % (
+                ",".join(["?"] * len(chunk))
+            )
+            args = list(chunk)
+            args.append(to_key)
 
-            return self.cursor_to_dict(txn)
+            if from_key:
+                sql += " AND stream_id > ?"
+                args.append(from_key)
 
-        txn_results = yield self.runInteraction(
-            "_get_linearized_receipts_for_rooms", f
-        )
+            txn.execute(sql, args)
+            rows.extend(self.cursor_to_dict(txn))
 
         results = {}
-        for row in txn_results:
+        for row in rows:
             # We want a single event per room, since we want to batch the
             # receipts by room, event and type.
             room_event = results.setdefault(row["room_id"], {
@@ -214,11 +230,10 @@ class ReceiptsStore(SQLBaseStore):
 
             receipt_type[row["user_id"]] = json.loads(row["data"])
 
-        results = {
+        return {
             room_id: [results[room_id]] if room_id in results else []
             for room_id in room_ids
         }
-        defer.returnValue(results)
 
     def get_max_receipt_stream_id(self):
         return self._receipts_id_gen.get_current_token()
@@ -294,6 +309,11 @@ class ReceiptsStore(SQLBaseStore):
             }
         )
 
+        if receipt_type == "m.read" and self.hs.is_mine_id(user_id):
+            self._update_push_summary_for_receipt_txn(
+                txn, room_id, user_id, event_id
+            )
+
         return True
 
     @defer.inlineCallbacks
@@ -303,52 +323,114 @@ class ReceiptsStore(SQLBaseStore):
         Automatically does conversion between linearized and graph
         representations.
         """
-        if not event_ids:
-            return
+        res = yield self.insert_receipts([{
+            "room_id": room_id,
+            "receipt_type": receipt_type,
+            "user_id": user_id,
+            "event_ids": event_ids,
+            "data": data,
+        }])
 
-        if len(event_ids) == 1:
-            linearized_event_id = event_ids[0]
-        else:
-            # we need to points in graph -> linearized form.
-            # TODO: Make this better.
-            def graph_to_linear(txn):
-                query = (
-                    "SELECT event_id WHERE room_id = ? AND stream_ordering IN ("
-                    " SELECT max(stream_ordering) WHERE event_id IN (%s)"
-                    ")"
-                ) % (",".join(["?"] * len(event_ids)))
-
-                txn.execute(query, [room_id] + event_ids)
-                rows = txn.fetchall()
-                if rows:
-                    return rows[0][0]
-                else:
-                    raise RuntimeError("Unrecognized event_ids: %r" % (event_ids,))
-
-            linearized_event_id = yield self.runInteraction(
-                "insert_receipt_conv", graph_to_linear
-            )
+        if not res:
+            defer.returnValue(None)
 
-        stream_id_manager = self._receipts_id_gen.get_next()
-        with stream_id_manager as stream_id:
-            have_persisted = yield self.runInteraction(
-                "insert_linearized_receipt",
-                self.insert_linearized_receipt_txn,
-                room_id, receipt_type, user_id, linearized_event_id,
-                data,
-                stream_id=stream_id,
-            )
+        new_receipts, stream_id, max_persisted_id = res
+        if not new_receipts:
+            defer.returnValue(None)
 
+        defer.returnValue((stream_id, max_persisted_id))
+
+    @defer.inlineCallbacks
+    def insert_receipts(self, receipts):
+        """Insert a batch of receipts in a single transaction.
+
+        Args:
+            receipts (list[dict]): The receipts to insert, each with keys
+                "room_id", "receipt_type", "user_id", "event_ids" and "data".
+
+        Returns:
+            Deferred[(list, int, int)|None]: The receipts that were newer than
+            the existing ones, the first stream id used and the current stream
+            id, or None if there was nothing to insert.
+        """
+        receipts = [receipt for receipt in receipts if receipt["event_ids"]]
+        if not receipts:
+            defer.returnValue(None)
+
+        stream_id_manager = self._receipts_id_gen.get_next_mult(len(receipts))
+        with stream_id_manager as stream_ids:
+            try:
+                new_receipts = yield self.runInteraction(
+                    "insert_receipts", self._insert_receipts_txn,
+                    receipts, stream_ids,
+                )
+            except Exception:
+                if len(receipts) == 1:
+                    raise
+
+                # Insert the receipts one at a time so that a receipt for an
+                # event we don't know about doesn't stop the others.
+                logger.exception("Failed to insert batch of receipts")
+                new_receipts = []
+                for receipt, stream_id in zip(receipts, stream_ids):
+                    try:
+                        new = yield self.runInteraction(
+                            "insert_receipt", self._insert_receipts_txn,
+                            [receipt], [stream_id],
+                        )
+                    except Exception:
+                        logger.exception("Failed to insert receipt")
+                        continue
+                    new_receipts.extend(new)
+
+        max_persisted_id = self._receipts_id_gen.get_current_token()
+
+        defer.returnValue((new_receipts, stream_ids[0], max_persisted_id))
+
+    def _insert_receipts_txn(self, txn, receipts, stream_ids):
+        new_receipts = []
+        for receipt, stream_id in zip(receipts, stream_ids):
+            room_id = receipt["room_id"]
+            receipt_type = receipt["receipt_type"]
+            user_id = receipt["user_id"]
+            event_ids = receipt["event_ids"]
+            data = receipt["data"]
+
+            if len(event_ids) == 1:
+                linearized_event_id = event_ids[0]
+            else:
+                # we need to points in graph -> linearized form.
+                linearized_event_id = self._graph_to_linear_txn(
+                    txn, room_id, event_ids
+                )
+
+            have_persisted = self.insert_linearized_receipt_txn(
+                txn, room_id, receipt_type, user_id, linearized_event_id,
+                data, stream_id=stream_id,
+            )
             if not have_persisted:
-                defer.returnValue(None)
+                continue
 
-        yield self.insert_graph_receipt(
-            room_id, receipt_type, user_id, event_ids, data
-        )
+            self.insert_graph_receipt_txn(
+                txn, room_id, receipt_type, user_id, event_ids, data
+            )
+            new_receipts.append(receipt)
 
-        max_persisted_id = self._stream_id_gen.get_current_token()
+        return new_receipts
 
-        defer.returnValue((stream_id, max_persisted_id))
+    def _graph_to_linear_txn(self, txn, room_id, event_ids):
+        query = (
+            "SELECT event_id FROM events"
+            " WHERE room_id = ? AND event_id IN (%s)"
+            " ORDER BY stream_ordering DESC LIMIT 1"
+        ) % (",".join(["?"] * len(event_ids)))
+
+        txn.execute(query, [room_id] + event_ids)
+        rows = txn.fetchall()
+        if rows:
+            return rows[0][0]
+        else:
+            raise RuntimeError("Unrecognized event_ids: %r" % (event_ids,))
 
     def insert_graph_receipt(self, room_id, receipt_type, user_id, event_ids,
                              data):
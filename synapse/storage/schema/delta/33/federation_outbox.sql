@@ -0,0 +1,26 @@
+/* Copyright 2016 OpenMarket Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+
+/* PDUs queued up to be sent to remote servers, so that they survive restarts
+ * and don't need to be held in memory while a destination is down. */
+CREATE TABLE federation_outbox(
+    outbox_id BIGINT NOT NULL,
+    destination TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    ts BIGINT NOT NULL
+);
+
+CREATE INDEX federation_outbox_destination ON federation_outbox(destination, outbox_id);
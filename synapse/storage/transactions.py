@@ -338,6 +338,157 @@ class TransactionStore(SQLBaseStore):
         txn.execute(query, (self._clock.time_msec(),))
         return self.cursor_to_dict(txn)
 
+    def add_pdu_to_federation_outbox(self, event_id, destinations):
+        """Queues up a PDU to be sent to the given destinations.
+
+        Args:
+            event_id (str): The event to send.
+            destinations (list): The servers to send the event to.
+
+        Returns:
+            Deferred
+        """
+        now = self._clock.time_msec()
+
+        return self.runInteraction(
+            "add_pdu_to_federation_outbox",
+            self._simple_insert_many_txn,
+            table="federation_outbox",
+            values=[
+                {
+                    "outbox_id": self._federation_outbox_id_gen.get_next(),
+                    "destination": destination,
+                    "event_id": event_id,
+                    "ts": now,
+                }
+                for destination in destinations
+            ],
+        )
+
+    def get_federation_outbox(self, destination, limit):
+        """Get the oldest PDUs still waiting to be sent to a destination.
+
+        Args:
+            destination (str)
+            limit (int): The maximum number of PDUs to return.
+
+        Returns:
+            Deferred: resolves to a list of event_ids, oldest first.
+        """
+        sql = (
+            "SELECT event_id FROM federation_outbox"
+            " WHERE destination = ?"
+            " ORDER BY outbox_id ASC LIMIT ?"
+        )
+
+        def get_federation_outbox_txn(txn):
+            txn.execute(sql, (destination, limit,))
+            return [row[0] for row in txn.fetchall()]
+
+        return self.runInteraction(
+            "get_federation_outbox", get_federation_outbox_txn
+        )
+
+    def delete_from_federation_outbox(self, destination, event_ids):
+        """Remove PDUs that have been sent to a destination from the outbox.
+
+        Args:
+            destination (str)
+            event_ids (list)
+
+        Returns:
+            Deferred
+        """
+        sql = (
+            "DELETE FROM federation_outbox"
+            " WHERE destination = ? AND event_id = ?"
+        )
+
+        def delete_from_federation_outbox_txn(txn):
+            txn.executemany(sql, [
+                (destination, event_id) for event_id in event_ids
+            ])
+
+        return self.runInteraction(
+            "delete_from_federation_outbox", delete_from_federation_outbox_txn
+        )
+
+    def get_destinations_with_federation_outbox(self):
+        """Get all destinations that have PDUs waiting to be sent to them.
+
+        Returns:
+            Deferred: resolves to a list of destinations.
+        """
+        return self._execute(
+            "get_destinations_with_federation_outbox",
+            lambda txn: [row[0] for row in txn.fetchall()],
+            "SELECT DISTINCT destination FROM federation_outbox",
+        )
+
+    def get_federation_out_pos(self):
+        """Get the position in the "federation" replication stream up to which
+        the federation sender worker has queued everything up to be sent.
+
+        Returns:
+            Deferred: resolves to the position, or -1 if there isn't one yet.
+        """
+        return self._execute(
+            "get_federation_out_pos",
+            lambda txn: txn.fetchone()[0],
+            "SELECT stream_id FROM federation_stream_position",
+        )
+
+    def update_federation_out_pos(self, stream_id):
+        """Store the position in the "federation" replication stream up to
+        which the federation sender worker has queued everything up to be sent.
+
+        Args:
+            stream_id (int)
+
+        Returns:
+            Deferred
+        """
+        def update_federation_out_pos_txn(txn):
+            txn.execute(
+                "UPDATE federation_stream_position SET stream_id = ?",
+                (stream_id,)
+            )
+
+        return self.runInteraction(
+            "update_federation_out_pos", update_federation_out_pos_txn
+        )
+
+    def get_srv_cache(self):
+        """Get the SRV records that were cached when the server last stopped.
+
+        Returns:
+            Deferred: resolves to a list of dicts with the service_name, host,
+            port, priority, weight and expires of each record.
+        """
+        return self._simple_select_list(
+            table="srv_cache",
+            keyvalues={},
+            retcols=(
+                "service_name", "host", "port", "priority", "weight", "expires",
+            ),
+            desc="get_srv_cache",
+        )
+
+    def store_srv_cache(self, rows):
+        """Replace the cached SRV records.
+
+        Args:
+            rows (list): dicts in the format returned by get_srv_cache.
+
+        Returns:
+            Deferred
+        """
+        def store_srv_cache_txn(txn):
+            txn.execute("DELETE FROM srv_cache")
+            self._simple_insert_many_txn(txn, "srv_cache", rows)
+
+        return self.runInteraction("store_srv_cache", store_srv_cache_txn)
+
     @defer.inlineCallbacks
     def _persist_in_mem_txns(self):
         try:
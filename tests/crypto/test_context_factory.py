@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+
+from synapse.config.tls import TlsConfig
+from synapse.crypto.context_factory import ServerContextFactory
+
+from OpenSSL import SSL
+
+import os
+import shutil
+import tempfile
+
+
+class ClientSessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        config_dict = {
+            "server_name": "test",
+            "tls_certificate_path": os.path.join(self.dir, "test.tls.crt"),
+            "tls_private_key_path": os.path.join(self.dir, "test.tls.key"),
+            "tls_dh_params_path": os.path.join(self.dir, "test.tls.dh"),
+        }
+        config = TlsConfig()
+        config.generate_files(config_dict)
+        config.read_config(config_dict)
+        self.context_factory = ServerContextFactory(config)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_session_is_resumed(self):
+        self.assertFalse(self.connect("remote"))
+        self.assertTrue(self.connect("remote"))
+        self.assertFalse(self.connect("other"))
+
+    def connect(self, destination):
+        """Connect to our own server context over memory BIOs, send some data
+        and close the connection cleanly.
+
+        Returns:
+            bool: Whether the client resumed an earlier TLS session.
+        """
+        client = self.context_factory.client_connection_creator(
+            destination
+        ).clientConnectionForTLS(None)
+        client.set_connect_state()
+        server = SSL.Connection(self.context_factory.getContext(), None)
+        server.set_accept_state()
+
+        def pump():
+            for _ in range(10):
+                for source, sink in ((client, server), (server, client)):
+                    try:
+                        sink.bio_write(source.bio_read(65536))
+                    except SSL.WantReadError:
+                        pass
+                    try:
+                        sink.do_handshake()
+                    except SSL.WantReadError:
+                        pass
+
+        try:
+            client.do_handshake()
+        except SSL.WantReadError:
+            pass
+        pump()
+
+        server.send(b"hello")
+        pump()
+        self.assertEquals(client.recv(5), b"hello")
+
+        client.shutdown()
+        pump()
+        with self.assertRaises(SSL.ZeroReturnError):
+            server.recv(5)
+        server.shutdown()
+        pump()
+
+        # pyOpenSSL doesn't expose SSL_session_reused.
+        return bool(SSL._lib.SSL_session_reused(client._ssl))
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+
+from twisted.internet import defer
+
+from synapse.api.errors import SynapseError
+from synapse.crypto import keyring as keyring_module
+from synapse.crypto.keyring import Keyring, MIN_KEY_LOOKUP_RETRY_INTERVAL
+
+from signedjson.key import get_verify_key
+from signedjson.sign import sign_json, verify_signed_json
+from unpaddedbase64 import decode_base64
+
+from mock import Mock, patch
+
+from tests.utils import MockClock
+
+import nacl.signing
+
+
+SIGNING_KEY_SEED = decode_base64(
+    "YJDBA9Xnr2sVqXD9Vj7XVUnmFZcZrlw8Md7kMW+3XA1"
+)
+
+KEY_ID = "ed25519:1"
+REMOTE = "remote"
+
+
+class KeyringVerifiedSignatureCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.signing_key = nacl.signing.SigningKey(SIGNING_KEY_SEED)
+        self.signing_key.alg = "ed25519"
+        self.signing_key.version = "1"
+        self.verify_key = get_verify_key(self.signing_key)
+
+        self.store = Mock()
+        self.store.get_server_verify_keys.side_effect = (
+            lambda server_name, key_ids: defer.succeed({
+                KEY_ID: self.verify_key,
+            })
+        )
+        self.store.store_server_verify_key.side_effect = (
+            lambda *args, **kwargs: defer.succeed(None)
+        )
+
+        hs = Mock()
+        hs.get_datastore.return_value = self.store
+        hs.get_config.return_value.perspectives = {}
+
+        self.keyring = Keyring(hs)
+
+    def _signed_json(self, content):
+        return sign_json({"content": content}, REMOTE, self.signing_key)
+
+    @defer.inlineCallbacks
+    def test_verified_signature_is_cached(self):
+        json_object = self._signed_json("hello")
+
+        with patch.object(
+            keyring_module, "verify_signed_json", wraps=verify_signed_json,
+        ) as verify_mock:
+            yield self.keyring.verify_json_for_server(REMOTE, json_object)
+            self.assertEquals(verify_mock.call_count, 1)
+
+            # The same object arriving again (e.g. via backfill) should not
+            # be verified again.
+            yield self.keyring.verify_json_for_server(
+                REMOTE, dict(json_object, unsigned={"age": 5}),
+            )
+            self.assertEquals(verify_mock.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_cache_does_not_cover_other_content(self):
+        json_object = self._signed_json("hello")
+        yield self.keyring.verify_json_for_server(REMOTE, json_object)
+
+        # Reusing the signature on different content must still fail.
+        tampered = dict(json_object, content="goodbye")
+        with self.assertRaises(SynapseError):
+            yield self.keyring.verify_json_for_server(REMOTE, tampered)
+
+    @defer.inlineCallbacks
+    def test_storing_keys_invalidates_cache(self):
+        json_object = self._signed_json("hello")
+
+        with patch.object(
+            keyring_module, "verify_signed_json", wraps=verify_signed_json,
+        ) as verify_mock:
+            yield self.keyring.verify_json_for_server(REMOTE, json_object)
+            self.assertEquals(verify_mock.call_count, 1)
+
+            self.verify_key.time_added = 0
+            yield self.keyring.store_keys(
+                server_name=REMOTE,
+                from_server=REMOTE,
+                verify_keys={KEY_ID: self.verify_key},
+            )
+
+            yield self.keyring.verify_json_for_server(REMOTE, json_object)
+            self.assertEquals(verify_mock.call_count, 2)
+
+
+class KeyringLookupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.signing_key = nacl.signing.SigningKey(SIGNING_KEY_SEED)
+        self.signing_key.alg = "ed25519"
+        self.signing_key.version = "1"
+
+        self.store = Mock()
+        self.store.get_server_verify_keys.side_effect = (
+            lambda server_name, key_ids: defer.succeed({})
+        )
+
+        self.clock = MockClock()
+
+        hs = Mock()
+        hs.get_datastore.return_value = self.store
+        hs.get_clock.return_value = self.clock
+        hs.get_config.return_value.perspectives = {}
+
+        self.keyring = Keyring(hs)
+
+    @defer.inlineCallbacks
+    def test_failed_lookups_back_off(self):
+        json_object = sign_json({"content": "hi"}, REMOTE, self.signing_key)
+
+        get_keys_from_server = Mock(return_value=defer.succeed({}))
+        self.keyring.get_keys_from_server = get_keys_from_server
+
+        with self.assertRaises(SynapseError):
+            yield self.keyring.verify_json_for_server(REMOTE, json_object)
+        self.assertEquals(get_keys_from_server.call_count, 1)
+
+        # We shouldn't try the remote server again straight away...
+        with self.assertRaises(SynapseError):
+            yield self.keyring.verify_json_for_server(REMOTE, json_object)
+        self.assertEquals(get_keys_from_server.call_count, 1)
+
+        # ... but should once the backoff has expired.
+        self.clock.advance_time_msec(MIN_KEY_LOOKUP_RETRY_INTERVAL)
+        with self.assertRaises(SynapseError):
+            yield self.keyring.verify_json_for_server(REMOTE, json_object)
+        self.assertEquals(get_keys_from_server.call_count, 2)
+
+    @patch.object(keyring_module, "MAX_KEY_LOOKUP_FAILURES", 2)
+    def test_only_recent_failures_are_remembered(self):
+        hs = Mock()
+        hs.get_clock.return_value = self.clock
+        keyring = Keyring(hs)
+
+        for server_name in ("server1", "server2", "server3"):
+            keyring._record_key_lookup_failure(server_name, [KEY_ID])
+
+        self.assertEquals(len(keyring.key_lookup_failures), 2)
+        self.assertFalse(
+            keyring._is_key_lookup_backing_off("server1", [KEY_ID])
+        )
+        self.assertTrue(
+            keyring._is_key_lookup_backing_off("server3", [KEY_ID])
+        )
+
+    @defer.inlineCallbacks
+    def test_perspective_lookups_are_batched(self):
+        self.keyring.perspective_servers = {"notary": {}}
+
+        get_keys_now = Mock(return_value=defer.succeed({
+            "server1": {KEY_ID: "key1"},
+            "server2": {KEY_ID: "key2"},
+        }))
+        self.keyring._get_keys_from_perspectives_now = get_keys_now
+
+        d1 = self.keyring.get_keys_from_perspectives([("server1", [KEY_ID])])
+        d2 = self.keyring.get_keys_from_perspectives([("server2", [KEY_ID])])
+        self.assertFalse(d1.called)
+        self.assertFalse(d2.called)
+
+        self.clock.advance_time(0)
+
+        self.assertEquals(get_keys_now.call_count, 1)
+        (server_name_and_key_ids,), _ = get_keys_now.call_args
+        self.assertEquals(
+            sorted(server_name_and_key_ids),
+            [("server1", set([KEY_ID])), ("server2", set([KEY_ID]))],
+        )
+
+        res1 = yield d1
+        res2 = yield d2
+        self.assertEquals(res1, {"server1": {KEY_ID: "key1"}})
+        self.assertEquals(res2, {"server2": {KEY_ID: "key2"}})
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+
+from synapse.api.errors import FederationError
+from synapse.events import FrozenEvent
+from synapse.federation.send_queue import (
+    FederationRemoteSendQueue, KEEP_ROWS_FOR_MS, process_rows_for_federation,
+)
+from synapse.federation.units import Edu
+
+from mock import Mock
+
+from twisted.internet import defer
+
+from tests.utils import MockClock
+
+
+class FederationRemoteSendQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = MockClock()
+
+        hs = Mock()
+        hs.hostname = "test"
+        hs.get_clock.return_value = self.clock
+
+        self.store = hs.get_datastore.return_value
+        self.store.add_pdu_to_federation_outbox.side_effect = (
+            lambda *args: defer.succeed(None)
+        )
+
+        self.queue = FederationRemoteSendQueue(hs)
+        self.notifier = hs.get_notifier.return_value
+
+    def _roundtrip(self, from_token):
+        rows = self.queue.get_replication_rows(
+            from_token, self.queue.get_current_token(), 100,
+        )
+        transaction_queue = Mock()
+        process_rows_for_federation(transaction_queue, rows)
+        return rows, transaction_queue
+
+    def _event(self):
+        return FrozenEvent({
+            "event_id": "$1:test",
+            "type": "m.room.message",
+            "room_id": "!room:test",
+            "sender": "@user:test",
+            "content": {},
+        })
+
+    def test_rows_are_replayed_into_transaction_queue(self):
+        self.queue.enqueue_pdu(self._event(), ["remote", "test"], 0)
+        self.store.add_pdu_to_federation_outbox.assert_called_once_with(
+            "$1:test", ["remote"],
+        )
+        self.queue.enqueue_edu(Edu(
+            origin="test", destination="remote", edu_type="m.typing",
+            content={"typing": True},
+        ))
+        self.queue.enqueue_failure(
+            FederationError("ERROR", 400, "bad", "$2:remote"), "remote",
+        )
+        self.assertEquals(self.notifier.on_new_replication_data.call_count, 3)
+
+        rows, transaction_queue = self._roundtrip(-1)
+        self.assertEquals(len(rows), 3)
+
+        (pdu, destinations, _, in_outbox), _ = (
+            transaction_queue.enqueue_outbox_pdu.call_args
+        )
+        self.assertEquals(pdu.event_id, "$1:test")
+        self.assertEquals(destinations, ["remote"])
+        self.assertTrue(in_outbox)
+
+        (edu,), _ = transaction_queue.enqueue_edu.call_args
+        self.assertEquals(edu.edu_type, "m.typing")
+        self.assertEquals(edu.content, {"typing": True})
+
+        (failure, destination), _ = transaction_queue.enqueue_failure.call_args
+        self.assertEquals(failure.affected, "$2:remote")
+        self.assertEquals(destination, "remote")
+
+        # Nothing new after the last position.
+        rows, _ = self._roundtrip(rows[-1][0])
+        self.assertEquals(rows, [])
+
+    def test_pdu_is_streamed_if_outbox_write_fails(self):
+        self.store.add_pdu_to_federation_outbox.side_effect = (
+            lambda *args: defer.fail(Exception("db down"))
+        )
+        self.queue.enqueue_pdu(self._event(), ["remote"], 0)
+
+        rows, transaction_queue = self._roundtrip(-1)
+        self.assertEquals(len(rows), 1)
+        (pdu, destinations, _, in_outbox), _ = (
+            transaction_queue.enqueue_outbox_pdu.call_args
+        )
+        self.assertEquals(pdu.event_id, "$1:test")
+        self.assertFalse(in_outbox)
+
+    def test_pdu_only_for_ourselves_is_dropped(self):
+        self.queue.enqueue_pdu(self._event(), ["test"], 0)
+
+        self.assertFalse(self.store.add_pdu_to_federation_outbox.called)
+        rows, _ = self._roundtrip(-1)
+        self.assertEquals(rows, [])
+
+    def test_old_rows_are_dropped(self):
+        self.queue.enqueue_edu(Edu(
+            origin="test", destination="remote", edu_type="m.typing",
+            content={},
+        ))
+        self.clock.advance_time_msec(KEEP_ROWS_FOR_MS + 1)
+        self.queue.enqueue_edu(Edu(
+            origin="test", destination="remote", edu_type="m.presence",
+            content={},
+        ))
+
+        self.queue._clear_queue()
+
+        rows, transaction_queue = self._roundtrip(-1)
+        self.assertEquals(len(rows), 1)
+        (edu,), _ = transaction_queue.enqueue_edu.call_args
+        self.assertEquals(edu.edu_type, "m.presence")
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.events import FrozenEvent
+from synapse.federation import transaction_queue
+from synapse.federation.transaction_queue import TransactionQueue
+
+from mock import Mock, patch
+
+from tests.utils import MockClock
+
+
+class TransactionQueueOutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Mock()
+        self.store.add_pdu_to_federation_outbox.return_value = defer.succeed(None)
+        self.store.delete_from_federation_outbox.return_value = defer.succeed(None)
+        self.store.get_destination_retry_timings.return_value = (
+            defer.succeed(None)
+        )
+        self.store.prep_send_transaction.return_value = defer.succeed([])
+        self.store.delivered_txn.return_value = defer.succeed(None)
+
+        self.transport = Mock()
+        self.transport.send_transaction.return_value = defer.succeed({})
+
+        hs = Mock()
+        hs.hostname = "test"
+        hs.get_datastore.return_value = self.store
+        hs.get_clock.return_value = MockClock()
+
+        self.queue = TransactionQueue(hs, self.transport)
+
+        self.event = FrozenEvent({
+            "event_id": "$1:test",
+            "type": "m.room.message",
+            "room_id": "!room:test",
+            "sender": "@user:test",
+            "content": {},
+        })
+
+    def test_sent_pdus_are_removed_from_outbox(self):
+        self.queue.enqueue_pdu(self.event, ["remote"], 0)
+
+        self.store.add_pdu_to_federation_outbox.assert_called_once_with(
+            "$1:test", set(["remote"]),
+        )
+        self.assertEquals(self.transport.send_transaction.call_count, 1)
+        self.store.delete_from_federation_outbox.assert_called_once_with(
+            "remote", ["$1:test"],
+        )
+        self.assertNotIn("remote", self.queue.destinations_to_catch_up)
+
+    def test_failed_destination_catches_up_from_outbox(self):
+        self.transport.send_transaction.return_value = defer.fail(IOError())
+
+        self.queue.enqueue_pdu(self.event, ["remote"], 0)
+
+        self.assertEquals(self.transport.send_transaction.call_count, 1)
+        self.assertFalse(self.store.delete_from_federation_outbox.called)
+        self.assertIn("remote", self.queue.destinations_to_catch_up)
+
+        # The remote comes back, so we should send what's in the outbox.
+        self.transport.send_transaction.return_value = defer.succeed({})
+        self.store.get_federation_outbox.side_effect = (
+            lambda destination, limit: defer.succeed(["$1:test"])
+        )
+        self.store.get_events.return_value = defer.succeed({
+            "$1:test": self.event,
+        })
+
+        self.queue._retry_catch_up_destinations()
+
+        self.assertEquals(self.transport.send_transaction.call_count, 2)
+        (transaction, _), _ = self.transport.send_transaction.call_args
+        self.assertEquals(
+            ["$1:test"], [p["event_id"] for p in transaction.pdus],
+        )
+        self.store.delete_from_federation_outbox.assert_called_once_with(
+            "remote", ["$1:test"],
+        )
+        self.assertNotIn("remote", self.queue.destinations_to_catch_up)
+
+    def test_unpersisted_pdus_are_sent_while_catching_up(self):
+        self.queue.destinations_to_catch_up.add("remote")
+        self.store.add_pdu_to_federation_outbox.return_value = (
+            defer.fail(IOError())
+        )
+        self.store.get_federation_outbox.side_effect = (
+            lambda destination, limit: defer.succeed(["$0:test"])
+        )
+        outbox_event = FrozenEvent({
+            "event_id": "$0:test",
+            "type": "m.room.message",
+            "room_id": "!room:test",
+            "sender": "@user:test",
+            "content": {},
+        })
+        self.store.get_events.return_value = defer.succeed({
+            "$0:test": outbox_event,
+        })
+
+        self.queue.enqueue_pdu(self.event, ["remote"], 0)
+
+        # The PDU that isn't in the outbox is sent along with the outbox.
+        self.assertEquals(self.transport.send_transaction.call_count, 1)
+        (transaction, _), _ = self.transport.send_transaction.call_args
+        self.assertEquals(
+            sorted(p["event_id"] for p in transaction.pdus),
+            ["$0:test", "$1:test"],
+        )
+        self.store.delete_from_federation_outbox.assert_called_once_with(
+            "remote", ["$0:test"],
+        )
+
+    def test_outbox_pdus_are_not_added_again(self):
+        self.queue.enqueue_outbox_pdu(self.event, ["remote", "test"], 0, True)
+
+        self.assertFalse(self.store.add_pdu_to_federation_outbox.called)
+        self.assertEquals(self.transport.send_transaction.call_count, 1)
+        (transaction, destination), _ = self.transport.send_transaction.call_args
+        self.assertEquals(transaction.destination, "remote")
+        self.store.delete_from_federation_outbox.assert_called_once_with(
+            "remote", ["$1:test"],
+        )
+
+    def test_catch_up_from_outbox(self):
+        self.store.get_destinations_with_federation_outbox.return_value = (
+            defer.succeed(["remote", "test"])
+        )
+        self.store.get_federation_outbox.side_effect = (
+            lambda destination, limit: defer.succeed(["$1:test"])
+        )
+        self.store.get_events.return_value = defer.succeed({
+            "$1:test": self.event,
+        })
+
+        self.queue.catch_up_from_outbox()
+
+        self.store.get_federation_outbox.assert_called_with(
+            "remote", transaction_queue.MAX_OUTBOX_PDUS_PER_TRANSACTION,
+        )
+        self.assertEquals(self.transport.send_transaction.call_count, 1)
+        self.store.delete_from_federation_outbox.assert_called_once_with(
+            "remote", ["$1:test"],
+        )
+
+    @patch.object(transaction_queue, "MAX_PENDING_EDUS_PER_DESTINATION", 2)
+    def test_dropped_edus_are_failed(self):
+        # Hold up the first transaction, so that the EDUs queue up.
+        self.queue.pending_transactions["remote"] = 1
+
+        edus = [Mock(destination="remote") for _ in range(3)]
+        deferreds = [self.queue.enqueue_edu(edu) for edu in edus]
+
+        # The oldest EDU is dropped, and its failure logged.
+        self.assertEquals(len(self.queue.pending_edus_by_dest["remote"]), 2)
+        self.assertTrue(deferreds[0].called)
+        self.assertFalse(deferreds[1].called)
+        self.assertFalse(deferreds[2].called)
+
+    def test_keeps_catching_up_for_pdus_added_while_reading(self):
+        outbox = ["$1:test"]
+        first_read = defer.Deferred()
+        reads = [first_read]
+
+        def get_federation_outbox(destination, limit):
+            if reads:
+                return reads.pop(0)
+            return defer.succeed(list(outbox))
+
+        def delete_from_federation_outbox(destination, event_ids):
+            for event_id in event_ids:
+                outbox.remove(event_id)
+            return defer.succeed(None)
+
+        self.store.get_federation_outbox.side_effect = get_federation_outbox
+        self.store.delete_from_federation_outbox.side_effect = (
+            delete_from_federation_outbox
+        )
+        self.store.get_events.side_effect = lambda event_ids, **kwargs: (
+            defer.succeed({
+                event_id: FrozenEvent({
+                    "event_id": event_id,
+                    "type": "m.room.message",
+                    "room_id": "!room:test",
+                    "sender": "@user:test",
+                    "content": {},
+                })
+                for event_id in event_ids
+            })
+        )
+
+        self.queue.destinations_to_catch_up.add("remote")
+        self.queue._retry_catch_up_destinations()
+
+        # A PDU is only added to the outbox while it is being read.
+        outbox.append("$2:test")
+        first_read.callback(["$1:test"])
+
+        sent = [
+            p["event_id"]
+            for (transaction, _), _ in self.transport.send_transaction.call_args_list
+            for p in transaction.pdus
+        ]
+        self.assertEquals(sent, ["$1:test", "$2:test"])
+        self.assertEquals(outbox, [])
+        self.assertNotIn("remote", self.queue.destinations_to_catch_up)
+
+    def test_runtime_error_catches_up_from_outbox(self):
+        self.store.prep_send_transaction.side_effect = (
+            lambda *args: defer.fail(RuntimeError())
+        )
+
+        d = self.queue.enqueue_edu(Mock(destination="remote"))
+        self.queue.enqueue_pdu(self.event, ["remote"], 0)
+
+        self.assertIn("remote", self.queue.destinations_to_catch_up)
+        self.assertTrue(d.called)
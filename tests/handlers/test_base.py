@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from mock import Mock
+
+from synapse.events import FrozenEvent
+from synapse.handlers._base import BaseHandler
+
+
+_next_event_id = [0]
+
+
+def _event(event_type, content, state_key=None, prev_content=None):
+    _next_event_id[0] += 1
+    d = {
+        "event_id": "$%d:test" % (_next_event_id[0],),
+        "type": event_type,
+        "room_id": "!room:test",
+        "sender": "@sender:test",
+        "content": content,
+    }
+    if state_key is not None:
+        d["state_key"] = state_key
+    if prev_content is not None:
+        d["unsigned"] = {"prev_content": prev_content}
+    return FrozenEvent(d)
+
+
+def _member(user_id, membership, prev_membership=None):
+    prev_content = None
+    if prev_membership:
+        prev_content = {"membership": prev_membership}
+    return _event(
+        "m.room.member", {"membership": membership}, state_key=user_id,
+        prev_content=prev_content,
+    )
+
+
+class FilterEventsForClientsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.forgotten = []
+
+        hs = Mock()
+        hs.get_datastore.return_value.who_forgot_in_room.side_effect = (
+            lambda room_id: defer.succeed(self.forgotten)
+        )
+        hs.config.signing_key = [Mock()]
+        self.handler = BaseHandler(hs)
+
+        self.state = {
+            ("m.room.member", "@joined:test"): _member("@joined:test", "join"),
+            ("m.room.member", "@joined2:test"): _member("@joined2:test", "join"),
+            ("m.room.member", "@invited:test"): _member("@invited:test", "invite"),
+            ("m.room.member", "@left:test"): _member("@left:test", "leave"),
+        }
+        self.users = [
+            ("@joined:test", False),
+            ("@joined2:test", False),
+            ("@invited:test", False),
+            ("@left:test", False),
+            ("@peeker:test", True),
+        ]
+
+    def set_visibility(self, visibility):
+        self.state[("m.room.history_visibility", "")] = _event(
+            "m.room.history_visibility", {"history_visibility": visibility},
+            state_key="",
+        )
+
+    @defer.inlineCallbacks
+    def visible_to(self, event):
+        results = yield self.handler.filter_events_for_clients(
+            self.users, [event], {event.event_id: self.state},
+        )
+        self.assertEquals(set(results), set(u for u, _ in self.users))
+        defer.returnValue(set(u for u, events in results.items() if events))
+
+    @defer.inlineCallbacks
+    def test_world_readable(self):
+        self.set_visibility("world_readable")
+        visible = yield self.visible_to(_event("m.room.message", {}))
+        self.assertEquals(visible, set(u for u, _ in self.users))
+
+    @defer.inlineCallbacks
+    def test_shared(self):
+        visible = yield self.visible_to(_event("m.room.message", {}))
+        self.assertEquals(visible, {
+            "@joined:test", "@joined2:test", "@invited:test", "@left:test",
+        })
+
+    @defer.inlineCallbacks
+    def test_invited(self):
+        self.set_visibility("invited")
+        visible = yield self.visible_to(_event("m.room.message", {}))
+        self.assertEquals(visible, {
+            "@joined:test", "@joined2:test", "@invited:test",
+        })
+
+    @defer.inlineCallbacks
+    def test_joined(self):
+        self.set_visibility("joined")
+        visible = yield self.visible_to(_event("m.room.message", {}))
+        self.assertEquals(visible, {"@joined:test", "@joined2:test"})
+
+    @defer.inlineCallbacks
+    def test_forgotten_membership(self):
+        self.set_visibility("joined")
+        self.forgotten = [{
+            "event_id": self.state[("m.room.member", "@joined2:test")].event_id,
+        }]
+        visible = yield self.visible_to(_event("m.room.message", {}))
+        self.assertEquals(visible, {"@joined:test"})
+
+    @defer.inlineCallbacks
+    def test_own_membership_event(self):
+        self.set_visibility("joined")
+
+        # Users can see their own leave, as they were joined before it.
+        visible = yield self.visible_to(
+            _member("@left:test", "leave", prev_membership="join")
+        )
+        self.assertEquals(visible, {
+            "@joined:test", "@joined2:test", "@left:test",
+        })
+
+    @defer.inlineCallbacks
+    def test_visibility_boundary(self):
+        self.set_visibility("joined")
+
+        # The least restrictive of the old and new visibility applies.
+        visible = yield self.visible_to(_event(
+            "m.room.history_visibility", {"history_visibility": "joined"},
+            state_key="", prev_content={"history_visibility": "invited"},
+        ))
+        self.assertEquals(visible, {
+            "@joined:test", "@joined2:test", "@invited:test",
+        })
+
+    @defer.inlineCallbacks
+    def test_multiple_events(self):
+        self.set_visibility("joined")
+        message = _event("m.room.message", {})
+        leave = _member("@left:test", "leave", prev_membership="join")
+
+        results = yield self.handler.filter_events_for_clients(
+            self.users, [message, leave],
+            {message.event_id: self.state, leave.event_id: self.state},
+        )
+        self.assertEquals(results["@joined:test"], [message, leave])
+        self.assertEquals(results["@left:test"], [leave])
+        self.assertEquals(results["@peeker:test"], [])
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+
+from synapse.handlers.receipts import ReceiptsHandler
+
+from twisted.internet import defer
+
+from mock import Mock
+
+
+class ReceiptsHandlerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.inserted = []
+        self.insert_deferreds = []
+        self.room_hosts = {}
+
+        self.store = Mock()
+        self.store.insert_receipts.side_effect = self.insert_receipts
+
+        def fetch_room_distributions_into(room_id, localusers, remotedomains):
+            remotedomains.update(self.room_hosts.get(room_id, []))
+            return defer.succeed(None)
+
+        hs = Mock()
+        hs.config.signing_key = [Mock()]
+        hs.get_datastore.return_value = self.store
+        hs.get_clock.return_value.time_msec.return_value = 1000
+        hs.get_handlers.return_value.room_member_handler.\
+            fetch_room_distributions_into.side_effect = (
+                fetch_room_distributions_into
+            )
+        self.federation = hs.get_replication_layer.return_value
+
+        self.handler = ReceiptsHandler(hs)
+
+    def insert_receipts(self, receipts):
+        self.inserted.append([
+            (r["room_id"], r["user_id"], r["event_ids"]) for r in receipts
+        ])
+        d = defer.Deferred()
+        self.insert_deferreds.append((receipts, d))
+        return d
+
+    def finish_insert(self):
+        receipts, d = self.insert_deferreds.pop(0)
+        d.callback((receipts, 1, len(receipts)))
+
+    def send_receipt(self, room_id, user_id, event_id):
+        return self.handler.received_client_receipt(
+            room_id, "m.read", user_id, event_id
+        )
+
+    def test_coalesces_receipts_while_persisting(self):
+        d1 = self.send_receipt("!a:test", "@alice:test", "$1:test")
+        d2 = self.send_receipt("!a:test", "@alice:test", "$2:test")
+        d3 = self.send_receipt("!a:test", "@bob:test", "$2:test")
+        d4 = self.send_receipt("!a:test", "@alice:test", "$3:test")
+
+        self.finish_insert()
+        self.assertTrue(d1.called)
+        self.assertFalse(d2.called)
+
+        self.finish_insert()
+        self.assertTrue(d2.called and d3.called and d4.called)
+
+        # Only the latest receipt from each user is persisted in the second
+        # batch.
+        self.assertEquals(self.inserted[0], [("!a:test", "@alice:test", ["$1:test"])])
+        self.assertEquals(sorted(self.inserted[1]), [
+            ("!a:test", "@alice:test", ["$3:test"]),
+            ("!a:test", "@bob:test", ["$2:test"]),
+        ])
+
+    def test_one_edu_per_destination(self):
+        self.room_hosts = {
+            "!a:test": ["remote1", "remote2"],
+            "!b:test": ["remote1"],
+        }
+        self.send_receipt("!a:test", "@alice:test", "$1:test")
+        self.send_receipt("!a:test", "@alice:test", "$2:test")
+        self.send_receipt("!b:test", "@alice:test", "$3:test")
+        self.finish_insert()
+        self.federation.send_edu.reset_mock()
+        self.finish_insert()
+
+        edus = {
+            kwargs["destination"]: kwargs["content"]
+            for _, kwargs in self.federation.send_edu.call_args_list
+        }
+        self.assertEquals(self.federation.send_edu.call_count, 2)
+        self.assertEquals(sorted(edus["remote1"].keys()), ["!a:test", "!b:test"])
+        self.assertEquals(edus["remote2"].keys(), ["!a:test"])
+        self.assertEquals(
+            edus["remote1"]["!a:test"]["m.read"]["@alice:test"]["event_ids"],
+            ["$2:test"],
+        )
+
+    def test_failure_is_returned_to_clients(self):
+        d = self.send_receipt("!a:test", "@alice:test", "$1:test")
+        receipts, insert = self.insert_deferreds.pop(0)
+        insert.errback(Exception("Failed"))
+        self.assertFailure(d, Exception)
+        return d
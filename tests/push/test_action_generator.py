@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+
+from synapse.events import FrozenEvent
+from synapse.push.action_generator import ActionGenerator, _state_before_event
+
+from twisted.internet import defer
+
+from mock import Mock
+
+
+def _event(stream_ordering):
+    return FrozenEvent({
+        "event_id": "$%d:test" % (stream_ordering,),
+        "type": "m.room.message",
+        "room_id": "!room:test",
+        "sender": "@sender:test",
+        "content": {"body": "Message %d" % (stream_ordering,)},
+    })
+
+
+class ActionGeneratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.position = 0
+        self.events = {}
+        self.rejected = set()
+        self.added = []
+
+        self.store = Mock()
+        self.store.get_push_actions_stream_token.side_effect = (
+            lambda: self.position
+        )
+        self.store.get_events_for_push_actions.side_effect = (
+            self.get_events_for_push_actions
+        )
+        self.store.get_events.side_effect = lambda event_ids: defer.succeed({
+            event_id: self.events[event_id] for event_id in event_ids
+            if event_id not in self.rejected
+        })
+        self.store.get_state_for_events.side_effect = (
+            lambda event_ids, types: defer.succeed({
+                event_id: {} for event_id in event_ids
+            })
+        )
+        self.store.add_push_actions_for_events.side_effect = (
+            self.add_push_actions_for_events
+        )
+
+        hs = Mock()
+        hs.get_datastore.return_value = self.store
+        hs.get_clock.return_value.time_msec.return_value = 0
+        self.pusher_pool = hs.get_pusherpool.return_value
+
+        self.action_generator = ActionGenerator(hs)
+        self.action_generator.BATCH_SIZE = 2
+        self.action_generator._get_actions_for_event = Mock(
+            side_effect=lambda event, state, handler: defer.succeed({
+                "@user:test": ["notify"],
+            })
+        )
+
+    def get_events_for_push_actions(self, last_id, current_id, limit):
+        rows = [
+            (stream_ordering, event.event_id)
+            for stream_ordering, event in sorted(
+                (int(event_id[1:].split(":")[0]), event)
+                for event_id, event in self.events.items()
+            )
+            if last_id < stream_ordering <= current_id
+        ][:limit]
+        if len(rows) == limit:
+            return defer.succeed((rows[-1][0], rows))
+        return defer.succeed((current_id, rows))
+
+    def add_push_actions_for_events(self, actions_for_events, position):
+        self.added.extend(
+            (stream_ordering, event.event_id)
+            for event, stream_ordering, _ in actions_for_events
+        )
+        self.position = position
+        return defer.succeed(None)
+
+    def persist(self, *stream_orderings):
+        for stream_ordering in stream_orderings:
+            event = _event(stream_ordering)
+            self.events[event.event_id] = event
+
+    def notified(self):
+        calls = self.pusher_pool.on_new_notifications.call_args_list
+        self.pusher_pool.on_new_notifications.reset_mock()
+        return [args for args, _ in calls]
+
+    def test_processes_events_in_batches(self):
+        self.persist(1, 2, 3, 4, 5)
+        self.action_generator.on_new_events(5)
+
+        self.assertEquals(
+            [stream_ordering for stream_ordering, _ in self.added],
+            [1, 2, 3, 4, 5],
+        )
+        self.assertEquals(self.position, 5)
+        self.assertEquals(self.notified(), [(1, 2), (3, 4), (5, 5)])
+
+    def test_only_processes_persisted_events(self):
+        self.persist(1, 2, 3)
+        self.action_generator.on_new_events(1)
+        self.assertEquals(self.position, 1)
+        self.assertEquals(self.notified(), [(1, 1)])
+
+        # Events 2 and 3 were persisted out of order, so are only processed
+        # once everything before them has been persisted.
+        self.action_generator.on_new_events(3)
+        self.assertEquals(self.position, 3)
+        self.assertEquals(self.notified(), [(2, 3)])
+
+    def test_waits_for_previous_batch(self):
+        add_deferred = defer.Deferred()
+        self.store.add_push_actions_for_events.side_effect = (
+            lambda actions_for_events, position: add_deferred
+        )
+
+        self.persist(1, 2, 3)
+        self.action_generator.on_new_events(1)
+        self.action_generator.on_new_events(3)
+        self.assertEquals(
+            self.store.get_events_for_push_actions.call_count, 1,
+        )
+
+        self.store.add_push_actions_for_events.side_effect = (
+            self.add_push_actions_for_events
+        )
+        self.position = 1
+        add_deferred.callback(None)
+
+        self.assertEquals(self.position, 3)
+        self.assertEquals(self.notified(), [(1, 1), (2, 3)])
+
+    def test_skips_rejected_and_failing_events(self):
+        self.persist(1, 2, 3)
+        self.rejected.add("$1:test")
+        self.action_generator._get_actions_for_event.side_effect = (
+            lambda event, state, handler: (
+                defer.fail(Exception("Failed"))
+                if event.event_id == "$2:test" else
+                defer.succeed({"@user:test": ["notify"]})
+            )
+        )
+
+        self.action_generator.on_new_events(3)
+        self.assertEquals(self.added, [(3, "$3:test")])
+        self.assertEquals(self.position, 3)
+
+
+class StateBeforeEventTestCase(unittest.TestCase):
+
+    def member(self, event_id, membership, **unsigned):
+        return FrozenEvent({
+            "event_id": event_id,
+            "type": "m.room.member",
+            "room_id": "!room:test",
+            "sender": "@user:test",
+            "state_key": "@user:test",
+            "content": {"membership": membership},
+            "unsigned": unsigned,
+        })
+
+    def test_message(self):
+        state = {("m.room.member", "@user:test"): self.member("$1:test", "join")}
+        self.assertEquals(_state_before_event(_event(2), state, {}), state)
+
+    def test_replaced_state(self):
+        join = self.member("$1:test", "join")
+        ban = self.member("$2:test", "ban", replaces_state="$1:test")
+        state = _state_before_event(
+            ban, {("m.room.member", "@user:test"): ban}, {"$1:test": join},
+        )
+        self.assertEquals(state, {("m.room.member", "@user:test"): join})
+
+    def test_new_state(self):
+        join = self.member("$1:test", "join")
+        state = _state_before_event(
+            join, {("m.room.member", "@user:test"): join}, {},
+        )
+        self.assertEquals(state, {})
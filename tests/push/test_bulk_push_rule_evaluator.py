@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+
+from synapse.events import FrozenEvent
+from synapse.push.bulk_push_rule_evaluator import (
+    BulkPushRuleEvaluator, RulesForRoom, _get_rules,
+)
+from synapse.push.push_rule_evaluator import PushRuleEvaluatorForEvent
+from synapse.util.caches.stream_change_cache import StreamChangeCache
+
+from twisted.internet import defer
+
+from mock import Mock
+
+import json
+
+
+def _event(content, event_type="m.room.message", sender="@sender:test",
+           **kwargs):
+    d = {
+        "event_id": "$1:test",
+        "type": event_type,
+        "room_id": "!room:test",
+        "sender": sender,
+        "content": content,
+    }
+    d.update(kwargs)
+    return FrozenEvent(d)
+
+
+def _member(user_id, displayname=None):
+    content = {"membership": "join"}
+    if displayname:
+        content["displayname"] = displayname
+    return _event(
+        content, event_type="m.room.member", sender=user_id, state_key=user_id,
+    )
+
+
+class BulkPushRuleEvaluatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = {}
+        self.enabled = {}
+
+        self.store = Mock()
+        self.store.bulk_get_push_rules.side_effect = lambda user_ids: (
+            defer.succeed({
+                u: [dict(r) for r in self.rules[u]]
+                for u in user_ids if u in self.rules
+            })
+        )
+        self.store.bulk_get_push_rules_enabled.side_effect = lambda user_ids: (
+            defer.succeed({
+                u: self.enabled[u] for u in user_ids if u in self.enabled
+            })
+        )
+
+        self.handler = Mock()
+        self.handler.filter_events_for_clients.side_effect = (
+            lambda user_tuples, events, _: defer.succeed({
+                u: events for u, _ in user_tuples
+            })
+        )
+
+    @defer.inlineCallbacks
+    def actions_for(self, event, user_ids, members=None):
+        members = members or user_ids
+
+        current_state = {}
+        for user_id in members:
+            displayname = user_id[1:].split(":")[0].capitalize()
+            current_state[("m.room.member", user_id)] = _member(
+                user_id, displayname,
+            )
+
+        rules_by_user = yield _get_rules("!room:test", user_ids, self.store)
+        evaluator = BulkPushRuleEvaluator(
+            "!room:test", rules_by_user, user_ids, self.store,
+        )
+        actions = yield evaluator.action_for_event_by_user(
+            event, self.handler, current_state,
+        )
+        defer.returnValue(actions)
+
+    def add_rule(self, user_id, rule_id, conditions, actions,
+                 priority_class=5, priority=0):
+        self.rules.setdefault(user_id, []).append({
+            "user_name": user_id,
+            "rule_id": rule_id,
+            "priority_class": priority_class,
+            "priority": priority,
+            "conditions": json.dumps(conditions),
+            "actions": json.dumps(actions),
+        })
+
+    @defer.inlineCallbacks
+    def test_users_with_default_rules_share_compiled_rules(self):
+        self.add_rule(
+            "@bob:test", "global/room/!room:test", [], ["dont_notify"],
+            priority_class=3,
+        )
+
+        rules = yield _get_rules(
+            "!room:test", ["@alice:test", "@carol:test", "@bob:test"],
+            self.store,
+        )
+
+        self.assertIs(rules["@alice:test"], rules["@carol:test"])
+        self.assertIsNot(rules["@alice:test"], rules["@bob:test"])
+
+        # And they're reused for later events
+        again = yield _get_rules("!room:test", ["@alice:test"], self.store)
+        self.assertIs(again["@alice:test"], rules["@alice:test"])
+
+    @defer.inlineCallbacks
+    def test_default_rules(self):
+        users = ["@alice:test", "@bob:test", "@sender:test"]
+
+        actions = yield self.actions_for(
+            _event({"msgtype": "m.text", "body": "hello"}), users,
+        )
+        self.assertEquals(set(actions), {"@alice:test", "@bob:test"})
+        self.assertEquals(actions["@alice:test"][0], "notify")
+
+        actions = yield self.actions_for(
+            _event({"msgtype": "m.text", "body": "hi alice"}), users,
+        )
+        self.assertIn(
+            {"set_tweak": "highlight"}, actions["@alice:test"],
+        )
+        self.assertIn(
+            {"set_tweak": "highlight", "value": False}, actions["@bob:test"],
+        )
+
+        actions = yield self.actions_for(
+            _event({"msgtype": "m.notice", "body": "hi alice"}), users,
+        )
+        self.assertEquals(actions, {})
+
+    @defer.inlineCallbacks
+    def test_user_rules(self):
+        users = ["@alice:test", "@bob:test", "@sender:test"]
+        self.add_rule(
+            "@bob:test", "global/room/!room:test", [], ["dont_notify"],
+            priority_class=3,
+        )
+
+        actions = yield self.actions_for(
+            _event({"msgtype": "m.text", "body": "hello"}), users,
+        )
+        self.assertEquals(set(actions), {"@alice:test"})
+
+        # Disabling the rule brings back the default behaviour
+        self.enabled["@bob:test"] = {"global/room/!room:test": 0}
+        actions = yield self.actions_for(
+            _event({"msgtype": "m.text", "body": "hello"}), users,
+        )
+        self.assertEquals(set(actions), {"@alice:test", "@bob:test"})
+
+    @defer.inlineCallbacks
+    def test_disabled_default_rule(self):
+        users = ["@alice:test", "@bob:test", "@sender:test"]
+        self.enabled["@alice:test"] = {"global/override/.m.rule.master": 1}
+
+        actions = yield self.actions_for(
+            _event({"msgtype": "m.text", "body": "hello"}), users,
+        )
+        self.assertEquals(set(actions), {"@bob:test"})
+
+    @defer.inlineCallbacks
+    def test_invite_for_me(self):
+        users = ["@alice:test", "@bob:test", "@sender:test"]
+        event = _event(
+            {"membership": "invite"}, event_type="m.room.member",
+            state_key="@alice:test",
+        )
+
+        actions = yield self.actions_for(event, users)
+        self.assertEquals(set(actions), {"@alice:test"})
+
+    @defer.inlineCallbacks
+    def test_member_count_from_state(self):
+        # Someone has joined since, but it was a one to one room when the
+        # event was sent.
+        self.store.get_users_in_room.return_value = defer.succeed([
+            "@alice:test", "@sender:test", "@carol:test",
+        ])
+
+        actions = yield self.actions_for(
+            _event({"msgtype": "m.text", "body": "hello"}),
+            ["@alice:test", "@sender:test"],
+        )
+        self.assertIn(
+            {"set_tweak": "sound", "value": "default"}, actions["@alice:test"],
+        )
+
+
+class RulesForRoomTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = {}
+        self.stream_id = 1
+
+        self.store = Mock()
+        self.store.get_push_rules_stream_token.side_effect = lambda: (
+            self.stream_id, 0,
+        )
+        self.store.push_rules_stream_cache = StreamChangeCache(
+            "PushRulesStreamChangeCache", self.stream_id,
+        )
+        self.store.bulk_get_push_rules.side_effect = lambda user_ids: (
+            defer.succeed({
+                u: [dict(r) for r in self.rules[u]]
+                for u in user_ids if u in self.rules
+            })
+        )
+        self.store.bulk_get_push_rules_enabled.side_effect = lambda user_ids: (
+            defer.succeed({})
+        )
+
+        self.rules_for_room = RulesForRoom("!room:test")
+
+    def fetched_users(self):
+        call_args = self.store.bulk_get_push_rules.call_args_list
+        self.store.bulk_get_push_rules.reset_mock()
+        return [sorted(args[0]) for args, _ in call_args]
+
+    def set_rules(self, user_id, actions):
+        self.rules[user_id] = [{
+            "user_name": user_id,
+            "rule_id": "global/room/!room:test",
+            "priority_class": 3,
+            "priority": 0,
+            "conditions": "[]",
+            "actions": json.dumps(actions),
+        }]
+        self.stream_id += 1
+        self.store.push_rules_stream_cache.entity_has_changed(
+            user_id, self.stream_id,
+        )
+
+    @defer.inlineCallbacks
+    def test_only_fetches_new_and_changed_users(self):
+        rules = yield self.rules_for_room.get_rules(
+            ["@alice:test", "@bob:test"], self.store,
+        )
+        self.assertEquals(self.fetched_users(), [["@alice:test", "@bob:test"]])
+        self.assertIs(rules["@alice:test"], rules["@bob:test"])
+
+        # Nothing has changed, so nothing is fetched.
+        yield self.rules_for_room.get_rules(
+            ["@alice:test", "@bob:test"], self.store,
+        )
+        self.assertEquals(self.fetched_users(), [])
+
+        # Only the new member is fetched.
+        rules = yield self.rules_for_room.get_rules(
+            ["@alice:test", "@bob:test", "@carol:test"], self.store,
+        )
+        self.assertEquals(self.fetched_users(), [["@carol:test"]])
+        self.assertEquals(len(rules), 3)
+
+        # Only the user whose rules changed is fetched, and users who have
+        # left are dropped.
+        self.set_rules("@bob:test", ["dont_notify"])
+        rules = yield self.rules_for_room.get_rules(
+            ["@bob:test", "@carol:test"], self.store,
+        )
+        self.assertEquals(self.fetched_users(), [["@bob:test"]])
+        self.assertEquals(set(rules), {"@bob:test", "@carol:test"})
+        self.assertIsNot(rules["@bob:test"], rules["@carol:test"])
+
+
+class PushRuleEvaluatorForEventTestCase(unittest.TestCase):
+
+    def test_flattened_keys_dont_leak_between_events(self):
+        PushRuleEvaluatorForEvent(
+            _event({"msgtype": "m.text", "body": "hello"}), 2,
+        )
+        evaluator = PushRuleEvaluatorForEvent(_event({}), 2)
+
+        self.assertFalse(evaluator.matches({
+            "kind": "event_match", "key": "content.msgtype", "pattern": "m.text",
+        }, "@alice:test", None))
+
+    def test_glob_patterns(self):
+        evaluator = PushRuleEvaluatorForEvent(
+            _event({"msgtype": "m.text", "body": "Hello Alice!"}), 2,
+        )
+
+        def matches(key, pattern):
+            return evaluator.matches({
+                "kind": "event_match", "key": key, "pattern": pattern,
+            }, "@alice:test", None)
+
+        self.assertTrue(matches("content.body", "alice"))
+        self.assertTrue(matches("content.body", "al*"))
+        self.assertFalse(matches("content.body", "ali"))
+        self.assertTrue(matches("content.msgtype", "m.te?t"))
+        self.assertTrue(matches("content.msgtype", "m.[st]ext"))
+        self.assertFalse(matches("content.msgtype", "m.[!t]ext"))
+        self.assertFalse(matches("content.msgtype", "m.tex"))
+
+    def test_user_independent_conditions_are_checked_once(self):
+        evaluator = PushRuleEvaluatorForEvent(
+            _event({"msgtype": "m.text", "body": "hello"}), 2,
+        )
+        condition = {
+            "kind": "event_match", "key": "type", "pattern": "m.room.message",
+        }
+
+        self.assertTrue(evaluator.matches(condition, "@alice:test", None))
+        evaluator._value_cache.clear()
+        self.assertTrue(evaluator.matches(condition, "@bob:test", None))
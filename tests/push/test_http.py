@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+
+from synapse.events import FrozenEvent
+from synapse.push.httppusher import HttpPusher
+
+from twisted.internet import defer
+
+from mock import Mock, patch
+
+
+def _push_action(stream_ordering):
+    return {
+        "event_id": "$%d:test" % (stream_ordering,),
+        "stream_ordering": stream_ordering,
+        "actions": ["notify"],
+    }
+
+
+class HttpPusherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.push_actions = [_push_action(i) for i in range(1, 6)]
+        self.requests = []
+
+        self.store = Mock()
+        self.store.get_unread_push_actions_for_user_in_range.side_effect = (
+            lambda user_id, min_stream_ordering, max_stream_ordering: (
+                defer.succeed([
+                    push_action for push_action in self.push_actions
+                    if push_action["stream_ordering"] > min_stream_ordering
+                ])
+            )
+        )
+        self.store.get_events.side_effect = lambda event_ids: defer.succeed({
+            event_id: FrozenEvent({
+                "event_id": event_id,
+                "type": "m.room.message",
+                "room_id": "!room:test",
+                "sender": "@sender:test",
+                "content": {},
+            })
+            for event_id in event_ids
+        })
+        for name in (
+            "update_pusher_last_stream_ordering_and_success",
+            "update_pusher_failing_since",
+            "update_pusher_last_stream_ordering",
+        ):
+            getattr(self.store, name).return_value = defer.succeed(None)
+
+        self.http_client = Mock()
+        self.http_client.post_json_get_json.side_effect = self.post_json
+
+        hs = Mock()
+        hs.get_datastore.return_value = self.store
+        hs.get_clock.return_value.time_msec.return_value = 0
+        hs.get_push_http_client.return_value = self.http_client
+
+        self.pusher = HttpPusher(hs, {
+            "user_name": "@user:test",
+            "app_id": "app",
+            "app_display_name": "App",
+            "device_display_name": "Device",
+            "pushkey": "key",
+            "ts": 0,
+            "data": {"url": "http://gateway/_matrix/push/v1/notify"},
+            "last_stream_ordering": 0,
+            "failing_since": None,
+        })
+        self.pusher.BATCH_SIZE = 2
+        self.pusher.max_stream_ordering = 5
+        self.pusher._build_notification_dict = (
+            lambda event, tweaks, badge: defer.succeed({
+                "event_id": event.event_id, "badge": badge,
+            })
+        )
+
+        self.badge_patch = patch(
+            "synapse.push.httppusher.push_tools.get_badge_count",
+            return_value=defer.succeed(3),
+        )
+        self.get_badge_count = self.badge_patch.start()
+
+    def tearDown(self):
+        self.badge_patch.stop()
+        self.pusher.on_stop()
+
+    def post_json(self, url, body):
+        d = defer.Deferred()
+        self.requests.append((body["event_id"], d))
+        return d
+
+    def respond(self, *failed):
+        requests, self.requests = self.requests, []
+        for event_id, d in requests:
+            if event_id in failed:
+                d.errback(Exception("Failed"))
+            else:
+                d.callback({})
+        return [event_id for event_id, _ in requests]
+
+    def test_sends_batches_at_once(self):
+        self.pusher.on_started()
+
+        # Each batch is sent at once, with the badge count fetched once.
+        self.assertEquals(self.respond(), ["$1:test", "$2:test"])
+        self.assertEquals(self.respond(), ["$3:test", "$4:test"])
+        self.assertEquals(self.pusher.backlog, 1)
+        self.assertEquals(self.respond(), ["$5:test"])
+        self.assertEquals(self.get_badge_count.call_count, 3)
+
+        self.assertEquals(self.pusher.last_stream_ordering, 5)
+        self.assertEquals(self.pusher.backlog, 0)
+        self.assertEquals(
+            self.store.update_pusher_last_stream_ordering_and_success.call_count,
+            3,
+        )
+
+    def test_retries_from_first_failure(self):
+        self.pusher.BATCH_SIZE = 5
+        self.pusher.on_started()
+
+        self.assertEquals(self.respond("$2:test"), [
+            "$1:test", "$2:test", "$3:test", "$4:test", "$5:test",
+        ])
+        self.assertEquals(self.pusher.last_stream_ordering, 1)
+        self.assertEquals(self.pusher.backlog, 4)
+        self.assertTrue(self.pusher.timed_call)
+
+        # Only the failed notification is sent again.
+        self.pusher.on_timer()
+        self.assertEquals(self.respond(), ["$2:test"])
+        self.assertEquals(self.pusher.last_stream_ordering, 5)
+        self.assertEquals(self.pusher.backlog, 0)
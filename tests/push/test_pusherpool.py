@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+
+from synapse.push.pusherpool import PusherPool
+
+from twisted.internet import defer
+
+from mock import Mock, patch
+
+
+def _pusherdict(user_id, ts, last_success=None):
+    return {
+        "user_name": user_id,
+        "app_id": "app",
+        "pushkey": "key",
+        "ts": ts,
+        "last_success": last_success,
+    }
+
+
+class PusherPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.started = []
+
+        hs = Mock()
+        hs.config.start_pushers = True
+        hs.config.pusher_startup_concurrency = 2
+        self.pusher_pool = PusherPool(hs)
+
+        self.create_pusher_patch = patch(
+            "synapse.push.pusherpool.pusher.create_pusher",
+            side_effect=self.create_pusher,
+        )
+        self.create_pusher_patch.start()
+
+    def tearDown(self):
+        self.create_pusher_patch.stop()
+
+    def create_pusher(self, hs, pusherdict):
+        p = Mock()
+        p.user_id = pusherdict["user_name"]
+        p.app_id = pusherdict["app_id"]
+        p.pushkey = pusherdict["pushkey"]
+        p.started = defer.Deferred()
+        p.on_started.side_effect = lambda: self.started.append(p) or p.started
+        return p
+
+    def finish(self):
+        started, self.started = self.started, []
+        for p in started:
+            p.started.callback(None)
+        return [p.user_id for p in started]
+
+    def test_starts_recently_active_users_first(self):
+        self.pusher_pool._start_pushers([
+            _pusherdict("@a:test", ts=1),
+            _pusherdict("@b:test", ts=4),
+            _pusherdict("@c:test", ts=2, last_success=5),
+            _pusherdict("@d:test", ts=3),
+            _pusherdict("@e:test", ts=0),
+        ])
+
+        # Only two pushers are started at a time.
+        self.assertEquals(self.finish(), ["@c:test", "@b:test"])
+        self.assertEquals(self.finish(), ["@d:test", "@a:test"])
+        self.assertEquals(self.finish(), ["@e:test"])
+        self.assertEquals(len(self.pusher_pool.pushers), 5)
+
+    def test_replaced_pushers_are_not_started(self):
+        self.pusher_pool._start_pushers([
+            _pusherdict("@a:test", ts=3),
+            _pusherdict("@b:test", ts=2),
+            _pusherdict("@c:test", ts=1),
+        ])
+        replaced = self.pusher_pool.pushers["@c:test"]["app:key"]
+        self.pusher_pool._start_pushers([_pusherdict("@c:test", ts=4)])
+
+        self.assertEquals(self.finish(), ["@a:test", "@b:test", "@c:test"])
+        self.assertEquals(self.finish(), [])
+        self.assertFalse(replaced.on_started.called)
+        self.assertTrue(replaced.on_stop.called)
@@ -0,0 +1,67 @@
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from ._base import BaseSlavedStoreTestCase
+
+from synapse.events import FrozenEvent
+from synapse.events.snapshot import EventContext
+from synapse.replication.slave.storage.directory import SlavedDirectoryStore
+from synapse.types import RoomAlias
+
+from twisted.internet import defer
+
+USER_ID = "@feeling:blue"
+ROOM_ID = "!room:blue"
+ALIAS = "#room:blue"
+
+
+class SlavedDirectoryStoreTestCase(BaseSlavedStoreTestCase):
+
+    STORE_TYPE = SlavedDirectoryStore
+
+    @defer.inlineCallbacks
+    def test_aliases(self):
+        yield self.check("get_aliases_for_room", [ROOM_ID], [])
+
+        yield self.master_store.create_room_alias_association(
+            RoomAlias.from_string(ALIAS), ROOM_ID, ["blue"],
+        )
+        yield self.persist_aliases_event([ALIAS])
+        yield self.replicate()
+        yield self.check("get_aliases_for_room", [ROOM_ID], [ALIAS])
+
+        yield self.master_store.delete_room_alias(RoomAlias.from_string(ALIAS))
+        yield self.persist_aliases_event([])
+        yield self.replicate()
+        yield self.check("get_aliases_for_room", [ROOM_ID], [])
+
+    @defer.inlineCallbacks
+    def persist_aliases_event(self, aliases):
+        event = FrozenEvent({
+            "sender": USER_ID,
+            "type": "m.room.aliases",
+            "state_key": "blue",
+            "content": {"aliases": aliases},
+            "event_id": "$%d:blue" % (self.event_id,),
+            "room_id": ROOM_ID,
+            "depth": self.event_id,
+            "origin_server_ts": self.event_id,
+            "prev_events": [],
+            "auth_events": [],
+            "prev_state": [],
+        })
+        self.event_id += 1
+
+        yield self.master_store.persist_event(event, EventContext())
@@ -117,12 +117,14 @@ class SlavedEventStoreTestCase(BaseSlavedStoreTestCase):
             stream_ordering=join.internal_metadata.stream_ordering,
         )])
         yield self.check("get_users_in_room", (ROOM_ID,), [USER_ID])
+        yield self.check("get_joined_hosts_for_room", (ROOM_ID,), {"blue"})
 
         # Leave the room.
         yield self.persist(type="m.room.member", key=USER_ID, membership="leave")
         yield self.replicate()
         yield self.check("get_rooms_for_user", (USER_ID,), [])
         yield self.check("get_users_in_room", (ROOM_ID,), [])
+        yield self.check("get_joined_hosts_for_room", (ROOM_ID,), set())
 
         # Add some other user to the room.
         join = yield self.persist(type="m.room.member", key=USER_ID_2, membership="join")
@@ -163,6 +165,37 @@ class SlavedEventStoreTestCase(BaseSlavedStoreTestCase):
             "get_latest_event_ids_in_room", (ROOM_ID,), [join.event_id]
         )
 
+    @defer.inlineCallbacks
+    def test_membership_changes_for_user(self):
+        yield self.persist(type="m.room.create", key="", creator=USER_ID)
+        yield self.replicate()
+        before = yield self.slaved_store.get_room_events_max_id()
+
+        yield self.persist(type="m.room.member", key=USER_ID, membership="join")
+        yield self.replicate()
+        after = yield self.slaved_store.get_room_events_max_id()
+
+        yield self.check(
+            "get_membership_changes_for_user", (USER_ID, before, after)
+        )
+        yield self.check(
+            "get_membership_changes_for_user", (USER_ID_2, before, after), []
+        )
+
+    @defer.inlineCallbacks
+    def test_get_recent_events_for_room(self):
+        yield self.persist(type="m.room.create", key="", creator=USER_ID)
+        yield self.persist(type="m.room.member", key=USER_ID, membership="join")
+        yield self.replicate()
+        token = yield self.slaved_store.get_room_events_max_id()
+        yield self.check("get_recent_events_for_room", (ROOM_ID, 10, token))
+
+        yield self.persist(type="m.room.message", msgtype="m.text", body="hi")
+        yield self.replicate()
+        token = yield self.slaved_store.get_room_events_max_id()
+        yield self.check("get_recent_events_for_room", (ROOM_ID, 10, token))
+        yield self.check("who_forgot_in_room", (ROOM_ID,), [])
+
     @defer.inlineCallbacks
     def test_get_current_state(self):
         # Create the room.
@@ -307,6 +340,61 @@ class SlavedEventStoreTestCase(BaseSlavedStoreTestCase):
             {"highlight_count": 1, "notify_count": 2}
         )
 
+    @defer.inlineCallbacks
+    def test_push_actions_added_after_persisting(self):
+        yield self.persist(type="m.room.create", creator=USER_ID)
+        yield self.persist(type="m.room.join", key=USER_ID, membership="join")
+        yield self.persist(
+            type="m.room.join", sender=USER_ID, key=USER_ID_2, membership="join"
+        )
+        event1 = yield self.persist(
+            type="m.room.message", msgtype="m.text", body="hello"
+        )
+        event2 = yield self.persist(
+            type="m.room.message", msgtype="m.text", body="world"
+        )
+        yield self.replicate()
+        yield self.check(
+            "get_unread_event_push_actions_by_room_for_user",
+            [ROOM_ID, USER_ID_2, event1.event_id],
+            {"highlight_count": 0, "notify_count": 0}
+        )
+
+        position = event2.internal_metadata.stream_ordering
+        yield self.master_store.add_push_actions_for_events(
+            [(event2, position, [(USER_ID_2, ["notify"])])], position,
+        )
+        self.assertEquals(
+            self.master_store.get_push_actions_stream_token(), position
+        )
+
+        yield self.replicate()
+        self.assertEquals(
+            self.slaved_store.get_push_actions_stream_token(), position
+        )
+        yield self.check(
+            "get_unread_event_push_actions_by_room_for_user",
+            [ROOM_ID, USER_ID_2, event1.event_id],
+            {"highlight_count": 0, "notify_count": 1}
+        )
+
+    @defer.inlineCallbacks
+    def test_warm_caches(self):
+        other_room_id = "!other:blue"
+        yield self.persist(type="m.room.create", key="", creator=USER_ID)
+        yield self.persist(type="m.room.member", key=USER_ID, membership="join")
+        yield self.persist(type="m.room.message", msgtype="m.text", body="hi")
+        yield self.persist(
+            room_id=other_room_id, type="m.room.create", key="", creator=USER_ID
+        )
+
+        yield self.replicate()
+
+        yield self.slaved_store.warm_caches(room_limit=1)
+        cache = self.slaved_store.get_users_in_room.cache
+        self.assertIsNotNone(cache.get((ROOM_ID,), None))
+        self.assertIsNone(cache.get((other_room_id,), None))
+
     event_id = 0
 
     @defer.inlineCallbacks
@@ -347,7 +435,6 @@ class SlavedEventStoreTestCase(BaseSlavedStoreTestCase):
         self.event_id += 1
 
         context = EventContext(current_state=state)
-        context.push_actions = push_actions
 
         ordering = None
         if backfill:
@@ -362,4 +449,9 @@ class SlavedEventStoreTestCase(BaseSlavedStoreTestCase):
         if ordering:
             event.internal_metadata.stream_ordering = ordering
 
+        if push_actions:
+            yield self.master_store.add_push_actions_for_events(
+                [(event, ordering, push_actions)], ordering
+            )
+
         defer.returnValue(event)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.replication.tcp import client
+from synapse.replication.tcp.client import ReplicationClientProtocol
+from synapse.replication.tcp.server import ReplicationStreamProtocolFactory
+from synapse.util.async import Linearizer
+
+from twisted.internet import defer
+from twisted.test import proto_helpers
+from tests import unittest
+from tests.utils import setup_test_homeserver, MockClock
+from mock import Mock, NonCallableMock, patch
+
+import json
+
+USER_ID = "@feeling:blue"
+TYPE = "my.type"
+
+
+class _Transport(proto_helpers.StringTransport):
+    """A StringTransport that fires a deferred when something is written."""
+
+    def __init__(self):
+        proto_helpers.StringTransport.__init__(self)
+        self.written = None
+
+    def wait_for_write(self):
+        self.clear()
+        self.written = defer.Deferred()
+        return self.written
+
+    def write(self, data):
+        proto_helpers.StringTransport.write(self, data)
+        written, self.written = self.written, None
+        if written is not None:
+            written.callback(data)
+
+    def writeSequence(self, data):
+        self.write("".join(data))
+
+
+class ReplicationStreamProtocolTestCase(unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.hs = yield setup_test_homeserver(
+            "blue",
+            http_client=None,
+            replication_layer=Mock(),
+            ratelimiter=NonCallableMock(spec_set=[
+                "send_message",
+            ]),
+        )
+        self.store = self.hs.get_datastore()
+        self.clock = self.hs.get_clock()
+
+        factory = ReplicationStreamProtocolFactory(self.hs)
+        self.protocol = factory.buildProtocol(None)
+        self.transport = _Transport()
+        self.protocol.makeConnection(self.transport)
+
+    def tearDown(self):
+        self.protocol.connectionLost(None)
+
+    def test_server_name(self):
+        self.assertEquals(self.transport.value(), "SERVER blue\n")
+
+    @defer.inlineCallbacks
+    def test_replicate(self):
+        yield self.store.add_account_data_for_user(USER_ID, TYPE, {"a": 1})
+
+        written = self.transport.wait_for_write()
+        self.protocol.lineReceived("NAME test")
+        self.protocol.lineReceived(
+            "REPLICATE " + json.dumps({"user_account_data": 0})
+        )
+        command, result = self.parse((yield written))
+        self.assertEquals(command, "RDATA")
+        first_position = result["user_account_data"]["position"]
+        self.assertEquals(
+            result["user_account_data"]["rows"],
+            [[first_position, USER_ID, TYPE, '{"a":1}']],
+        )
+
+        # Only the rows after what has already been sent are pushed.
+        written = self.transport.wait_for_write()
+        yield self.store.add_account_data_for_user(USER_ID, TYPE, {"a": 2})
+        self.hs.get_notifier().notify_replication()
+        command, result = self.parse((yield written))
+        self.assertEquals(command, "RDATA")
+        rows = result["user_account_data"]["rows"]
+        self.assertEquals(len(rows), 1)
+        self.assertTrue(rows[0][0] > first_position)
+
+    @defer.inlineCallbacks
+    def test_ping(self):
+        written = self.transport.wait_for_write()
+        self.protocol.lineReceived(
+            "REPLICATE " + json.dumps({"user_account_data": 0})
+        )
+        # Let the empty replication run before timing it out.
+        yield self.store.get_max_account_data_stream_id()
+        self.clock.advance_time_msec(5 * 1000)
+        command, _ = self.parse((yield written))
+        self.assertEquals(command, "PING")
+
+    def test_unknown_command(self):
+        self.transport.clear()
+        self.protocol.lineReceived("WIBBLE")
+        command, _ = self.parse(self.transport.value())
+        self.assertEquals(command, "ERROR")
+        self.assertTrue(self.transport.disconnecting)
+
+    def parse(self, data):
+        command, _, arg = data.rstrip("\n").partition(" ")
+        if command == "RDATA":
+            arg = json.loads(arg)
+        return command, arg
+
+
+class ReplicationClientProtocolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.processed = []
+
+        self.factory = Mock()
+        self.factory.clock = MockClock()
+        self.factory.client_name = "test"
+        self.factory.stream_positions.return_value = {"events": 3}
+        self.factory.process_replication.side_effect = self.process_replication
+        self.factory.linearizer = Linearizer()
+
+        self.protocol = ReplicationClientProtocol(self.factory)
+        self.transport = proto_helpers.StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def process_replication(self, result):
+        self.processed.append(result)
+        return defer.succeed(None)
+
+    def test_subscribe(self):
+        self.assertEquals(
+            self.transport.value().split("\n"),
+            ["NAME test", 'REPLICATE {"events":3}', ""],
+        )
+
+    def test_rdata(self):
+        self.protocol.lineReceived("PING 1000")
+        self.protocol.lineReceived("RDATA " + json.dumps({"events": {}}))
+        self.protocol.lineReceived("RDATA " + json.dumps({"receipts": {}}))
+        self.assertEquals(self.processed, [{"events": {}}, {"receipts": {}}])
+
+    def test_failure_stops_processing(self):
+        self.factory.process_replication.side_effect = Exception("Failed")
+        self.protocol.lineReceived("RDATA " + json.dumps({"events": {}}))
+        self.assertTrue(self.transport.disconnecting)
+
+        self.factory.process_replication.side_effect = self.process_replication
+        self.protocol.lineReceived("RDATA " + json.dumps({"receipts": {}}))
+        self.assertEquals(self.processed, [])
+
+    @patch.object(client, "MAX_PENDING_BATCHES", 2)
+    def test_pauses_when_behind(self):
+        processing = defer.Deferred()
+        self.factory.process_replication.side_effect = lambda result: processing
+
+        self.protocol.lineReceived("RDATA " + json.dumps({"events": {}}))
+        self.assertEquals(self.transport.producerState, "producing")
+        self.protocol.lineReceived("RDATA " + json.dumps({"receipts": {}}))
+        self.assertEquals(self.transport.producerState, "paused")
+
+        # The pings stop while paused, which isn't a reason to reconnect.
+        self.factory.clock.advance_time_msec(60 * 1000)
+        self.assertFalse(self.transport.disconnecting)
+
+        processing.callback(None)
+        self.assertEquals(self.transport.producerState, "producing")
+        self.assertEquals(self.protocol.pending_batches, 0)
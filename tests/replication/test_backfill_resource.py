@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.replication.backfill_resource import BackfillResource
+
+from twisted.internet import defer
+from tests import unittest
+from tests.utils import MockClock
+from mock import Mock, NonCallableMock
+import json
+import contextlib
+import StringIO
+
+
+class BackfillResourceCase(unittest.TestCase):
+    def setUp(self):
+        self.federation_handler = Mock()
+
+        self.hs = Mock()
+        self.hs.version_string = "test"
+        self.hs.get_handlers.return_value.federation_handler = (
+            self.federation_handler
+        )
+        self.hs.get_clock.return_value = MockClock()
+
+    @defer.inlineCallbacks
+    def test_backfill(self):
+        self.federation_handler.maybe_backfill.return_value = defer.succeed(
+            True
+        )
+        resource = BackfillResource(self.hs)
+
+        request = NonCallableMock(spec_set=[
+            "write", "finish", "setResponseCode", "setHeader", "content",
+            "method", "processing", "code",
+        ])
+        request.method = "POST"
+        request.content = StringIO.StringIO(json.dumps({
+            "room_id": "!room:test", "current_depth": 10,
+        }))
+
+        @contextlib.contextmanager
+        def processing():
+            yield
+        request.processing = processing
+
+        yield resource._async_render_POST(request)
+
+        self.federation_handler.maybe_backfill.assert_called_once_with(
+            "!room:test", 10
+        )
+        self.assertTrue(request.finish.called)
+        self.assertEquals(request.setResponseCode.call_args[0][0], 200)
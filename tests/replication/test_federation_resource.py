@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.api.errors import SynapseError
+from synapse.replication.federation_resource import (
+    FederationQueryResource, FederationSendResource,
+)
+
+from twisted.internet import defer
+from tests import unittest
+from tests.utils import MockClock
+from mock import Mock, NonCallableMock
+import json
+import contextlib
+import StringIO
+
+
+class FederationResourceCase(unittest.TestCase):
+    def setUp(self):
+        self.federation = Mock()
+
+        self.hs = Mock()
+        self.hs.version_string = "test"
+        self.hs.get_replication_layer.return_value = self.federation
+        self.hs.get_clock.return_value = MockClock()
+
+    @defer.inlineCallbacks
+    def test_send_transaction(self):
+        self.federation.on_incoming_transaction.return_value = defer.succeed(
+            (200, {"pdus": {}})
+        )
+        resource = FederationSendResource(self.hs)
+
+        transaction = {"origin": "remote", "pdus": [], "transaction_id": "1"}
+        body = yield self.post(resource, {"transaction": transaction})
+
+        self.federation.on_incoming_transaction.assert_called_once_with(
+            transaction
+        )
+        self.assertEquals(body, {"code": 200, "response": {"pdus": {}}})
+
+    @defer.inlineCallbacks
+    def test_query_error_is_returned(self):
+        self.federation.on_query_request.return_value = defer.fail(
+            SynapseError(404, "Room alias not found")
+        )
+        resource = FederationQueryResource(self.hs)
+
+        body = yield self.post(resource, {
+            "query_type": "directory",
+            "args": {"room_alias": "#a:test"},
+        })
+
+        self.federation.on_query_request.assert_called_once_with(
+            "directory", {"room_alias": "#a:test"}
+        )
+        self.assertEquals(body["code"], 404)
+        self.assertEquals(body["response"]["error"], "Room alias not found")
+
+    @defer.inlineCallbacks
+    def post(self, resource, content):
+        request = NonCallableMock(spec_set=[
+            "write", "finish", "setResponseCode", "setHeader", "content",
+            "method", "processing", "code",
+        ])
+
+        request.method = "POST"
+        request.content = StringIO.StringIO(json.dumps(content))
+
+        @contextlib.contextmanager
+        def processing():
+            yield
+        request.processing = processing
+
+        yield resource._async_render_POST(request)
+        self.assertTrue(request.finish.called)
+
+        self.assertEquals(request.setResponseCode.call_args[0][0], 200)
+
+        response_json = "".join(
+            call[0][0] for call in request.write.call_args_list
+        )
+        defer.returnValue(json.loads(response_json))
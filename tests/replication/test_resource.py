@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from synapse.federation.units import Edu
 from synapse.replication.resource import ReplicationResource
 from synapse.types import Requester, UserID
 
@@ -116,11 +117,77 @@ class ReplicationResourceCase(unittest.TestCase):
             "position", "room_id", "receipt_type", "user_id", "event_id", "data"
         ])
 
-    def _test_timeout(stream):
+    @defer.inlineCallbacks
+    def test_federation(self):
+        self.hs.config.send_federation = False
+        self.resource = ReplicationResource(self.hs)
+
+        get = self.get(federation="-1")
+        self.hs.get_federation_sender().enqueue_edu(Edu(
+            origin="red", destination="remote", edu_type="m.typing",
+            content={},
+        ))
+        code, body = yield get
+        self.assertEquals(code, 200)
+        self.assertEquals(body["federation"]["field_names"], [
+            "position", "type", "content"
+        ])
+        self.assertEquals(body["federation"]["rows"][0][1], "edu")
+
+    @defer.inlineCallbacks
+    def test_push_actions(self):
+        room_id = yield self.create_room()
+        bob = UserID.from_string("@bob:red")
+        handlers = self.hs.get_handlers()
+        for requester, membership in ((self.user, "invite"), (bob, "join")):
+            yield handlers.room_member_handler.update_membership(
+                Requester(requester, "", False), bob, room_id, membership,
+            )
+        event_id = yield self.send_text_message(room_id, "Hello, World")
+        yield handlers.receipts_handler.received_client_receipt(
+            room_id, "m.read", bob.to_string(), event_id
+        )
+
+        # Users get push actions once they have sent a read receipt.
+        position = self.hs.get_datastore().get_push_actions_stream_token()
+        get = self.get(push_actions=str(position))
+        yield self.send_text_message(room_id, "Hello, Bob")
+        code, body = yield get
+        # Earlier events without any push actions may move the position first.
+        while not body["push_actions"]["rows"]:
+            code, body = yield self.get(
+                push_actions=str(body["push_actions"]["position"])
+            )
+        self.assertEquals(code, 200)
+        self.assertEquals(body["push_actions"]["field_names"], [
+            "position", "room_id", "user_id"
+        ])
+        self.assertEquals(
+            set(tuple(row[1:]) for row in body["push_actions"]["rows"]),
+            {(room_id, bob.to_string())},
+        )
+
+    @defer.inlineCallbacks
+    def test_push_actions_position_without_rows(self):
+        room_id = yield self.create_room()
+        position = self.hs.get_datastore().get_push_actions_stream_token()
+        get = self.get(push_actions=str(position))
+        # Nobody gets push actions for their own messages.
+        yield self.send_text_message(room_id, "Hello, World")
+        code, body = yield get
+        self.assertEquals(code, 200)
+        self.assertEquals(body["push_actions"]["rows"], [])
+        self.assertEquals(
+            body["push_actions"]["position"],
+            self.hs.get_datastore().get_push_actions_stream_token(),
+        )
+        self.assertTrue(body["push_actions"]["position"] > position)
+
+    def _test_timeout(stream, position="-1"):
         """Check that a request for the given stream timesout"""
         @defer.inlineCallbacks
         def test_timeout(self):
-            get = self.get(**{stream: "-1", "timeout": "0"})
+            get = self.get(**{stream: position, "timeout": "0"})
             self.hs.clock.advance_time_msec(1)
             code, body = yield get
             self.assertEquals(code, 200)
@@ -139,6 +206,9 @@ class ReplicationResourceCase(unittest.TestCase):
     test_timeout_push_rules = _test_timeout("push_rules")
     test_timeout_pushers = _test_timeout("pushers")
     test_timeout_state = _test_timeout("state")
+    # The push actions position is sent even without any rows, so this has to
+    # start from the current position rather than before it.
+    test_timeout_push_actions = _test_timeout("push_actions", position="0")
 
     @defer.inlineCallbacks
     def send_text_message(self, room_id, message):
@@ -199,7 +269,10 @@ class ReplicationResourceCase(unittest.TestCase):
             self.assertIn("field_names", stream)
             field_names = stream["field_names"]
             self.assertIn("rows", stream)
-            self.assertTrue(stream["rows"])
+            if name != "push_actions":
+                # The push actions position moves even for events without
+                # any push actions, so it can be sent without any rows.
+                self.assertTrue(stream["rows"])
             for row in stream["rows"]:
                 self.assertEquals(
                     len(row), len(field_names),
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.replication.stream_buffer import StreamRowBuffer
+
+from twisted.internet import defer
+from tests import unittest
+
+
+class StreamRowBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        # A stream with a row at every position, and a secondary table with a
+        # row at every even position which is returned in descending order.
+        self.rows = [(position, "row%d" % position) for position in range(1, 21)]
+        self.fetches = []
+        self.pending = None
+        self.buffer = StreamRowBuffer(
+            "test_buffer", self.fetch, num_tables=2, descending_tables=(1,),
+            max_rows=10,
+        )
+
+    def fetch(self, from_position, to_position, limit):
+        self.fetches.append((from_position, to_position, limit))
+        rows = [
+            row for row in self.rows if from_position < row[0] <= to_position
+        ][:limit]
+        upper_bound = rows[-1][0] if len(rows) == limit else to_position
+        evens = [
+            row for row in reversed(self.rows)
+            if from_position < row[0] <= upper_bound and row[0] % 2 == 0
+        ]
+        if self.pending is not None:
+            return self.pending.addCallback(lambda _: (rows, evens))
+        return defer.succeed((rows, evens))
+
+    @defer.inlineCallbacks
+    def test_served_from_memory(self):
+        fetched = yield self.buffer.get_rows(0, 5, 100)
+        self.assertEquals(self.fetches, [(0, 5, 100)])
+
+        buffered = yield self.buffer.get_rows(0, 5, 100)
+        self.assertEquals(self.fetches, [(0, 5, 100)])
+        self.assertEquals(buffered, list(fetched))
+
+        rows, evens = yield self.buffer.get_rows(2, 5, 2)
+        self.assertEquals(self.fetches, [(0, 5, 100)])
+        self.assertEquals(rows, self.rows[2:4])
+        self.assertEquals(evens, [(4, "row4")])
+
+    @defer.inlineCallbacks
+    def test_extended_by_later_rows(self):
+        yield self.buffer.get_rows(0, 5, 100)
+        yield self.buffer.get_rows(5, 8, 100)
+        self.assertEquals(self.fetches, [(0, 5, 100), (5, 8, 100)])
+
+        rows, evens = yield self.buffer.get_rows(3, 8, 100)
+        self.assertEquals(len(self.fetches), 2)
+        self.assertEquals(rows, self.rows[3:8])
+        self.assertEquals(evens, [(8, "row8"), (6, "row6"), (4, "row4")])
+
+    @defer.inlineCallbacks
+    def test_limited_fetch(self):
+        yield self.buffer.get_rows(0, 10, 4)
+        self.assertEquals((self.buffer.start, self.buffer.end), (0, 4))
+
+        # Asking for more than was fetched has to go to the database.
+        yield self.buffer.get_rows(0, 10, 100)
+        self.assertEquals(len(self.fetches), 2)
+
+    @defer.inlineCallbacks
+    def test_laggards_use_database(self):
+        yield self.buffer.get_rows(0, 15, 100)
+        # The ten most recent rows across both tables are kept.
+        self.assertEquals((self.buffer.start, self.buffer.end), (8, 15))
+        self.assertEquals(len(self.buffer), 10)
+
+        yield self.buffer.get_rows(9, 15, 100)
+        self.assertEquals(len(self.fetches), 1)
+
+        rows, evens = yield self.buffer.get_rows(2, 15, 100)
+        self.assertEquals(len(self.fetches), 2)
+        self.assertEquals(rows, self.rows[2:15])
+
+    @defer.inlineCallbacks
+    def test_concurrent_fetches(self):
+        self.pending = defer.Deferred()
+        first = self.buffer.get_rows(0, 5, 100)
+        second = self.buffer.get_rows(0, 5, 100)
+        self.pending.callback(None)
+
+        first = yield first
+        second = yield second
+        self.assertEquals(self.fetches, [(0, 5, 100)])
+        self.assertEquals(first, second)
+
+    @defer.inlineCallbacks
+    def test_bounded_across_tables(self):
+        # A single position with many rows in the secondary table, like a
+        # state group with a lot of state.
+        self.rows = [(1, "row1"), (2, "row2"), (3, "row3")]
+
+        def fetch(from_position, to_position, limit):
+            rows = [
+                row for row in self.rows if from_position < row[0] <= to_position
+            ]
+            state = [(2, "state%d" % i) for i in range(20)]
+            return defer.succeed((rows, state))
+
+        self.buffer.fetch = fetch
+        yield self.buffer.get_rows(0, 3, 100)
+        self.assertEquals((self.buffer.start, self.buffer.end), (2, 3))
+        self.assertEquals(len(self.buffer), 1)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.events import FrozenEvent
+from synapse.events.snapshot import EventContext
+
+from tests.utils import setup_test_homeserver
+
+from mock import Mock
+
+ROOM_ID = "!room:test"
+USER_ID = "@alice:test"
+READER_ID = "@bob:test"
+
+HIGHLIGHT = ["notify", {"set_tweak": "highlight", "value": True}]
+
+
+class EventPushActionsStoreTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(
+            resource_for_federation=Mock(),
+            http_client=None,
+        )
+
+        self.store = hs.get_datastore()
+        self.event_id = 0
+
+    @defer.inlineCallbacks
+    def persist(self, actions=None, event_type="m.room.message", **kwargs):
+        self.event_id += 1
+        event_dict = {
+            "type": event_type,
+            "sender": USER_ID,
+            "content": {"body": "Message %d" % (self.event_id,)},
+            "event_id": "$%d:test" % (self.event_id,),
+            "room_id": ROOM_ID,
+            "depth": self.event_id,
+            "origin_server_ts": self.event_id,
+            "prev_events": [],
+            "auth_events": [],
+        }
+        event_dict.update(kwargs)
+        event = FrozenEvent(event_dict)
+
+        ordering, _ = yield self.store.persist_event(
+            event, EventContext(current_state={})
+        )
+        if actions is not None:
+            yield self.store.add_push_actions_for_events(
+                [(event, ordering, [(READER_ID, actions)])], ordering
+            )
+        defer.returnValue(event)
+
+    def read(self, event):
+        return self.store.insert_receipt(
+            ROOM_ID, "m.read", READER_ID, [event.event_id], {}
+        )
+
+    @defer.inlineCallbacks
+    def assert_unread(self, receipt_event, notify_count, highlight_count):
+        self.store.get_unread_event_push_actions_by_room_for_user.invalidate_all()
+        counts = yield self.store.get_unread_event_push_actions_by_room_for_user(
+            ROOM_ID, READER_ID, receipt_event.event_id
+        )
+        self.assertEquals(counts, {
+            "notify_count": notify_count, "highlight_count": highlight_count,
+        })
+
+    def get_summary(self):
+        return self.store._simple_select_one(
+            table="event_push_summary",
+            keyvalues={"user_id": READER_ID, "room_id": ROOM_ID},
+            retcols=("event_id", "notif_count", "highlight_count"),
+            allow_none=True,
+        )
+
+    def count_push_actions(self):
+        return self.store._simple_select_one_onecol(
+            table="event_push_actions",
+            keyvalues={"user_id": READER_ID},
+            retcol="COUNT(*)",
+        )
+
+    @defer.inlineCallbacks
+    def test_counts_are_summarised(self):
+        event1 = yield self.persist(["notify"])
+        yield self.persist(["notify"])
+        yield self.persist(HIGHLIGHT)
+
+        # Without a receipt the push actions are counted.
+        yield self.assert_unread(event1, 2, 1)
+        summary = yield self.get_summary()
+        self.assertIsNone(summary)
+
+        yield self.read(event1)
+        summary = yield self.get_summary()
+        self.assertEquals(summary, {
+            "event_id": event1.event_id, "notif_count": 2, "highlight_count": 1,
+        })
+
+        # New push actions are added to the summary
+        event4 = yield self.persist(HIGHLIGHT)
+        yield self.assert_unread(event1, 3, 2)
+
+        yield self.read(event4)
+        yield self.assert_unread(event4, 0, 0)
+
+        yield self.persist(["notify"])
+        yield self.assert_unread(event4, 1, 0)
+
+    @defer.inlineCallbacks
+    def test_actions_before_receipt_are_not_counted(self):
+        event1 = yield self.persist(["notify"])
+        event2 = yield self.persist(["notify"])
+        yield self.read(event2)
+
+        # An event from before the receipt, e.g. from another server.
+        yield self.persist(["notify"], depth=event1.depth)
+        yield self.assert_unread(event2, 0, 0)
+
+    @defer.inlineCallbacks
+    def test_redaction_removes_from_summary(self):
+        event1 = yield self.persist(["notify"])
+        yield self.read(event1)
+        event2 = yield self.persist(HIGHLIGHT)
+        yield self.assert_unread(event1, 1, 1)
+
+        yield self.persist(event_type="m.room.redaction", redacts=event2.event_id)
+        yield self.assert_unread(event1, 0, 0)
+
+    @defer.inlineCallbacks
+    def test_prune_read_push_actions(self):
+        yield self.persist(["notify"])
+        event2 = yield self.persist(["notify"])
+        yield self.persist(HIGHLIGHT)
+
+        # The actions aren't pruned until there's a receipt.
+        yield self.store._prune_read_push_actions()
+        count = yield self.count_push_actions()
+        self.assertEquals(count, 3)
+
+        yield self.read(event2)
+        yield self.store._prune_read_push_actions()
+        count = yield self.count_push_actions()
+        self.assertEquals(count, 1)
+        yield self.assert_unread(event2, 1, 1)
+
+    @defer.inlineCallbacks
+    def test_unread_notif_counts_for_user(self):
+        event1 = yield self.persist(["notify"])
+        counts = yield self.store.get_unread_notif_counts_for_user(READER_ID)
+        self.assertEquals(counts, {})
+
+        yield self.read(event1)
+        counts = yield self.store.get_unread_notif_counts_for_user(READER_ID)
+        self.assertEquals(counts, {ROOM_ID: 0})
+
+        # The cached counts are invalidated by new push actions and receipts.
+        event2 = yield self.persist(["notify"])
+        yield self.persist(HIGHLIGHT)
+        counts = yield self.store.get_unread_notif_counts_for_user(READER_ID)
+        self.assertEquals(counts, {ROOM_ID: 2})
+
+        yield self.read(event2)
+        counts = yield self.store.get_unread_notif_counts_for_user(READER_ID)
+        self.assertEquals(counts, {ROOM_ID: 1})
+
+        # Without a summary for the receipt the push actions are counted.
+        yield self.store._simple_delete_one(
+            table="event_push_summary",
+            keyvalues={"user_id": READER_ID, "room_id": ROOM_ID},
+        )
+        self.store.get_unread_notif_counts_for_user.invalidate_all()
+        counts = yield self.store.get_unread_notif_counts_for_user(READER_ID)
+        self.assertEquals(counts, {ROOM_ID: 1})
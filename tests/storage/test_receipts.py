@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.events import FrozenEvent
+from synapse.events.snapshot import EventContext
+
+from tests.utils import setup_test_homeserver
+
+from mock import Mock
+
+ROOM_ID = "!room:test"
+USER_ID = "@alice:test"
+
+
+def _receipt(user_id, *event_ids):
+    return {
+        "room_id": ROOM_ID,
+        "receipt_type": "m.read",
+        "user_id": user_id,
+        "event_ids": list(event_ids),
+        "data": {},
+    }
+
+
+class ReceiptsStoreTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(
+            resource_for_federation=Mock(),
+            http_client=None,
+        )
+
+        self.store = hs.get_datastore()
+        self.event_id = 0
+
+    @defer.inlineCallbacks
+    def persist(self):
+        self.event_id += 1
+        event = FrozenEvent({
+            "type": "m.room.message",
+            "sender": USER_ID,
+            "content": {"body": "Message %d" % (self.event_id,)},
+            "event_id": "$%d:test" % (self.event_id,),
+            "room_id": ROOM_ID,
+            "depth": self.event_id,
+            "origin_server_ts": self.event_id,
+            "prev_events": [],
+            "auth_events": [],
+        })
+        yield self.store.persist_event(event, EventContext(current_state={}))
+        defer.returnValue(event.event_id)
+
+    @defer.inlineCallbacks
+    def get_receipts(self):
+        rows = yield self.store.get_all_updated_receipts(
+            0, self.store.get_max_receipt_stream_id()
+        )
+        defer.returnValue({row[3]: row[4] for row in rows})
+
+    @defer.inlineCallbacks
+    def test_insert_receipts(self):
+        event1 = yield self.persist()
+        event2 = yield self.persist()
+        yield self.store.insert_receipt(
+            ROOM_ID, "m.read", "@bob:test", [event2], {}
+        )
+
+        new_receipts, _, _ = yield self.store.insert_receipts([
+            _receipt("@alice:test", event1, event2),
+            # This is older than bob's existing receipt.
+            _receipt("@bob:test", event1),
+        ])
+        self.assertEquals(
+            [receipt["user_id"] for receipt in new_receipts], ["@alice:test"]
+        )
+
+        receipts = yield self.get_receipts()
+        self.assertEquals(receipts, {"@alice:test": event2, "@bob:test": event2})
+
+    @defer.inlineCallbacks
+    def test_insert_receipts_skips_unknown_events(self):
+        event1 = yield self.persist()
+
+        new_receipts, _, _ = yield self.store.insert_receipts([
+            _receipt("@alice:test", event1),
+            _receipt("@bob:test", "$unknown:test", "$other:test"),
+        ])
+        self.assertEquals(
+            [receipt["user_id"] for receipt in new_receipts], ["@alice:test"]
+        )
+
+        receipts = yield self.get_receipts()
+        self.assertEquals(receipts, {"@alice:test": event1})
+
+    @defer.inlineCallbacks
+    def test_get_linearized_receipts_for_rooms(self):
+        room_ids = ["!room%d:test" % (i,) for i in range(150)]
+        for room_id in room_ids:
+            yield self.store.insert_receipt(
+                room_id, "m.read", "@bob:remote", ["$event:test"], {}
+            )
+        from_key = self.store.get_max_receipt_stream_id()
+
+        # Fetching from the start returns the receipts for every room.
+        receipts = yield self.store.get_linearized_receipts_for_rooms(
+            room_ids, to_key=from_key
+        )
+        self.assertEquals(
+            sorted(receipt["room_id"] for receipt in receipts), sorted(room_ids)
+        )
+
+        yield self.store.insert_receipt(
+            room_ids[5], "m.read", "@bob:remote", ["$event2:test"], {}
+        )
+        to_key = self.store.get_max_receipt_stream_id()
+
+        # Only the rooms whose receipts have changed are looked up.
+        get_receipts = self.store._get_linearized_receipts_for_rooms
+        self.store._get_linearized_receipts_for_rooms = Mock(
+            side_effect=get_receipts
+        )
+        receipts = yield self.store.get_linearized_receipts_for_rooms(
+            room_ids, to_key=to_key, from_key=from_key
+        )
+        self.assertEquals(receipts, [{
+            "type": "m.receipt",
+            "room_id": room_ids[5],
+            "content": {"$event2:test": {"m.read": {"@bob:remote": {}}}},
+        }])
+        args, _ = self.store._get_linearized_receipts_for_rooms.call_args
+        self.assertEquals(args[0], set([room_ids[5]]))
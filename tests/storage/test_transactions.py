@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from tests.utils import setup_test_homeserver
+
+
+class FederationOutboxStoreTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver()
+
+        self.store = hs.get_datastore()
+
+    @defer.inlineCallbacks
+    def test_outbox_is_ordered_per_destination(self):
+        yield self.store.add_pdu_to_federation_outbox("$1:test", ["a", "b"])
+        yield self.store.add_pdu_to_federation_outbox("$2:test", ["a"])
+        yield self.store.add_pdu_to_federation_outbox("$3:test", ["a", "b"])
+
+        self.assertEquals(
+            ["$1:test", "$2:test", "$3:test"],
+            (yield self.store.get_federation_outbox("a", 10)),
+        )
+        self.assertEquals(
+            ["$1:test", "$3:test"],
+            (yield self.store.get_federation_outbox("b", 10)),
+        )
+        self.assertEquals(
+            ["$1:test", "$2:test"],
+            (yield self.store.get_federation_outbox("a", 2)),
+        )
+
+    @defer.inlineCallbacks
+    def test_delete_from_outbox(self):
+        yield self.store.add_pdu_to_federation_outbox("$1:test", ["a", "b"])
+        yield self.store.add_pdu_to_federation_outbox("$2:test", ["a"])
+
+        yield self.store.delete_from_federation_outbox("a", ["$1:test", "$2:test"])
+
+        self.assertEquals([], (yield self.store.get_federation_outbox("a", 10)))
+        self.assertEquals(
+            ["$1:test"], (yield self.store.get_federation_outbox("b", 10)),
+        )
+        self.assertEquals(
+            ["b"], (yield self.store.get_destinations_with_federation_outbox()),
+        )
+
+    @defer.inlineCallbacks
+    def test_federation_out_pos(self):
+        self.assertEquals(-1, (yield self.store.get_federation_out_pos()))
+
+        yield self.store.update_federation_out_pos(5)
+
+        self.assertEquals(5, (yield self.store.get_federation_out_pos()))
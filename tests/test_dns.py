@@ -19,9 +19,43 @@ from twisted.names import dns, error
 
 from mock import Mock
 
-from synapse.http.endpoint import resolve_service
+from synapse.http.endpoint import (
+    resolve_service, load_server_cache, persist_server_cache, _Server,
+    NEGATIVE_CACHE_SECONDS, PREFETCH_SECONDS,
+)
 
-from tests.utils import MockClock
+from tests.utils import MockClock, setup_test_homeserver
+
+
+class StubResolver(object):
+    """A resolver that answers from a dict of SRV targets and A records, and
+    which can be paused to hold queries in flight.
+    """
+
+    def __init__(self):
+        self.srv = {}
+        self.a = {}
+        self.service_lookups = []
+        self.paused = None
+
+    @defer.inlineCallbacks
+    def lookupService(self, name):
+        self.service_lookups.append(name)
+        if self.paused:
+            yield self.paused
+        if name not in self.srv:
+            raise error.DNSNameError()
+        target, port = self.srv[name]
+        defer.returnValue(([dns.RRHeader(
+            type=dns.SRV, ttl=3600,
+            payload=dns.Record_SRV(target=target, port=port),
+        )], None, None))
+
+    def lookupAddress(self, name):
+        return defer.succeed(([dns.RRHeader(
+            type=dns.A, ttl=3600,
+            payload=dns.Record_A(address=self.a[name]),
+        )], None, None))
 
 
 class DnsTestCase(unittest.TestCase):
@@ -136,10 +170,117 @@ class DnsTestCase(unittest.TestCase):
         service_name = "test_service.examle.com"
 
         cache = {}
+        negative_cache = {}
 
         servers = yield resolve_service(
-            service_name, dns_client=dns_client_mock, cache=cache
+            service_name, dns_client=dns_client_mock, cache=cache,
+            negative_cache=negative_cache,
         )
 
         self.assertEquals(len(servers), 0)
         self.assertEquals(len(cache), 0)
+        self.assertIn(service_name, negative_cache)
+
+
+class DnsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = MockClock()
+        self.resolver = StubResolver()
+        self.resolver.srv["_matrix._tcp.example.com"] = ("host.example.com", 8448)
+        self.resolver.a["host.example.com"] = "10.0.0.1"
+        self.cache = {}
+        self.negative_cache = {}
+
+    def resolve(self, service_name="_matrix._tcp.example.com"):
+        return resolve_service(
+            service_name, dns_client=self.resolver, cache=self.cache,
+            clock=self.clock, negative_cache=self.negative_cache,
+        )
+
+    @defer.inlineCallbacks
+    def test_negative_results_are_cached(self):
+        servers = yield self.resolve("_matrix._tcp.missing.com")
+        self.assertEquals(servers, [])
+        servers = yield self.resolve("_matrix._tcp.missing.com")
+        self.assertEquals(servers, [])
+        self.assertEquals(len(self.resolver.service_lookups), 1)
+
+        self.clock.advance_time(NEGATIVE_CACHE_SECONDS + 1)
+        yield self.resolve("_matrix._tcp.missing.com")
+        self.assertEquals(len(self.resolver.service_lookups), 2)
+
+    @defer.inlineCallbacks
+    def test_expired_negative_results_are_removed(self):
+        yield self.resolve("_matrix._tcp.missing1.com")
+        self.clock.advance_time(NEGATIVE_CACHE_SECONDS + 1)
+        yield self.resolve("_matrix._tcp.missing2.com")
+
+        self.assertEquals(
+            self.negative_cache.keys(), ["_matrix._tcp.missing2.com"],
+        )
+
+    @defer.inlineCallbacks
+    def test_refreshed_before_expiry(self):
+        servers = yield self.resolve()
+        self.assertEquals(servers[0].host, "10.0.0.1")
+
+        # Close to expiring the cached servers are returned straight away,
+        # while the record is looked up again in the background.
+        self.clock.advance_time(3600 - PREFETCH_SECONDS + 1)
+        self.resolver.a["host.example.com"] = "10.0.0.2"
+        self.resolver.paused = defer.Deferred()
+
+        servers = yield self.resolve()
+        self.assertEquals(servers[0].host, "10.0.0.1")
+        self.assertEquals(len(self.resolver.service_lookups), 2)
+
+        self.resolver.paused.callback(None)
+        servers = yield self.resolve()
+        self.assertEquals(servers[0].host, "10.0.0.2")
+        self.assertEquals(len(self.resolver.service_lookups), 2)
+
+    @defer.inlineCallbacks
+    def test_concurrent_lookups_share_query(self):
+        self.resolver.paused = defer.Deferred()
+
+        d1 = self.resolve()
+        d2 = self.resolve()
+        self.assertEquals(len(self.resolver.service_lookups), 1)
+
+        self.resolver.paused.callback(None)
+        servers1 = yield d1
+        servers2 = yield d2
+        self.assertEquals(servers1, servers2)
+        self.assertEquals(servers1[0].host, "10.0.0.1")
+
+    @defer.inlineCallbacks
+    def test_concurrent_lookups_with_different_caches(self):
+        self.resolver.paused = defer.Deferred()
+
+        d1 = self.resolve()
+        other_cache = {}
+        d2 = resolve_service(
+            "_matrix._tcp.example.com", dns_client=self.resolver,
+            cache=other_cache, clock=self.clock, negative_cache={},
+        )
+        self.assertEquals(len(self.resolver.service_lookups), 2)
+
+        self.resolver.paused.callback(None)
+        yield d1
+        yield d2
+        self.assertIn("_matrix._tcp.example.com", self.cache)
+        self.assertIn("_matrix._tcp.example.com", other_cache)
+
+    @defer.inlineCallbacks
+    def test_persisted(self):
+        hs = yield setup_test_homeserver()
+        store = hs.get_datastore()
+
+        server = _Server(
+            priority=10, weight=5, host="10.0.0.1", port=8448, expires=1000,
+        )
+        yield persist_server_cache(store, cache={"_matrix._tcp.a.com": [server]})
+
+        cache = {}
+        yield load_server_cache(store, cache=cache)
+        self.assertEquals(cache, {"_matrix._tcp.a.com": [server]})
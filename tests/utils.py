@@ -52,6 +52,7 @@ def setup_test_homeserver(name="test", datastore=None, config=None, **kargs):
         config.server_name = "server.under.test"
         config.trusted_third_party_id_servers = []
         config.room_invite_state_types = []
+        config.pusher_startup_concurrency = 10
 
     config.database_config = {"name": "sqlite3"}
 